@@ -201,7 +201,7 @@ _create_sassy_cron_ztf () {
   if [[ ${1} -eq 1 ]]; then
     write_yellow "DryRun> PGPASSWORD=${3} psql -h localhost -p 5432 -U ${2} -d ${2} -e -c \"DROP INDEX IF EXISTS sassy_cron_ztf_q3c_ang2ipix_idx;\""
     write_yellow "DryRun> PGPASSWORD=${3} psql -h localhost -p 5432 -U ${2} -d ${2} -e -c \"DROP TABLE IF EXISTS sassy_cron_ztf;\""
-    write_yellow "DryRun> PGPASSWORD=${3} psql -h localhost -p 5432 -U ${2} -d ${2} -e -c \"CREATE TABLE sassy_cron_ztf (zoid, zjd, zmagap, zmagpsf, zmagdiff, zfid, zdrb, zrb, zsid, zcandid, zssnamenr, zra, zdec) AS (SELECT DISTINCT \"objectId\", jd, magap, magpsf, magdiff, fid, drb, rb, id, alert_candid, ssnamenr, (CASE WHEN ST_X(ST_AsText(location)) < 0.0 THEN ST_X(ST_AsText(location))+360.0 ELSE ST_X(ST_AsText(location)) END), ST_Y(ST_AsText(location)) FROM alert WHERE ((\"objectId\" LIKE 'ZTF2') AND ssnamenr LIKE 'null' AND (jd BETWEEN ${6} AND ${4}) AND ((rb BETWEEN ${7} AND ${5}) AND (drb BETWEEN ${7} AND ${5}))));\""
+    write_yellow "DryRun> PGPASSWORD=${3} psql -h localhost -p 5432 -U ${2} -d ${2} -e -c \"CREATE TABLE sassy_cron_ztf (zoid, zjd, zmagap, zmagpsf, zmagdiff, zfid, zdrb, zrb, zsid, zcandid, zssnamenr, zra, zdec) AS (SELECT DISTINCT \"objectId\", jd, magap, magpsf, magdiff, fid, drb, rb, id, alert_candid, ssnamenr, ra, dec FROM alert WHERE ((\"objectId\" LIKE 'ZTF2') AND ssnamenr LIKE 'null' AND (jd BETWEEN ${6} AND ${4}) AND ((rb BETWEEN ${7} AND ${5}) AND (drb BETWEEN ${7} AND ${5}))));\""
     write_yellow "DryRun> PGPASSWORD=${3} psql -h localhost -p 5432 -U ${2} -d ${2} -e -c \"CREATE INDEX ON sassy_cron_ztf (q3c_ang2ipix(zra, zdec));\""
     write_yellow "DryRun> PGPASSWORD=${3} psql -h localhost -p 5432 -U ${2} -d ${2} -e -c \"CLUSTER sassy_cron_ztf_q3c_ang2ipix_idx ON sassy_cron_ztf;\""
     write_yellow "DryRun> PGPASSWORD=${3} psql -h localhost -p 5432 -U ${2} -d ${2} -e -c \"SELECT COUNT(*) FROM sassy_cron_ztf;\""
@@ -209,7 +209,7 @@ _create_sassy_cron_ztf () {
   else
     PGPASSWORD=${3} psql -h localhost -p 5432 -U ${2} -d ${2} -e -c "DROP INDEX IF EXISTS sassy_cron_ztf_q3c_ang2ipix_idx;" 2> /dev/null
     PGPASSWORD=${3} psql -h localhost -p 5432 -U ${2} -d ${2} -e -c "DROP TABLE IF EXISTS sassy_cron_ztf;" 2> /dev/null
-    PGPASSWORD=${3} psql -h localhost -p 5432 -U ${2} -d ${2} -e -c "CREATE TABLE sassy_cron_ztf (zoid, zjd, zmagap, zmagpsf, zmagdiff, zfid, zdrb, zrb, zsid, zcandid, zssnamenr, zra, zdec) AS (SELECT DISTINCT \"objectId\", jd, magap, magpsf, magdiff, fid, drb, rb, id, alert_candid, ssnamenr, (CASE WHEN ST_X(ST_AsText(location)) < 0.0 THEN ST_X(ST_AsText(location))+360.0 ELSE ST_X(ST_AsText(location)) END), ST_Y(ST_AsText(location)) FROM alert WHERE ((\"objectId\" LIKE '%ZTF2%') AND ssnamenr LIKE '%null%' AND (jd BETWEEN ${6} AND ${4}) AND ((rb BETWEEN ${7} AND ${5}) AND (drb BETWEEN ${7} AND ${5}))));"
+    PGPASSWORD=${3} psql -h localhost -p 5432 -U ${2} -d ${2} -e -c "CREATE TABLE sassy_cron_ztf (zoid, zjd, zmagap, zmagpsf, zmagdiff, zfid, zdrb, zrb, zsid, zcandid, zssnamenr, zra, zdec) AS (SELECT DISTINCT \"objectId\", jd, magap, magpsf, magdiff, fid, drb, rb, id, alert_candid, ssnamenr, ra, dec FROM alert WHERE ((\"objectId\" LIKE '%ZTF2%') AND ssnamenr LIKE '%null%' AND (jd BETWEEN ${6} AND ${4}) AND ((rb BETWEEN ${7} AND ${5}) AND (drb BETWEEN ${7} AND ${5}))));"
     PGPASSWORD=${3} psql -h localhost -p 5432 -U ${2} -d ${2} -e -c "CREATE INDEX ON sassy_cron_ztf (q3c_ang2ipix(zra, zdec));"
     PGPASSWORD=${3} psql -h localhost -p 5432 -U ${2} -d ${2} -e -c "CLUSTER sassy_cron_ztf_q3c_ang2ipix_idx ON sassy_cron_ztf;"
     PGPASSWORD=${3} psql -h localhost -p 5432 -U ${2} -d ${2} -e -c "SELECT COUNT(*) FROM sassy_cron_ztf;"
@@ -18,6 +18,9 @@
 HERE=${PWD}
 PARENT=$(dirname "${HERE}")
 default_archive_dir='/dataraid6/backups'
+default_workers=4
+default_batch_size=1000
+default_avro_dir=''
 
 
 # +
@@ -61,11 +64,14 @@ usage () {
   write_blue   "Update database from ZTF gzip file (pndaly@email.arizona.edu)"                                        2>&1
   write_blue   ""                                                                                                     2>&1
   write_green  "Use:"                                                                                                 2>&1
-  write_green  " %% bash $0 --date=<int> --archive-dir=<str> [--dry-run]"                                             2>&1
+  write_green  " %% bash $0 --date=<int> --archive-dir=<str> --avro-dir=<str> --workers=<int> --batch-size=<int> [--dry-run]" 2>&1
   write_green  ""                                                                                                     2>&1
   write_yellow "Input(s):"                                                                                            2>&1
   write_yellow "  --date=<int>         where <int> is of the form YYYYMMDD,           default=${today}"               2>&1
   write_yellow "  --archive-dir=<str>  where <str> is the (input) archive directory,  default=${default_archive_dir}" 2>&1
+  write_yellow "  --avro-dir=<str>     where <str> is the (output) avro directory,    default=none (not written)"     2>&1
+  write_yellow "  --workers=<int>      where <int> is the number of parser processes, default=${default_workers}"     2>&1
+  write_yellow "  --batch-size=<int>   where <int> is the number of alerts per write, default=${default_batch_size}"  2>&1
   write_yellow ""                                                                                                     2>&1
   write_cyan   "Input(s):"                                                                                            2>&1
   write_cyan   "  --dry-run            show (but do not execute) commands,            default=false"                  2>&1
@@ -86,6 +92,18 @@ while test $# -gt 0; do
       rs_archive_dir=$(echo $1 | cut -d'=' -f2)
       shift
       ;;
+    --avro-dir*|--AVRO-DIR*)
+      rs_avro_dir=$(echo $1 | cut -d'=' -f2)
+      shift
+      ;;
+    --workers*|--WORKERS*)
+      rs_workers=$(echo $1 | cut -d'=' -f2)
+      shift
+      ;;
+    --batch-size*|--BATCH-SIZE*)
+      rs_batch_size=$(echo $1 | cut -d'=' -f2)
+      shift
+      ;;
     --dry-run|--DRY-RUN)
       dry_run=1
       shift
@@ -113,6 +131,22 @@ if [[ -z ${rs_archive_dir} ]]; then
   rs_archive_dir=${default_archive_dir}
 fi
 
+if [[ -z ${rs_avro_dir} ]]; then
+  rs_avro_dir=${default_avro_dir}
+fi
+
+case ${rs_workers} in
+  ''|*[!0-9]*)
+    rs_workers=${default_workers}
+    ;;
+esac
+
+case ${rs_batch_size} in
+  ''|*[!0-9]*)
+    rs_batch_size=${default_batch_size}
+    ;;
+esac
+
 
 # +
 # check validity
@@ -127,6 +161,15 @@ if ! [[ -d ${rs_archive_dir} ]]; then
   exit 0
 fi
 
+rs_avro_opt=""
+if [[ ! -z ${rs_avro_dir} ]]; then
+  if ! [[ -d ${rs_avro_dir} ]]; then
+    write_red "<ERROR> directory (${rs_avro_dir}) does not exist... exiting"
+    exit 0
+  fi
+  rs_avro_opt="--archive-dir=${rs_avro_dir}"
+fi
+
 if [[ -f ${rs_archive_dir}/ztf_public_${rs_date}.tar.gz ]]; then
   if [[ $(stat --printf=%s ${rs_archive_dir}/ztf_public_${rs_date}.tar.gz) =~ ^[0-9]{3}$ ]]; then
     write_red "<ERROR> archive (${rs_archive_dir}/ztf_public_${rs_date}.tar.gz) < 1000 bytes ... not updating"
@@ -143,10 +186,10 @@ fi
 # +
 # execute (dry-run)
 # -
-write_blue "%% bash $0 --archive-dir=${rs_archive_dir} --date=${rs_date} --dry-run=${dry_run}"
+write_blue "%% bash $0 --archive-dir=${rs_archive_dir} --avro-dir=${rs_avro_dir} --date=${rs_date} --workers=${rs_workers} --batch-size=${rs_batch_size} --dry-run=${dry_run}"
 if [[ ${dry_run} -eq 1 ]]; then
   write_yellow "Dry-Run>> source ${PARENT}/etc/Sassy.sh ${PARENT}"
-  write_yellow "Dry-Run>> PYTHONPATH=${PARENT}:${PARENT}/src python3 ${PARENT}/src/ingest_from_gzip.py --file=${rs_archive_dir}/ztf_public_${rs_date}.tar.gz"
+  write_yellow "Dry-Run>> PYTHONPATH=${PARENT}:${PARENT}/src python3 ${PARENT}/src/ingest_from_gzip.py --file=${rs_archive_dir}/ztf_public_${rs_date}.tar.gz --workers=${rs_workers} --batch-size=${rs_batch_size} ${rs_avro_opt}"
 
 
 # +
@@ -155,8 +198,8 @@ if [[ ${dry_run} -eq 1 ]]; then
 else
   write_yellow "Executing>> source ${PARENT}/etc/Sassy.sh ${PARENT}"
   source ${PARENT}/etc/Sassy.sh ${PARENT}
-  write_yellow "Executing>> PYTHONPATH=${PARENT}:${PARENT}/src python3 ${PARENT}/src/ingest_from_gzip.py --file=${rs_archive_dir}/ztf_public_${rs_date}.tar.gz"
-  PYTHONPATH=${PARENT}:${PARENT}/src python3 ${PARENT}/src/ingest_from_gzip.py --file=${rs_archive_dir}/ztf_public_${rs_date}.tar.gz
+  write_yellow "Executing>> PYTHONPATH=${PARENT}:${PARENT}/src python3 ${PARENT}/src/ingest_from_gzip.py --file=${rs_archive_dir}/ztf_public_${rs_date}.tar.gz --workers=${rs_workers} --batch-size=${rs_batch_size} ${rs_avro_opt}"
+  PYTHONPATH=${PARENT}:${PARENT}/src python3 ${PARENT}/src/ingest_from_gzip.py --file=${rs_archive_dir}/ztf_public_${rs_date}.tar.gz --workers=${rs_workers} --batch-size=${rs_batch_size} ${rs_avro_opt}
 
 fi
 
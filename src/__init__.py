@@ -16,11 +16,16 @@ import os
 import hashlib
 import random
 
+from src.time_utils import isot_to_jd as _isot_to_jd
+from src.time_utils import jd_to_isot as _jd_to_isot
+
 
 # +
 # constant(s)
 # -
 ISO_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+MJD_EPOCH = datetime(1858, 11, 17)
+MJD_OFFSET = 2400000.5
 ISO_PATTERN = '[0-9]{4}-[0-9]{2}-[0-9]{2}[ T?][0-9]{2}:[0-9]{2}:[0-9]{2}.[0-9]{6}'
 ZTF_ZERO_NID = '2017-01-01T00:00:00.000000'
 ZTF_ZERO_POINTS = {1: 26.325, 2: 26.275, 3: 25.660}
@@ -56,25 +61,17 @@ def get_isot(ndays=0):
 # +
 # function: get_jd()
 # -
-# noinspection PyBroadException
 def get_jd(ndays=0):
     """ return date in jd format for any ndays offset """
-    try:
-        return Time(get_isot(ndays)).jd
-    except:
-        return math.nan
+    return _isot_to_jd(get_isot(ndays))
 
 
 # +
 # function: isot_to_jd()
 # -
-# noinspection PyBroadException
 def isot_to_jd(isot=''):
     """ returns jd from isot date string """
-    try:
-        return Time(isot).jd
-    except:
-        return math.nan
+    return _isot_to_jd(isot)
 
 
 # +
@@ -104,13 +101,21 @@ def nid_to_isot(nid=0):
 # +
 # function: jd_to_isot()
 # -
-# noinspection PyBroadException
 def jd_to_isot(jd=math.nan):
     """ return isot from jd """
+    return _jd_to_isot(jd)
+
+
+# +
+# function: jd_to_path()
+# -
+def jd_to_path(jd=None):
+    """ return 'YYYY/MM/DD/' (UTC) for a julian date without going through astropy """
     try:
-        return Time(jd, format='jd', precision=6).isot
-    except:
-        return None
+        _date = MJD_EPOCH + timedelta(days=float(jd) - MJD_OFFSET)
+    except (TypeError, ValueError, OverflowError):
+        return ''
+    return f'{_date.year:04d}/{_date.month:02d}/{_date.day:02d}/'
 
 
 # +
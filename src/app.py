@@ -26,11 +26,13 @@ except:
     sassy_bot_read = None
 
 from flask import Flask
+from flask import Response
 from flask import jsonify
 from flask import request
 from flask import render_template
 from flask import send_file
 from flask import send_from_directory
+from flask import stream_with_context
 from urllib.parse import urlencode
 from urllib.parse import parse_qsl
 
@@ -84,6 +86,29 @@ from src.models.ligo_q3c import ligo_q3c_get_text
 # noinspection PyUnresolvedReferences
 from src.models.psql import Psql
 
+# noinspection PyUnresolvedReferences
+from src.batch_queries import query_limits
+from src.batch_queries import run_queries
+
+# noinspection PyUnresolvedReferences
+from src.pagination import keyset_paginate
+
+# noinspection PyUnresolvedReferences
+from src.query_guard import QueryTooExpensive
+from src.query_guard import guard_page
+from src.query_guard import guard_query
+
+# noinspection PyUnresolvedReferences
+from src.response_cache import RESPONSE_CACHE
+from src.response_cache import request_wants_json
+
+# noinspection PyUnresolvedReferences
+from src.streaming import stream_format
+from src.streaming import stream_queries
+
+# noinspection PyUnresolvedReferences
+from src.table_stats import TABLE_STATS
+
 # noinspection PyUnresolvedReferences
 from src.models.tns import TnsRecord
 from src.models.tns import db as db_tns
@@ -95,10 +120,13 @@ from src.models.tns_q3c import tns_q3c_filters
 from src.models.tns_q3c import tns_q3c_get_text
 
 # noinspection PyUnresolvedReferences
+from src.models.ztf import ZTF_CUTOUTS
 from src.models.ztf import ZtfAlert
 from src.models.ztf import db as db_ztf
+from src.models.ztf import ztf_columns
 from src.models.ztf import ztf_filters
 from src.models.ztf import ztf_get_text
+from src.models.ztf import ztf_serialize_rows
 
 import glob
 import io
@@ -163,17 +191,48 @@ with app.app_context():
     db_ztf.init_app(app)
 
 
+# +
+# initialize table statistics (latest row, count and jd range served from memory)
+# -
+TABLE_STATS.register(db_glade, GladeRecord, GladeRecord.gwgc)
+TABLE_STATS.register(db_glade_q3c, GladeQ3cRecord, GladeQ3cRecord.gwgc)
+TABLE_STATS.register(db_gwgc, GwgcRecord, GwgcRecord.name)
+TABLE_STATS.register(db_gwgc_q3c, GwgcQ3cRecord, GwgcQ3cRecord.name)
+TABLE_STATS.register(db_ligo, LigoRecord, LigoRecord.name)
+TABLE_STATS.register(db_ligo_q3c, LigoQ3cRecord, LigoQ3cRecord.name)
+TABLE_STATS.register(db_sassy, SassyCron, SassyCron.zjd, SassyCron.zjd)
+TABLE_STATS.register(db_tns, TnsRecord, TnsRecord.tns_name)
+TABLE_STATS.register(db_tns_q3c, TnsQ3cRecord, TnsQ3cRecord.tns_name)
+TABLE_STATS.register(db_ztf, ZtfAlert, ZtfAlert.jd, ZtfAlert.jd)
+TABLE_STATS.subscribe(RESPONSE_CACHE.invalidate)
+
+
+# +
+# start the table statistics thread when the app first serves (not when imported by ingest)
+# -
+@app.before_first_request
+def _start_table_stats():
+    TABLE_STATS.start(app)
+
+
 # +
 # (hidden) function: _request_wants_json()
 # -
 def _request_wants_json():
-    if request.args.get('format', 'html', type=str) == 'json':
-        return True
-    else:
-        best = request.accept_mimetypes.best_match(['application/json', 'text/html'])
-        return best == 'application/json' and \
-            request.accept_mimetypes[best] > \
-            request.accept_mimetypes['text/html']
+    return request_wants_json()
+
+
+# +
+# (hidden) function: _query_too_expensive()
+# -
+@app.errorhandler(QueryTooExpensive)
+def _query_too_expensive(e=None):
+    logger.warning(f'route {request.path} refused, error={e}')
+    if _request_wants_json() or request.method == 'POST':
+        return jsonify(e.serialized()), 422
+    details = [{'format': '<query>', 'line': '', 'name': 'query', 'route': f'{request.path}', 'type': 'query cost',
+                'url': f'{request.url}', 'value': f'{e}'}]
+    return render_template('error.html', details=details), 422
 
 
 # +
@@ -235,22 +294,22 @@ def sassy_astronomical_elliptical():
             _dbh = db_glade_q3c
             _fil = glade_q3c_filters
             _rec = GladeQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.gwgc.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'gwgc_q3c':
             _dbh = db_gwgc_q3c
             _fil = gwgc_q3c_filters
             _rec = GwgcQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'ligo_q3c':
             _dbh = db_ligo_q3c
             _fil = ligo_q3c_filters
             _rec = LigoQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'tns_q3c':
             _dbh = db_tns_q3c
             _fil = tns_q3c_filters
             _rec = TnsQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.tns_name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
 
         query = _dbh.session.query(_rec)
         query = _fil(query, {"ellipse": f"{_ra},{_dec},{_maj},{_rat},{_pos}"})
@@ -313,22 +372,22 @@ def sassy_astronomical_radial():
             _dbh = db_glade_q3c
             _fil = glade_q3c_filters
             _rec = GladeQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.gwgc.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'gwgc_q3c':
             _dbh = db_gwgc_q3c
             _fil = gwgc_q3c_filters
             _rec = GwgcQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'ligo_q3c':
             _dbh = db_ligo_q3c
             _fil = ligo_q3c_filters
             _rec = LigoQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'tns_q3c':
             _dbh = db_tns_q3c
             _fil = tns_q3c_filters
             _rec = TnsQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.tns_name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
 
         query = _dbh.session.query(_rec)
         query = _fil(query, {"astrocone": f"{_nam},{_rad}"})
@@ -413,7 +472,6 @@ def cron_records():
     forwarded_ips = request.headers.getlist('X-Forwarded-For')
     client_ip = forwarded_ips[0].split(',')[0] if len(forwarded_ips) >= 1 else ''
     logger.info('incoming request', extra={'tags': {'requesting_ip': client_ip, 'request_args': request.args}})
-    page = request.args.get('page', 1, type=int)
 
     # set default(s)
     zjd_min, zjd_max, iso_min, iso_max = math.nan, -math.nan, '', ''
@@ -434,19 +492,13 @@ def cron_records():
         query = sassy_cron_filters(query, _args)
 
         # get latest alert
-        latest = db_sassy.session.query(SassyCron).order_by(SassyCron.zjd.desc()).first()
+        latest = TABLE_STATS.latest(SassyCron.__tablename__)
 
-        # paginate
-        paginator = query.paginate(page, RESULTS_PER_PAGE, True)
+        # paginate by keyset (?cursor=), the total is an estimate unless ?count=exact, the page and count are guarded
+        paginator = keyset_paginate(query, SassyCron, _args, 'zjd', 'ascending', RESULTS_PER_PAGE, route='sassy_cron')
 
         # set response dictionary
-        response = {
-            'total': paginator.total,
-            'pages': paginator.pages,
-            'has_next': paginator.has_next,
-            'has_prev': paginator.has_prev,
-            'results': SassyCron.serialize_list(paginator.items)
-        }
+        response = dict(paginator.serialized(), results=SassyCron.serialize_list(paginator.items))
         try:
             zjd_min = min([_k['zjd'] for _k in response['results']])
             zjd_max = max([_k['zjd'] for _k in response['results']])
@@ -460,26 +512,17 @@ def cron_records():
         # get search criteria
         searches = request.get_json().get('queries')
 
-        # initialize output(s)
-        search_results = []
-        total = 0
-
-        # iterate over searches
-        for search_args in searches:
-
-            # initialize result(s)
-            search_result = {}
-
-            # query database
-            query = db_sassy.session.query(SassyCron)
-            query = sassy_cron_filters(query, search_args)
+        # stream (?stream=ndjson|json) from a server-side cursor rather than build the response in memory
+        _stream = stream_format(request)
+        if _stream:
+            return stream_queries(db_sassy.session, SassyCron, sassy_cron_filters, searches, _stream,
+                                  route='sassy_cron')
 
-            # extract, transform and load (ETL) into result(s)
-            search_result['query'] = search_args
-            search_result['num_alerts'] = query.count()
-            search_result['results'] = SassyCron.serialize_list(query.all())
-            search_results.append(search_result)
-            total += search_result['num_alerts']
+        # run the searches concurrently (in request order) with a per-query statement timeout
+        _workers, _timeout_ms = query_limits(request.get_json())
+        search_results = run_queries(db_sassy.read_engine, SassyCron, sassy_cron_filters, searches,
+                                     _workers, _timeout_ms, route='sassy_cron')
+        total = sum([_r['num_alerts'] for _r in search_results])
 
         # set response dictionary
         response = {
@@ -492,10 +535,8 @@ def cron_records():
         return jsonify(response)
     else:
         _args = request.args.copy()
-        try:
-            _args.pop('page')
-        except:
-            pass
+        for _k in ['page', 'cursor']:
+            _args.pop(_k, None)
         arg_str = urlencode(_args)
         return render_template('sassy_cron.html', context=response, page=paginator.page, arg_str=arg_str, latest=latest,
                                iso_min=iso_min, iso_max=iso_max, zjd_min=zjd_min, zjd_max=zjd_max,
@@ -541,22 +582,22 @@ def sassy_digital_elliptical():
             _dbh = db_glade_q3c
             _fil = glade_q3c_filters
             _rec = GladeQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.gwgc.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'gwgc_q3c':
             _dbh = db_gwgc_q3c
             _fil = gwgc_q3c_filters
             _rec = GwgcQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'ligo_q3c':
             _dbh = db_ligo_q3c
             _fil = ligo_q3c_filters
             _rec = LigoQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'tns_q3c':
             _dbh = db_tns_q3c
             _fil = tns_q3c_filters
             _rec = TnsQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.tns_name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
 
         query = _dbh.session.query(_rec)
         query = _fil(query, {"ellipse": f"{_ra},{_dec},{_maj},{_rat},{_pos}"})
@@ -620,22 +661,22 @@ def sassy_digital_radial():
             _dbh = db_glade_q3c
             _fil = glade_q3c_filters
             _rec = GladeQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.gwgc.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'gwgc_q3c':
             _dbh = db_gwgc_q3c
             _fil = gwgc_q3c_filters
             _rec = GwgcQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'ligo_q3c':
             _dbh = db_ligo_q3c
             _fil = ligo_q3c_filters
             _rec = LigoQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'tns_q3c':
             _dbh = db_tns_q3c
             _fil = tns_q3c_filters
             _rec = TnsQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.tns_name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
 
         query = _dbh.session.query(_rec)
         query = _fil(query, {"cone": f"{_ra},{_dec},{_rad}"})
@@ -704,22 +745,22 @@ def sassy_sexagisimal_elliptical():
             _dbh = db_glade_q3c
             _fil = glade_q3c_filters
             _rec = GladeQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.gwgc.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'gwgc_q3c':
             _dbh = db_gwgc_q3c
             _fil = gwgc_q3c_filters
             _rec = GwgcQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'ligo_q3c':
             _dbh = db_ligo_q3c
             _fil = ligo_q3c_filters
             _rec = LigoQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'tns_q3c':
             _dbh = db_tns_q3c
             _fil = tns_q3c_filters
             _rec = TnsQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.tns_name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
 
         query = _dbh.session.query(_rec)
         query = _fil(query, {"ellipse": f"{_dra},{_ddec},{_maj},{_rat},{_pos}"})
@@ -786,22 +827,22 @@ def sassy_sexagisimal_radial():
             _dbh = db_glade_q3c
             _fil = glade_q3c_filters
             _rec = GladeQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.gwgc.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'gwgc_q3c':
             _dbh = db_gwgc_q3c
             _fil = gwgc_q3c_filters
             _rec = GwgcQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'ligo_q3c':
             _dbh = db_ligo_q3c
             _fil = ligo_q3c_filters
             _rec = LigoQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
         elif _cat == 'tns_q3c':
             _dbh = db_tns_q3c
             _fil = tns_q3c_filters
             _rec = TnsQ3cRecord
-            latest = _dbh.session.query(_rec).order_by(_rec.tns_name.desc()).first()
+            latest = TABLE_STATS.latest(_rec.__tablename__)
 
         query = _dbh.session.query(_rec)
         query = _fil(query, {"cone": f"{_dra},{_ddec},{_rad}"})
@@ -835,6 +876,7 @@ def sassy_sexagisimal_radial():
 # noinspection PyBroadException
 @app.route('/sassy/glade/', methods=['GET', 'POST'])
 @app.route('/glade/', methods=['GET', 'POST'])
+@RESPONSE_CACHE.cached('glade')
 def glade_records():
     logger.debug(f'route /sassy/glade/ entry')
 
@@ -842,7 +884,6 @@ def glade_records():
     forwarded_ips = request.headers.getlist('X-Forwarded-For')
     client_ip = forwarded_ips[0].split(',')[0] if len(forwarded_ips) >= 1 else ''
     logger.info('incoming request', extra={'tags': {'requesting_ip': client_ip, 'request_args': request.args}})
-    page = request.args.get('page', 1, type=int)
 
     # set default(s)
     paginator = None
@@ -862,19 +903,13 @@ def glade_records():
         query = glade_filters(query, _args)
 
         # get latest alert
-        latest = db_glade.session.query(GladeRecord).order_by(GladeRecord.gwgc.desc()).first()
+        latest = TABLE_STATS.latest(GladeRecord.__tablename__)
 
-        # paginate
-        paginator = query.paginate(page, RESULTS_PER_PAGE, True)
+        # paginate by keyset (?cursor=), the total is an estimate unless ?count=exact, the page and count are guarded
+        paginator = keyset_paginate(query, GladeRecord, _args, 'id', 'ascending', RESULTS_PER_PAGE, route='glade')
 
         # set response dictionary
-        response = {
-            'total': paginator.total,
-            'pages': paginator.pages,
-            'has_next': paginator.has_next,
-            'has_prev': paginator.has_prev,
-            'results': GladeRecord.serialize_list(paginator.items)
-        }
+        response = dict(paginator.serialized(), results=GladeRecord.serialize_list(paginator.items))
 
     # POST request
     if request.method == 'POST':
@@ -895,11 +930,14 @@ def glade_records():
             # query database
             query = db_glade.session.query(GladeRecord)
             query = glade_filters(query, search_args)
+            query, _warning = guard_query(query, 'glade', downgrade=True)
 
             # extract, transform and load (ETL) into result(s)
             search_result['query'] = search_args
             search_result['num_alerts'] = query.count()
             search_result['results'] = GladeRecord.serialize_list(query.all())
+            if _warning:
+                search_result['warning'] = _warning
             search_results.append(search_result)
             total += search_result['num_alerts']
 
@@ -914,10 +952,8 @@ def glade_records():
         return jsonify(response)
     else:
         _args = request.args.copy()
-        try:
-            _args.pop('page')
-        except:
-            pass
+        for _k in ['page', 'cursor']:
+            _args.pop(_k, None)
         arg_str = urlencode(_args)
         return render_template('glade.html', context=response, page=paginator.page, arg_str=arg_str, latest=latest,
                                url={'url': f'{SASSY_APP_URL}', 'page': 'glade'})
@@ -929,6 +965,7 @@ def glade_records():
 # noinspection PyShadowingBuiltins
 @app.route('/sassy/glade/<int:dbid>/')
 @app.route('/glade/<int:dbid>/')
+@RESPONSE_CACHE.cached('glade')
 def glade_detail(dbid=0):
     logger.debug(f'route /sassy/glade/{dbid}/ entry')
 
@@ -954,6 +991,7 @@ def glade_detail(dbid=0):
 # noinspection PyShadowingBuiltins
 @app.route('/sassy/glade/text/')
 @app.route('/glade/text/')
+@RESPONSE_CACHE.cached('glade')
 def glade_text():
     logger.debug(f'route /sassy/glade/text/ entry')
     return render_template('glade_text.html', text=glade_get_text())
@@ -965,6 +1003,7 @@ def glade_text():
 # noinspection PyBroadException
 @app.route('/sassy/glade_q3c/', methods=['GET', 'POST'])
 @app.route('/glade_q3c/', methods=['GET', 'POST'])
+@RESPONSE_CACHE.cached('glade_q3c')
 def glade_q3c_records():
     logger.debug(f'route /sassy/glade_q3c/ entry')
 
@@ -991,8 +1030,11 @@ def glade_q3c_records():
         query = db_glade_q3c.session.query(GladeQ3cRecord)
         query = glade_q3c_filters(query, _args)
 
+        # refuse a page (at its offset) or count the planner expects to be too expensive (raises QueryTooExpensive)
+        guard_page(query, 'glade_q3c', page, RESULTS_PER_PAGE, count=True)
+
         # get latest alert
-        latest = db_glade_q3c.session.query(GladeQ3cRecord).order_by(GladeQ3cRecord.gwgc.desc()).first()
+        latest = TABLE_STATS.latest(GladeQ3cRecord.__tablename__)
 
         # paginate
         paginator = query.paginate(page, RESULTS_PER_PAGE, True)
@@ -1025,11 +1067,14 @@ def glade_q3c_records():
             # query database
             query = db_glade_q3c.session.query(GladeQ3cRecord)
             query = glade_q3c_filters(query, search_args)
+            query, _warning = guard_query(query, 'glade_q3c', downgrade=True)
 
             # extract,transform and load (ETL) into result(s)
             search_result['query'] = search_args
             search_result['num_alerts'] = query.count()
             search_result['results'] = GladeQ3cRecord.serialize_list(query.all())
+            if _warning:
+                search_result['warning'] = _warning
             search_results.append(search_result)
             total += search_result['num_alerts']
 
@@ -1059,6 +1104,7 @@ def glade_q3c_records():
 # noinspection PyShadowingBuiltins
 @app.route('/sassy/glade_q3c/<int:dbid>/')
 @app.route('/glade_q3c/<int:dbid>/')
+@RESPONSE_CACHE.cached('glade_q3c')
 def glade_q3c_detail(dbid=0):
     logger.debug(f'route /sassy/glade_q3c/{dbid}/ entry')
 
@@ -1084,6 +1130,7 @@ def glade_q3c_detail(dbid=0):
 # noinspection PyShadowingBuiltins
 @app.route('/sassy/glade_q3c/text/')
 @app.route('/glade_q3c/text/')
+@RESPONSE_CACHE.cached('glade_q3c')
 def glade_q3c_text():
     logger.debug(f'route /sassy/glade_q3c/text/ entry')
     return render_template('glade_q3c_text.html', text=glade_q3c_get_text())
@@ -1095,6 +1142,7 @@ def glade_q3c_text():
 # noinspection PyBroadException
 @app.route('/sassy/gwgc/', methods=['GET', 'POST'])
 @app.route('/gwgc/', methods=['GET', 'POST'])
+@RESPONSE_CACHE.cached('gwgc')
 def gwgc_records():
     logger.debug(f'route /sassy/gwgc/ entry')
 
@@ -1122,8 +1170,11 @@ def gwgc_records():
         query = db_gwgc.session.query(GwgcRecord)
         query = gwgc_filters(query, _args)
 
+        # refuse a page (at its offset) or count the planner expects to be too expensive (raises QueryTooExpensive)
+        guard_page(query, 'gwgc', page, RESULTS_PER_PAGE, count=True)
+
         # get latest alert
-        latest = db_gwgc.session.query(GwgcRecord).order_by(GwgcRecord.name.desc()).first()
+        latest = TABLE_STATS.latest(GwgcRecord.__tablename__)
 
         # paginate
         paginator = query.paginate(page, RESULTS_PER_PAGE, True)
@@ -1158,11 +1209,14 @@ def gwgc_records():
             query = db_gwgc.session.query(GwgcRecord)
             logger.debug(f'route /sassy/gwgc/ search_args={search_args}')
             query = gwgc_filters(query, search_args)
+            query, _warning = guard_query(query, 'gwgc', downgrade=True)
 
             # extract,transform and load (ETL) into result(s)
             search_result['query'] = search_args
             search_result['num_alerts'] = query.count()
             search_result['results'] = GwgcRecord.serialize_list(query.all())
+            if _warning:
+                search_result['warning'] = _warning
             search_results.append(search_result)
             total += search_result['num_alerts']
 
@@ -1192,6 +1246,7 @@ def gwgc_records():
 # noinspection PyShadowingBuiltins
 @app.route('/sassy/gwgc/<int:dbid>/')
 @app.route('/gwgc/<int:dbid>/')
+@RESPONSE_CACHE.cached('gwgc')
 def gwgc_detail(dbid=0):
     logger.debug(f'route /sassy/gwgc/{dbid}/ entry')
 
@@ -1217,6 +1272,7 @@ def gwgc_detail(dbid=0):
 # noinspection PyShadowingBuiltins
 @app.route('/sassy/gwgc/text/')
 @app.route('/gwgc/text/')
+@RESPONSE_CACHE.cached('gwgc')
 def gwgc_text():
     logger.debug(f'route /sassy/gwgc/text/ entry')
     return render_template('gwgc_text.html', text=gwgc_get_text())
@@ -1228,6 +1284,7 @@ def gwgc_text():
 # noinspection PyBroadException
 @app.route('/sassy/gwgc_q3c/', methods=['GET', 'POST'])
 @app.route('/gwgc_q3c/', methods=['GET', 'POST'])
+@RESPONSE_CACHE.cached('gwgc_q3c')
 def gwgc_q3c_records():
     logger.debug(f'route /sassy/gwgc_q3c/ entry')
 
@@ -1254,8 +1311,11 @@ def gwgc_q3c_records():
         query = db_gwgc_q3c.session.query(GwgcQ3cRecord)
         query = gwgc_q3c_filters(query, _args)
 
+        # refuse a page (at its offset) or count the planner expects to be too expensive (raises QueryTooExpensive)
+        guard_page(query, 'gwgc_q3c', page, RESULTS_PER_PAGE, count=True)
+
         # get latest alert
-        latest = db_gwgc_q3c.session.query(GwgcQ3cRecord).order_by(GwgcQ3cRecord.name.desc()).first()
+        latest = TABLE_STATS.latest(GwgcQ3cRecord.__tablename__)
 
         # paginate
         paginator = query.paginate(page, RESULTS_PER_PAGE, True)
@@ -1288,11 +1348,14 @@ def gwgc_q3c_records():
             # query database
             query = db_gwgc_q3c.session.query(GwgcQ3cRecord)
             query = gwgc_q3c_filters(query, search_args)
+            query, _warning = guard_query(query, 'gwgc_q3c', downgrade=True)
 
             # extract,transform and load (ETL) into result(s)
             search_result['query'] = search_args
             search_result['num_alerts'] = query.count()
             search_result['results'] = GwgcQ3cRecord.serialize_list(query.all())
+            if _warning:
+                search_result['warning'] = _warning
             search_results.append(search_result)
             total += search_result['num_alerts']
 
@@ -1322,6 +1385,7 @@ def gwgc_q3c_records():
 # noinspection PyShadowingBuiltins
 @app.route('/sassy/gwgc_q3c/<int:dbid>/')
 @app.route('/gwgc_q3c/<int:dbid>/')
+@RESPONSE_CACHE.cached('gwgc_q3c')
 def gwgc_q3c_detail(dbid=0):
     logger.debug(f'route /sassy/gwgc_q3c/{dbid}/ entry')
 
@@ -1347,6 +1411,7 @@ def gwgc_q3c_detail(dbid=0):
 # noinspection PyShadowingBuiltins
 @app.route('/sassy/gwgc_q3c/text/')
 @app.route('/gwgc_q3c/text/')
+@RESPONSE_CACHE.cached('gwgc_q3c')
 def gwgc_q3c_text():
     logger.debug(f'route /sassy/gwgc_q3c/text/ entry')
     return render_template('gwgc_q3c_text.html', text=gwgc_q3c_get_text())
@@ -1368,6 +1433,7 @@ def sassy_help():
 # noinspection PyBroadException
 @app.route('/sassy/ligo/', methods=['GET', 'POST'])
 @app.route('/ligo/', methods=['GET', 'POST'])
+@RESPONSE_CACHE.cached('ligo')
 def ligo_records():
     logger.debug(f'route /sassy/ligo/ entry')
 
@@ -1394,8 +1460,11 @@ def ligo_records():
         query = db_ligo.session.query(LigoRecord)
         query = ligo_filters(query, _args)
 
+        # refuse a page (at its offset) or count the planner expects to be too expensive (raises QueryTooExpensive)
+        guard_page(query, 'ligo', page, RESULTS_PER_PAGE, count=True)
+
         # get latest alert
-        latest = db_ligo.session.query(LigoRecord).order_by(LigoRecord.name.desc()).first()
+        latest = TABLE_STATS.latest(LigoRecord.__tablename__)
 
         # paginate
         paginator = query.paginate(page, RESULTS_PER_PAGE, True)
@@ -1429,11 +1498,14 @@ def ligo_records():
             # query database
             query = db_ligo.session.query(LigoRecord)
             query = ligo_filters(query, search_args)
+            query, _warning = guard_query(query, 'ligo', downgrade=True)
 
             # extract,transform and load (ETL) into result(s)
             search_result['query'] = search_args
             search_result['num_alerts'] = query.count()
             search_result['results'] = LigoRecord.serialize_list(query.all())
+            if _warning:
+                search_result['warning'] = _warning
             search_results.append(search_result)
             total += search_result['num_alerts']
 
@@ -1463,6 +1535,7 @@ def ligo_records():
 # noinspection PyShadowingBuiltins
 @app.route('/sassy/ligo/<int:dbid>/')
 @app.route('/ligo/<int:dbid>/')
+@RESPONSE_CACHE.cached('ligo')
 def ligo_detail(dbid=0):
     logger.debug(f'route /sassy/ligo/{dbid}/ entry')
 
@@ -1487,6 +1560,7 @@ def ligo_detail(dbid=0):
 # -
 @app.route('/sassy/ligo/text/')
 @app.route('/ligo/text/')
+@RESPONSE_CACHE.cached('ligo')
 def ligo_text():
     logger.debug(f'route /sassy/ligo/text/ entry')
     return render_template('ligo_text.html', text=ligo_get_text())
@@ -1498,6 +1572,7 @@ def ligo_text():
 # noinspection PyBroadException
 @app.route('/sassy/ligo_q3c/', methods=['GET', 'POST'])
 @app.route('/ligo_q3c/', methods=['GET', 'POST'])
+@RESPONSE_CACHE.cached('ligo_q3c')
 def ligo_q3c_records():
     logger.debug(f'route /sassy/ligo_q3c/ entry')
 
@@ -1524,8 +1599,11 @@ def ligo_q3c_records():
         query = db_ligo_q3c.session.query(LigoQ3cRecord)
         query = ligo_q3c_filters(query, _args)
 
+        # refuse a page (at its offset) or count the planner expects to be too expensive (raises QueryTooExpensive)
+        guard_page(query, 'ligo_q3c', page, RESULTS_PER_PAGE, count=True)
+
         # get latest alert
-        latest = db_ligo_q3c.session.query(LigoQ3cRecord).order_by(LigoQ3cRecord.name.desc()).first()
+        latest = TABLE_STATS.latest(LigoQ3cRecord.__tablename__)
 
         # paginate
         paginator = query.paginate(page, RESULTS_PER_PAGE, True)
@@ -1559,11 +1637,14 @@ def ligo_q3c_records():
             # query database
             query = db_ligo_q3c.session.query(LigoQ3cRecord)
             query = ligo_q3c_filters(query, search_args)
+            query, _warning = guard_query(query, 'ligo_q3c', downgrade=True)
 
             # extract,transform and load (ETL) into result(s)
             search_result['query'] = search_args
             search_result['num_alerts'] = query.count()
             search_result['results'] = LigoQ3cRecord.serialize_list(query.all())
+            if _warning:
+                search_result['warning'] = _warning
             search_results.append(search_result)
             total += search_result['num_alerts']
 
@@ -1593,6 +1674,7 @@ def ligo_q3c_records():
 # noinspection PyShadowingBuiltins
 @app.route('/sassy/ligo_q3c/<int:dbid>/')
 @app.route('/ligo_q3c/<int:dbid>/')
+@RESPONSE_CACHE.cached('ligo_q3c')
 def ligo_q3c_detail(dbid=0):
     logger.debug(f'route /sassy/ligo_q3c/{dbid}/ entry')
 
@@ -1617,6 +1699,7 @@ def ligo_q3c_detail(dbid=0):
 # -
 @app.route('/sassy/ligo_q3c/text/')
 @app.route('/ligo_q3c/text/')
+@RESPONSE_CACHE.cached('ligo_q3c')
 def ligo_q3c_text():
     logger.debug(f'route /sassy/ligo_q3c/text/ entry')
     return render_template('ligo_q3c_text.html', text=ligo_q3c_get_text())
@@ -2163,38 +2246,33 @@ def plot_finder(img=''):
 def psql_query():
     logger.debug(f'route /sassy/psql/ entry')
 
-    # connect to database
-    db_psql = None
-    try:
-        db_psql = Psql(f'{SASSY_DB_USER}:{SASSY_DB_PASS}', f'{SASSY_DB_NAME}',
-                       int(f'{SASSY_DB_PORT}'), f'{SASSY_DB_HOST}', logger)
-        db_psql.connect()
-    except Exception as e:
-        logger.error(f'failed connecting via Psql({PSQL_CONNECT_MSG}), error={e}')
-
     # build form
     form = PsqlQueryForm()
 
     # validate form (POST request)
-    search_results = []
     if form.validate_on_submit():
 
         # get data
         _sql_query = form.sql_query.data
         logger.debug(f'query=\"{_sql_query}\"')
 
-        # execute query
-        if db_psql and hasattr(db_psql, 'fetchall'):
-            _results = db_psql.fetchall(_sql_query)
-            logger.debug(f'_results={_results}')
-            for _e in _results:
-                search_results.append(_e)
-
-        response = {
-            'total': len(search_results),
-            'results': search_results
-        }
-        return render_template('psql_query_results.html', context=response)
+        # borrow a pooled, read-only connection (only now that there is a query to run)
+        db_psql = Psql(f'{SASSY_DB_USER}:{SASSY_DB_PASS}', f'{SASSY_DB_NAME}',
+                       int(f'{SASSY_DB_PORT}'), f'{SASSY_DB_HOST}', logger)
+        db_psql.connect()
+        if db_psql.error is not None:
+            logger.error(f'failed connecting via Psql({PSQL_CONNECT_MSG}), error={db_psql.error}')
+
+        # render the rows as they come off the server-side cursor, then give the connection back
+        def _generate():
+            try:
+                _context = {'context': {'results': db_psql.iterrows(_sql_query), 'limit': db_psql.limit},
+                            'psql': db_psql}
+                app.update_template_context(_context)
+                yield from app.jinja_env.get_template('psql_query_results.html').generate(_context)
+            finally:
+                db_psql.disconnect()
+        return Response(stream_with_context(_generate()))
 
     # return for GET
     return render_template('psql_query.html', form=form)
@@ -2300,6 +2378,7 @@ def sassy_cron_page(oid=''):
 # noinspection PyBroadException
 @app.route('/sassy/tns/', methods=['GET', 'POST'])
 @app.route('/tns/', methods=['GET', 'POST'])
+@RESPONSE_CACHE.cached('tns')
 def tns_records():
     logger.debug(f'route /sassy/tns/ entry')
 
@@ -2307,7 +2386,6 @@ def tns_records():
     forwarded_ips = request.headers.getlist('X-Forwarded-For')
     client_ip = forwarded_ips[0].split(',')[0] if len(forwarded_ips) >= 1 else ''
     logger.info('incoming request', extra={'tags': {'requesting_ip': client_ip, 'request_args': request.args}})
-    page = request.args.get('page', 1, type=int)
     response = {}
 
     # set default(s)
@@ -2327,19 +2405,14 @@ def tns_records():
         query = tns_filters(query, _args)
 
         # get latest alert
-        latest = db_tns.session.query(TnsRecord).order_by(TnsRecord.tns_name.desc()).first()
+        latest = TABLE_STATS.latest(TnsRecord.__tablename__)
 
-        # paginate
-        paginator = query.paginate(page, RESULTS_PER_PAGE, True)
+        # paginate by keyset (?cursor=), the total is an estimate unless ?count=exact, the page and count are guarded
+        paginator = keyset_paginate(query, TnsRecord, _args, 'discovery_date', 'descending', RESULTS_PER_PAGE,
+                                    route='tns')
 
         # set response dictionary
-        response = {
-            'total': paginator.total,
-            'pages': paginator.pages,
-            'has_next': paginator.has_next,
-            'has_prev': paginator.has_prev,
-            'results': TnsRecord.serialize_list(paginator.items)
-        }
+        response = dict(paginator.serialized(), results=TnsRecord.serialize_list(paginator.items))
         logger.debug(f'response={response}')
 
     # POST request
@@ -2361,11 +2434,14 @@ def tns_records():
             # query database
             query = db_tns.session.query(TnsRecord)
             query = tns_filters(query, search_args)
+            query, _warning = guard_query(query, 'tns', downgrade=True)
 
             # extract,transform and load (ETL) into result(s)
             search_result['query'] = search_args
             search_result['num_alerts'] = query.count()
             search_result['results'] = TnsRecord.serialize_list(query.all())
+            if _warning:
+                search_result['warning'] = _warning
             search_results.append(search_result)
             total += search_result['num_alerts']
 
@@ -2380,10 +2456,8 @@ def tns_records():
         return jsonify(response)
     else:
         _args = request.args.copy()
-        try:
-            _args.pop('page')
-        except:
-            pass
+        for _k in ['page', 'cursor']:
+            _args.pop(_k, None)
         arg_str = urlencode(_args)
         return render_template('tns.html', context=response, page=paginator.page, arg_str=arg_str, latest=latest,
                                url={'url': f'{SASSY_APP_URL}', 'page': 'tns'})
@@ -2395,6 +2469,7 @@ def tns_records():
 # noinspection PyShadowingBuiltins
 @app.route('/sassy/tns/<int:dbid>/')
 @app.route('/tns/<int:dbid>/')
+@RESPONSE_CACHE.cached('tns')
 def tns_detail(dbid=0):
     logger.debug(f'route /sassy/tns/{dbid}/ entry')
 
@@ -2421,6 +2496,7 @@ def tns_detail(dbid=0):
 # -
 @app.route('/sassy/tns/text/')
 @app.route('/tns/text/')
+@RESPONSE_CACHE.cached('tns')
 def tns_text():
     logger.debug(f'route /sassy/tns/text/ entry')
     return render_template('tns_text.html', text=tns_get_text())
@@ -2432,6 +2508,7 @@ def tns_text():
 # noinspection PyBroadException
 @app.route('/sassy/tns_q3c/', methods=['GET', 'POST'])
 @app.route('/tns_q3c/', methods=['GET', 'POST'])
+@RESPONSE_CACHE.cached('tns_q3c')
 def tns_q3c_records():
     logger.debug(f'route /sassy/tns_q3c/ entry')
 
@@ -2458,8 +2535,11 @@ def tns_q3c_records():
         query = db_tns_q3c.session.query(TnsQ3cRecord)
         query = tns_q3c_filters(query, _args)
 
+        # refuse a page (at its offset) or count the planner expects to be too expensive (raises QueryTooExpensive)
+        guard_page(query, 'tns_q3c', page, RESULTS_PER_PAGE, count=True)
+
         # get latest alert
-        latest = db_tns_q3c.session.query(TnsQ3cRecord).order_by(TnsQ3cRecord.tns_name.desc()).first()
+        latest = TABLE_STATS.latest(TnsQ3cRecord.__tablename__)
 
         # paginate
         paginator = query.paginate(page, RESULTS_PER_PAGE, True)
@@ -2493,11 +2573,14 @@ def tns_q3c_records():
             # query database
             query = db_tns_q3c.session.query(TnsQ3cRecord)
             query = tns_q3c_filters(query, search_args)
+            query, _warning = guard_query(query, 'tns_q3c', downgrade=True)
 
             # extract,transform and load (ETL) into result(s)
             search_result['query'] = search_args
             search_result['num_alerts'] = query.count()
             search_result['results'] = TnsQ3cRecord.serialize_list(query.all())
+            if _warning:
+                search_result['warning'] = _warning
             search_results.append(search_result)
             total += search_result['num_alerts']
 
@@ -2527,6 +2610,7 @@ def tns_q3c_records():
 # noinspection PyShadowingBuiltins
 @app.route('/sassy/tns_q3c/<int:dbid>/')
 @app.route('/tns_q3c/<int:dbid>/')
+@RESPONSE_CACHE.cached('tns_q3c')
 def tns_q3c_detail(dbid=0):
     logger.debug(f'route /sassy/tns_q3c/{dbid}/ entry')
 
@@ -2553,6 +2637,7 @@ def tns_q3c_detail(dbid=0):
 # -
 @app.route('/sassy/tns_q3c/text/')
 @app.route('/tns_q3c/text/')
+@RESPONSE_CACHE.cached('tns_q3c')
 def tns_q3c_text():
     logger.debug(f'route /sassy/tns_q3c/text/ entry')
     return render_template('tns_q3c_text.html', text=tns_q3c_get_text())
@@ -2796,9 +2881,9 @@ def ztf_alert_stamp(id=0, stamp=''):
         return render_template('error.html', details=details)
     logger.debug(f'alert={alert}')
 
-    # return data
-    if hasattr(alert, f'cutout{stamp}'):
-        _sf = getattr(alert, f'cutout{stamp}')
+    # return data (the packet is decoded once and cached by candid)
+    _sf = getattr(alert, f'cutout{stamp}', None) if stamp in ZTF_CUTOUTS else None
+    if _sf:
         return send_file(
             io.BytesIO(_sf['stampData']),
             mimetype='image/fits',
@@ -2894,7 +2979,6 @@ def ztf_alerts():
     forwarded_ips = request.headers.getlist('X-Forwarded-For')
     client_ip = forwarded_ips[0].split(',')[0] if len(forwarded_ips) >= 1 else ''
     logger.info('incoming request', extra={'tags': {'requesting_ip': client_ip, 'request_args': request.args}})
-    page = request.args.get('page', 1, type=int)
     response = {}
 
     # set default(s)
@@ -2914,19 +2998,15 @@ def ztf_alerts():
         query = ztf_filters(query, request.args)
 
         # get latest alert
-        latest = db_ztf.session.query(ZtfAlert).order_by(ZtfAlert.jd.desc()).first()
+        latest = TABLE_STATS.latest(ZtfAlert.__tablename__)
 
-        # paginate
-        paginator = query.paginate(page, RESULTS_PER_PAGE, True)
+        # paginate by keyset (?cursor=), the total is an estimate unless ?count=exact, the page and count are guarded
+        _fields = request.args.get('fields', '') if _request_wants_json() else ''
+        paginator = keyset_paginate(query, ZtfAlert, request.args, 'jd', 'descending', RESULTS_PER_PAGE,
+                                    ztf_columns(_fields), route='ztf')
 
-        # set response dictionary
-        response = {
-            'total': paginator.total,
-            'pages': paginator.pages,
-            'has_next': paginator.has_next,
-            'has_prev': paginator.has_prev,
-            'results': ZtfAlert.serialize_list(paginator.items)
-        }
+        # set response dictionary (only the selected columns are read, ?fields=objectId,jd,ra,dec for json)
+        response = dict(paginator.serialized(), results=ztf_serialize_rows(paginator.items, _fields))
 
     # POST request
     if request.method == 'POST':
@@ -2935,26 +3015,18 @@ def ztf_alerts():
         searches = request.get_json().get('queries')
         logger.debug(f'searches={searches}')
 
-        # initialize output(s)
-        search_results = []
-        total = 0
-
-        # iterate over searches
-        for search_args in searches:
-
-            # initialize result(s)
-            search_result = {}
-
-            # query database
-            query = db_ztf.session.query(ZtfAlert)
-            query = ztf_filters(query, search_args)
+        # stream (?stream=ndjson|json) from a server-side cursor rather than build the response in memory
+        _stream = stream_format(request)
+        if _stream:
+            return stream_queries(db_ztf.session, ZtfAlert, ztf_filters, searches, _stream, route='ztf')
 
-            # extract,transform and load (ETL) into result(s)
-            search_result['query'] = search_args
-            search_result['num_alerts'] = query.count()
-            search_result['results'] = ZtfAlert.serialize_list(query.all())
-            search_results.append(search_result)
-            total += search_result['num_alerts']
+        # run the searches concurrently (in request order) with a per-query statement timeout
+        _workers, _timeout_ms = query_limits(request.get_json())
+        _fields = request.get_json().get('fields', '')
+        search_results = run_queries(db_ztf.read_engine, ZtfAlert, ztf_filters, searches, _workers, _timeout_ms,
+                                     lambda _q: ztf_serialize_rows(_q.with_entities(*ztf_columns(_fields)), _fields),
+                                     route='ztf')
+        total = sum([_r['num_alerts'] for _r in search_results])
 
         # set response dictionary
         response = {
@@ -2967,10 +3039,8 @@ def ztf_alerts():
         return jsonify(response)
     else:
         _args = request.args.copy()
-        try:
-            _args.pop('page')
-        except:
-            pass
+        for _k in ['page', 'cursor']:
+            _args.pop(_k, None)
         arg_str = urlencode(_args)
         return render_template('ztf.html', context=response, page=paginator.page, arg_str=arg_str, latest=latest,
                                url={'url': f'{SASSY_APP_URL}', 'page': 'ztf'})
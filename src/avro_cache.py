@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from src import jd_to_path
+from src.utils.utils import UtilsLogger
+
+from collections import OrderedDict
+
+import fastavro
+import io
+import os
+import requests
+import stat
+import tempfile
+import threading
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    Resolve and cache decoded ZTF AVRO packets keyed by candid.
+
+    Packets are looked up in an in-process LRU, then read directly from the SASSY_ZTF_AVRO directories
+    (YYYY/MM/DD/<candid>.avro), then from an on-disk cache of the raw AVRO previously fetched over HTTP,
+    and only as a last resort fetched over HTTP. Both caches are bounded: the memory cache by entry count
+    (SASSY_AVRO_CACHE_SIZE) and the disk cache by size (SASSY_AVRO_CACHE_MB), least recently used first.
+
+    The disk cache holds AVRO bytes (decoded with fastavro on read, never unpickled) in a private
+    directory, ${SASSY_HOME}/cache/avro by default (SASSY_AVRO_CACHE). The directory must be owned by
+    the web app's user and not be accessible by anyone else, otherwise the disk cache is disabled.
+
+    >>> from src.avro_cache import AVRO_CACHE
+    >>> packet = AVRO_CACHE.get(1237486751415010006, 2458991.7486806)
+"""
+
+
+# +
+# constant(s)
+# -
+AVRO_CACHE_DIR = os.getenv("SASSY_AVRO_CACHE", os.path.join(os.getenv("SASSY_HOME", "/var/www/SASSy"), 'cache', 'avro'))
+AVRO_CACHE_MB = int(os.getenv("SASSY_AVRO_CACHE_MB", 512))
+AVRO_CACHE_SIZE = int(os.getenv("SASSY_AVRO_CACHE_SIZE", 256))
+AVRO_CACHE_TRIM = 0.9
+AVRO_HTTP_TIMEOUT = 30.0
+SASSY_ZTF_AVRO = os.getenv("SASSY_ZTF_AVRO", "/dataraid6/ztf:/data/ztf")
+
+
+# +
+# logging
+# -
+logger = UtilsLogger('avro_cache').logger
+
+
+# +
+# function: resolve_avro()
+# -
+def resolve_avro(candid=0, jd=None, dirs=SASSY_ZTF_AVRO):
+    """ return the path of <dir>/YYYY/MM/DD/<candid>.avro in the first directory that has it, or '' """
+    _key = f'{jd_to_path(jd)}{candid}.avro'
+    for _d in (dirs or '').split(':'):
+        _f = os.path.join(_d, _key)
+        if _d.strip() != '' and os.path.isfile(_f):
+            return _f
+    return ''
+
+
+# +
+# function: read_packet()
+# -
+def read_packet(data=None, candid=None):
+    """ decode AVRO bytes or a file path and return the packet for candid (or the first packet if candid is None) """
+    try:
+        if isinstance(data, str):
+            with open(data, 'rb') as _f:
+                _packets = list(fastavro.reader(_f))
+        else:
+            _packets = list(fastavro.reader(io.BytesIO(data)))
+    except Exception as e:
+        logger.warning(f'unable to decode avro, error={e}')
+        return None
+    for _packet in _packets:
+        if candid is None or _packet['candidate']['candid'] == candid:
+            return _packet
+    return None
+
+
+# +
+# function: private_dir()
+# -
+def private_dir(path=''):
+    """ create path (mode 0700) if needed, return True if it is a real directory owned by us and closed to others """
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        _stat = os.lstat(path)
+    except OSError as e:
+        logger.warning(f'unable to create {path}, error={e}')
+        return False
+    if not stat.S_ISDIR(_stat.st_mode) or _stat.st_uid != os.geteuid() or _stat.st_mode & 0o077:
+        logger.warning(f'{path} is not a private directory (uid={_stat.st_uid}, mode={oct(_stat.st_mode)}), '
+                       f'it must be owned by uid={os.geteuid()} with mode 0700')
+        return False
+    return True
+
+
+# +
+# class: AvroCache()
+# -
+class AvroCache(object):
+
+    # +
+    # method: __init__()
+    # -
+    def __init__(self, size=AVRO_CACHE_SIZE, cache_dir=AVRO_CACHE_DIR, cache_mb=AVRO_CACHE_MB, dirs=SASSY_ZTF_AVRO):
+
+        # private variable(s)
+        self.__size = size if (isinstance(size, int) and size >= 0) else AVRO_CACHE_SIZE
+        self.__dir = cache_dir if (isinstance(cache_dir, str) and cache_dir.strip() != '') else ''
+        self.__bytes = max(0, int(cache_mb)) * 1024 * 1024 if self.__dir else 0
+        self.__dirs = dirs
+        self.__lock = threading.Lock()
+        self.__memory = OrderedDict()
+        self.__disk_used = None
+        self.__private = None
+        self.__counts = {'memory': 0, 'disk': 0, 'file': 0, 'http': 0, 'miss': 0}
+
+    # +
+    # property(s)
+    # -
+    @property
+    def counts(self):
+        with self.__lock:
+            return dict(self.__counts, entries=len(self.__memory))
+
+    # +
+    # method: get()
+    # -
+    def get(self, candid=0, jd=None, url='', match=None):
+        """ return the decoded packet for candid, url is only fetched if the file is not on local disk """
+        match = match if match is not None else candid
+
+        # memory
+        with self.__lock:
+            if candid in self.__memory:
+                self.__memory.move_to_end(candid)
+                self.__counts['memory'] += 1
+                return self.__memory[candid]
+
+        # the avro archive, then the disk cache (of earlier http fetches), then http
+        _path = resolve_avro(candid, jd, self.__dirs)
+        _source, _packet = 'file', (read_packet(_path, match) if _path else None)
+        if _packet is None:
+            _source, _packet = 'disk', self.__disk_get(candid, match)
+        if _packet is None and isinstance(url, str) and url.strip() != '':
+            _data = self.__http_get(url)
+            _source, _packet = 'http', (read_packet(_data, match) if _data else None)
+            if _packet is not None:
+                self.__disk_put(candid, _data)
+        if _packet is None:
+            with self.__lock:
+                self.__counts['miss'] += 1
+            return None
+
+        # remember
+        with self.__lock:
+            self.__counts[_source] += 1
+        self.__memory_put(candid, _packet)
+        return _packet
+
+    # +
+    # method: clear()
+    # -
+    def clear(self):
+        """ empty the memory cache (the disk cache is left alone) """
+        with self.__lock:
+            self.__memory.clear()
+
+    # +
+    # (hidden) method: __memory_put()
+    # -
+    def __memory_put(self, candid=0, packet=None):
+        if self.__size == 0:
+            return
+        with self.__lock:
+            self.__memory[candid] = packet
+            self.__memory.move_to_end(candid)
+            while len(self.__memory) > self.__size:
+                self.__memory.popitem(last=False)
+
+    # +
+    # (hidden) method: __disk_ready()
+    # -
+    def __disk_ready(self):
+        """ check (once) that the cache directory is private, the disk cache is disabled if it is not """
+        if not self.__bytes:
+            return False
+        with self.__lock:
+            if self.__private is None:
+                self.__private = private_dir(self.__dir)
+                if not self.__private:
+                    logger.warning(f'disabling the avro disk cache in {self.__dir}')
+            return self.__private
+
+    # +
+    # (hidden) method: __disk_path()
+    # -
+    def __disk_path(self, candid=0):
+        return os.path.join(self.__dir, f'{int(candid) % 256:02x}', f'{int(candid)}.avro')
+
+    # +
+    # (hidden) method: __disk_get()
+    # -
+    def __disk_get(self, candid=0, match=None):
+        if not self.__disk_ready():
+            return None
+        _path = self.__disk_path(candid)
+        try:
+            with open(_path, 'rb') as _f:
+                _data = _f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f'unable to read cache entry {_path}, error={e}')
+            return None
+        _packet = read_packet(_data, match)
+        try:
+            if _packet is not None:
+                os.utime(_path)
+            else:
+                logger.warning(f'discarding undecodable cache entry {_path}')
+                os.remove(_path)
+        except OSError:
+            pass
+        return _packet
+
+    # +
+    # (hidden) method: __disk_put()
+    # -
+    def __disk_put(self, candid=0, data=None):
+        if not self.__disk_ready():
+            return
+        _path = self.__disk_path(candid)
+        try:
+            os.makedirs(os.path.dirname(_path), mode=0o700, exist_ok=True)
+            _fd, _tmp = tempfile.mkstemp(dir=os.path.dirname(_path), suffix='.tmp')
+            with os.fdopen(_fd, 'wb') as _f:
+                _f.write(data)
+            _size = len(data)
+            os.replace(_tmp, _path)
+        except OSError as e:
+            logger.warning(f'unable to write cache entry {_path}, error={e}')
+            return
+
+        # keep a running total and only walk the tree when the bound is crossed
+        with self.__lock:
+            if self.__disk_used is None:
+                self.__disk_used = self.__disk_scan()[1]
+            else:
+                self.__disk_used += _size
+            _trim = self.__disk_used > self.__bytes
+        if _trim:
+            self.__disk_trim()
+
+    # +
+    # (hidden) method: __disk_scan()
+    # -
+    def __disk_scan(self):
+        _entries, _total = [], 0
+        for _root, _dirs, _files in os.walk(self.__dir):
+            for _name in _files:
+                if not _name.endswith('.avro'):
+                    continue
+                try:
+                    _stat = os.stat(os.path.join(_root, _name))
+                except OSError:
+                    continue
+                _entries.append((_stat.st_mtime, _stat.st_size, os.path.join(_root, _name)))
+                _total += _stat.st_size
+        return _entries, _total
+
+    # +
+    # (hidden) method: __disk_trim()
+    # -
+    def __disk_trim(self):
+        """ remove least recently used entries until the cache is under AVRO_CACHE_TRIM of its bound """
+        _entries, _total = self.__disk_scan()
+        for _mtime, _size, _path in sorted(_entries):
+            if _total <= self.__bytes * AVRO_CACHE_TRIM:
+                break
+            try:
+                os.remove(_path)
+                _total -= _size
+            except OSError:
+                pass
+        with self.__lock:
+            self.__disk_used = _total
+
+    # +
+    # (hidden) method: __http_get()
+    # -
+    @staticmethod
+    def __http_get(url=''):
+        try:
+            _response = requests.get(url, timeout=AVRO_HTTP_TIMEOUT)
+            _response.raise_for_status()
+        except requests.RequestException as e:
+            logger.warning(f'unable to fetch {url}, error={e}')
+            return None
+        return _response.content
+
+
+# +
+# global cache
+# -
+AVRO_CACHE = AvroCache()
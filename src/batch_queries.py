@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from src.query_guard import QueryTooExpensive
+from src.query_guard import guard_query
+from src.utils.utils import UtilsLogger
+
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import exc
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import os
+import time
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    Run the entries of a multi-query POST concurrently over the connection pool.
+
+    Each query runs in its own session with a statement_timeout, at most QUERY_WORKERS at a time, and
+    the results are returned in request order. A query that fails or times out (in the database or while
+    waiting for a pooled connection) yields an entry with an 'error' and no results rather than failing
+    the whole batch. Clients may lower (not raise) the limits with "workers" and "timeout_ms" in the
+    JSON body. Given a route, each query is first checked (and
+    perhaps capped, with a 'warning') by src.query_guard.guard_query().
+
+    >>> from src.batch_queries import run_queries
+    >>> search_results = run_queries(db.engine, ZtfAlert, ztf_filters, searches)
+"""
+
+
+# +
+# constant(s)
+# -
+QUERY_TIMEOUT_MS = int(os.getenv("SASSY_QUERY_TIMEOUT_MS", 30000))
+QUERY_WORKERS = int(os.getenv("SASSY_QUERY_WORKERS", 8))
+
+
+# +
+# logging
+# -
+logger = UtilsLogger('batch_queries').logger
+
+
+# +
+# function: query_limits()
+# -
+# noinspection PyBroadException
+def query_limits(body=None):
+    """ return (workers, timeout_ms) requested in a JSON body, capped by QUERY_WORKERS and QUERY_TIMEOUT_MS """
+    body = body if isinstance(body, dict) else {}
+    try:
+        _workers = min(max(1, int(body.get('workers', QUERY_WORKERS))), QUERY_WORKERS)
+    except Exception:
+        _workers = QUERY_WORKERS
+    try:
+        _timeout_ms = min(max(1, int(body.get('timeout_ms', QUERY_TIMEOUT_MS))), QUERY_TIMEOUT_MS)
+    except Exception:
+        _timeout_ms = QUERY_TIMEOUT_MS
+    return _workers, _timeout_ms
+
+
+# +
+# function: run_query()
+# -
+def run_query(engine=None, model=None, filters=None, search_args=None, timeout_ms=QUERY_TIMEOUT_MS, serializer=None,
+              route=''):
+    """ run one filtered query in a private session, returns {'query', 'num_alerts', 'results'[, 'error'|'warning']} """
+    _start = time.monotonic()
+    _session = Session(bind=engine)
+    try:
+        _session.execute(text("SELECT set_config('statement_timeout', :ms, true)"), {'ms': f'{int(timeout_ms)}'})
+        _query = filters(_session.query(model), search_args)
+        _query, _warning = guard_query(_query, route, downgrade=True) if route else (_query, None)
+        _results = serializer(_query) if serializer is not None else model.serialize_list(_query.all())
+        _result = {'query': search_args, 'num_alerts': len(_results), 'results': _results}
+        if _warning:
+            _result['warning'] = _warning
+        return _result
+    except QueryTooExpensive as e:
+        return {'query': search_args, 'num_alerts': 0, 'results': [], 'error': f'{e}'}
+    except exc.SQLAlchemyError as e:
+        # includes a pool TimeoutError when every connection is busy, not only DBAPI errors
+        logger.warning(f'query failed after {time.monotonic() - _start:.3f}s, query={search_args}, error={e}')
+        _error = e.orig if isinstance(e, exc.DBAPIError) else e
+        return {'query': search_args, 'num_alerts': 0, 'results': [], 'error': f'{_error}'.strip()}
+    finally:
+        _session.rollback()
+        _session.close()
+
+
+# +
+# function: run_queries()
+# -
+def run_queries(engine=None, model=None, filters=None, searches=None, workers=QUERY_WORKERS,
+                timeout_ms=QUERY_TIMEOUT_MS, serializer=None, route=''):
+    """ run every search concurrently (at most workers at once), returns their results in request order,
+        serializer(query) replaces model.serialize_list(query.all()) if given """
+
+    # check input(s)
+    if engine is None or model is None or filters is None:
+        raise Exception('run_queries() entry: engine, model or filters is empty')
+    searches = searches if isinstance(searches, list) else []
+    if not searches:
+        return []
+
+    # a single query does not need a thread
+    workers = max(1, min(workers, len(searches)))
+    if workers == 1:
+        return [run_query(engine, model, filters, _s, timeout_ms, serializer, route) for _s in searches]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch-query') as _executor:
+        _futures = [_executor.submit(run_query, engine, model, filters, _s, timeout_ms, serializer, route)
+                    for _s in searches]
+        return [_f.result() for _f in _futures]
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from src.utils.utils import UtilsLogger
+
+from flask_sqlalchemy import SignallingSession
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.expression import CompoundSelect
+from sqlalchemy.sql.expression import Select
+
+import os
+import threading
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    One shared, tuned engine (and an optional read replica) for every Flask-SQLAlchemy handle.
+
+    Each model module keeps its own SassySQLAlchemy() (and so its own metadata), but every handle
+    bound to the same URI shares one engine and one connection pool instead of building its own.
+    The pool is sized by SASSY_DB_POOL_SIZE, SASSY_DB_MAX_OVERFLOW, SASSY_DB_POOL_TIMEOUT and
+    SASSY_DB_POOL_RECYCLE, connections are checked on checkout (SASSY_DB_PRE_PING) and may carry a
+    server-side statement_timeout (SASSY_DB_STATEMENT_TIMEOUT_MS, 0 disables it). Each setting can
+    be overridden in app.config under the same name.
+
+    If SASSY_DB_REPLICA_URI is set, SELECTs issued by a session that has not written anything in
+    its current transaction are sent to the replica; inserts, updates, deletes, flushes, text()
+    statements and everything after them (until commit or rollback) go to the primary. db.read_engine
+    is the replica engine (or the primary if there is none) for code that opens its own sessions.
+
+    >>> from src.database import SassySQLAlchemy
+    >>> db = SassySQLAlchemy()
+    >>> db.init_app(app)
+    >>> db.engine is db_ztf.engine
+    True
+"""
+
+
+# +
+# constant(s)
+# -
+DB_MAX_OVERFLOW = int(os.getenv("SASSY_DB_MAX_OVERFLOW", 10))
+DB_POOL_RECYCLE = int(os.getenv("SASSY_DB_POOL_RECYCLE", 1800))
+DB_POOL_SIZE = int(os.getenv("SASSY_DB_POOL_SIZE", 10))
+DB_POOL_TIMEOUT = int(os.getenv("SASSY_DB_POOL_TIMEOUT", 30))
+DB_PRE_PING = os.getenv("SASSY_DB_PRE_PING", "true").lower() in ['true', '1', 'yes']
+DB_REPLICA_URI = os.getenv("SASSY_DB_REPLICA_URI", "")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("SASSY_DB_STATEMENT_TIMEOUT_MS", 0))
+
+
+# +
+# logging
+# -
+logger = UtilsLogger('database').logger
+
+
+# +
+# function: engine_options()
+# -
+def engine_options(config=None):
+    """ return the create_engine() keyword arguments for config (app.config), defaulting to the environment """
+    config = config if config is not None else {}
+    _options = {
+        'max_overflow': int(config.get('SASSY_DB_MAX_OVERFLOW', DB_MAX_OVERFLOW)),
+        'pool_pre_ping': bool(config.get('SASSY_DB_PRE_PING', DB_PRE_PING)),
+        'pool_recycle': int(config.get('SASSY_DB_POOL_RECYCLE', DB_POOL_RECYCLE)),
+        'pool_size': int(config.get('SASSY_DB_POOL_SIZE', DB_POOL_SIZE)),
+        'pool_timeout': int(config.get('SASSY_DB_POOL_TIMEOUT', DB_POOL_TIMEOUT))
+    }
+    _timeout_ms = int(config.get('SASSY_DB_STATEMENT_TIMEOUT_MS', DB_STATEMENT_TIMEOUT_MS))
+    if _timeout_ms > 0:
+        _options['connect_args'] = {'options': f'-c statement_timeout={_timeout_ms}'}
+    return _options
+
+
+# +
+# function: shared_engine()
+# -
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+
+def shared_engine(uri='', config=None):
+    """ return the process-wide engine for uri, creating it (with engine_options(config)) on first use """
+    if not isinstance(uri, str) or uri.strip() == '':
+        raise Exception('shared_engine() entry: uri is empty')
+    with _ENGINES_LOCK:
+        _engine = _ENGINES.get(uri, None)
+        if _engine is None:
+            _options = engine_options(config)
+            _engine = _ENGINES[uri] = create_engine(uri, **_options)
+            logger.debug(f'created engine {_engine.url!r} with {_options}')
+        return _engine
+
+
+# +
+# class: RoutingSession(), inherits from SignallingSession
+# -
+class RoutingSession(SignallingSession):
+
+    # +
+    # method: __init__()
+    # -
+    def __init__(self, db=None, autocommit=False, autoflush=True, **options):
+        self.__db = db
+        SignallingSession.__init__(self, db, autocommit=autocommit, autoflush=autoflush, **options)
+
+    # +
+    # method: get_bind()
+    # -
+    def get_bind(self, mapper=None, clause=None):
+        """ send reads to the replica until this transaction writes, everything else to the primary """
+        if isinstance(clause, (Select, CompoundSelect)) and not self.info.get('primary', False) and \
+                not self._flushing and self._is_clean():
+            _replica = self.__db.get_read_engine(self.app)
+            if _replica is not None:
+                return _replica
+        return SignallingSession.get_bind(self, mapper, clause)
+
+    # +
+    # method: execute(), flush(), commit(), rollback(), close()
+    # -
+    def execute(self, clause=None, params=None, mapper=None, bind=None, **kw):
+        if not isinstance(clause, (Select, CompoundSelect)):
+            self.info['primary'] = True
+        return SignallingSession.execute(self, clause, params=params, mapper=mapper, bind=bind, **kw)
+
+    def flush(self, objects=None):
+        if not self._is_clean():
+            self.info['primary'] = True
+        return SignallingSession.flush(self, objects)
+
+    def commit(self):
+        try:
+            return SignallingSession.commit(self)
+        finally:
+            self.info.pop('primary', None)
+
+    def rollback(self):
+        try:
+            return SignallingSession.rollback(self)
+        finally:
+            self.info.pop('primary', None)
+
+    def close(self):
+        try:
+            return SignallingSession.close(self)
+        finally:
+            self.info.pop('primary', None)
+
+
+# +
+# class: SassySQLAlchemy(), inherits from SQLAlchemy
+# -
+class SassySQLAlchemy(SQLAlchemy):
+
+    # +
+    # method: get_engine()
+    # -
+    def get_engine(self, app=None, bind=None):
+        """ return the shared engine of the app's URI (declared binds keep their own engines) """
+        if bind is not None:
+            return SQLAlchemy.get_engine(self, app, bind)
+        app = self.get_app(app)
+        return shared_engine(app.config['SQLALCHEMY_DATABASE_URI'], app.config)
+
+    # +
+    # method: get_read_engine()
+    # -
+    def get_read_engine(self, app=None):
+        """ return the shared replica engine, or None if SASSY_DB_REPLICA_URI is not set """
+        app = self.get_app(app)
+        _uri = f"{app.config.get('SASSY_DB_REPLICA_URI', DB_REPLICA_URI) or ''}".strip()
+        return shared_engine(_uri, app.config) if _uri != '' else None
+
+    # +
+    # property(s)
+    # -
+    @property
+    def read_engine(self):
+        return self.get_read_engine() or self.engine
+
+    # +
+    # method: create_session()
+    # -
+    def create_session(self, options=None):
+        return sessionmaker(class_=RoutingSession, db=self, **(options or {}))
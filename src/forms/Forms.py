@@ -4,7 +4,6 @@
 # +
 # import(s)
 # -
-from astropy.time import Time
 from datetime import datetime
 from datetime import timedelta
 from flask_wtf import FlaskForm
@@ -17,6 +16,9 @@ from wtforms.validators import DataRequired
 from wtforms.validators import NumberRange
 from wtforms.validators import Regexp
 
+from src.time_utils import isot_to_jd
+from src.time_utils import jd_to_isot
+
 import re
 import math
 
@@ -28,20 +30,12 @@ def forms_get_iso(offset=0):
     return (datetime.now() + timedelta(days=offset)).isoformat()
 
 
-# noinspection PyBroadException
 def forms_iso_to_jd(_iso=''):
-    try:
-        return float(Time(_iso).mjd)+2400000.5
-    except Exception:
-        return float(math.nan)
+    return isot_to_jd(_iso)
 
 
-# noinspection PyBroadException
 def forms_jd_to_iso(_jd=0.0):
-    try:
-        return Time(_jd, format='jd', precision=6).isot
-    except Exception:
-        return None
+    return jd_to_isot(_jd)
 
 
 # +
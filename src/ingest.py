@@ -4,21 +4,39 @@
 # +
 # import(s)
 # -
+import argparse
 import base64
-import boto3
 import fastavro
 import io
-import os
+import psycopg2
+import threading
+import time
 
-from astropy.coordinates import SkyCoord
-from astropy.time import Time
 
 from kafka import KafkaConsumer
-from botocore.exceptions import ClientError
+from kafka import TopicPartition
 from sqlalchemy import exc
-
+from sqlalchemy import literal_column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from src.ingest_copy import CONFLICT_ACTIONS
+from src.ingest_copy import CONFLICT_KEY
+from src.ingest_copy import COPY_FORMATS
+from src.ingest_copy import copy_rows
+from src.ingest_archive import ARCHIVE_ROOT
+from src.ingest_archive import get_archivers
+from src.ingest_archive import packet_key
+from src.ingest_archive import set_local_archive
+from src.ingest_transform import derive_fields
+from src.ingest_metrics import METRICS
+from src.ingest_metrics import record_lag
+from src.ingest_metrics import start_metrics_server
+from src.ingest_metrics import start_stats_logger
+from src.table_stats import notify_stats
 from src.models.ztf import ZtfAlert
 from src.models.ztf import db
+from src.models.ztf import ztf_latest_rebuild
+from src.models.ztf import ztf_latest_update
 from src.app import app
 from src.app import logger
 
@@ -26,53 +44,99 @@ from src.app import logger
 # +
 # constant(s)
 # -
-AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID", None)
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY", None)
-AWS_USE_S3 = False if AWS_ACCESS_KEY is None else True
-BUCKET_NAME = os.getenv("S3_BUCKET", None)
+BATCH_MS = 1000
+BATCH_SIZE = 500
+BATCH_WORKERS = 4
+BATCH_RETRY_SECONDS = 5.0
 
 GROUP_ID = 'LCOGT'
 PRODUCER_HOST = 'public.alerts.ztf.uw.edu'
 PRODUCER_PORT = '9092'
 TOPIC = "^(ztf_\d{8}_programid1)"
+WRITERS = ['insert'] + COPY_FORMATS
 
 
 # +
-# create AWS session
+# ingest reads what it has just written (eg derived fields), so never route its queries to a replica
 # -
-if AWS_USE_S3:
-    session = boto3.Session(aws_access_key_id=AWS_ACCESS_KEY, aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
-    s3 = session.resource('s3')
-else:
-    s3 = None
+app.config['SASSY_DB_REPLICA_URI'] = ''
 
 
 # +
-# (hidden) function: _packet_path()
+# (hidden) function: _column_defaults()
 # -
-def _packet_path(packet=None):
+def _column_defaults():
+    _defaults = {}
+    for _c in ZtfAlert.__table__.columns:
+        if _c.primary_key:
+            continue
+        _defaults[_c.name] = _c.default.arg if (_c.default is not None and _c.default.is_scalar) else None
+    return _defaults
 
-    # check input(s) and return string
-    if packet is not None and 'candidate' in packet and 'jd' in packet['candidate']:
-        jd_time = Time(packet['candidate']['jd'], format='jd')
-        return '{}/{}/{}/'.format(
-            jd_time.datetime.year, str(jd_time.datetime.month).zfill(2), str(jd_time.datetime.day).zfill(2)
-        )
-    else:
-        return ''
+
+# +
+# constant(s) derived from the model
+# -
+ALERT_COLUMN_DEFAULTS = _column_defaults()
+
+
+# +
+# function: packets_to_rows()
+# -
+def packets_to_rows(packets=None):
+    """ convert a batch of packets to full-column alert rows, derived fields are computed batch-wise """
+
+    # check input(s)
+    if packets is None:
+        raise Exception('packets_to_rows() entry: packets is empty!')
+    for _packet in packets:
+        if _packet is None or 'candidate' not in _packet or 'prv_candidates' not in _packet:
+            raise Exception('packets_to_rows() entry: packet is empty!')
+
+    rows = []
+    for _packet, _derived in zip(packets, derive_fields(packets)):
+
+        # do not mutate the caller's packet
+        candidate = dict(_packet['candidate'])
+        ra = candidate.pop('ra')
+        dec = candidate.pop('dec')
+
+        # every row carries every column so that rows can share one multi-row insert
+        row = dict(ALERT_COLUMN_DEFAULTS)
+        row.update({_k: _v for _k, _v in candidate.items() if _k in ALERT_COLUMN_DEFAULTS})
+        row.update({
+            'objectId': _packet['objectId'],
+            'publisher': _packet.get('publisher', ''),
+            'alert_candid': _packet['candid'],
+            'location': f'srid=4035;POINT({ra} {dec})',
+            'ra': ra,
+            'dec': dec
+        })
+        row.update(_derived)
+        rows.append(row)
+    return rows
+
+
+# +
+# function: packet_to_row()
+# -
+def packet_to_row(packet=None):
+
+    # check input(s)
+    if packet is None or 'candidate' not in packet or 'prv_candidates' not in packet:
+        raise Exception('packet_to_row() entry: packet is empty!')
+    return packets_to_rows([packet])[0]
 
 
 # +
 # function: do_ingest()
 # -
-# noinspection PyBroadException
-def do_ingest(encoded_packet=None):
+def do_ingest(encoded_packet=None, on_conflict=CONFLICT_ACTIONS[0]):
+    """ base64 compatibility wrapper around ingest_bytes() """
 
     # check input(s)
     if encoded_packet is None:
         raise Exception('do_ingest() entry: encoded packet is empty')
-    else:
-        logger.info('encoded_packet contains data')
 
     # decode the packet
     try:
@@ -82,88 +146,62 @@ def do_ingest(encoded_packet=None):
     else:
         logger.info('encoded_packet decoded OK')
 
-    # get data
+    return ingest_bytes(f_data, on_conflict)
+
+
+# +
+# function: ingest_bytes()
+# -
+def ingest_bytes(data=None, on_conflict=CONFLICT_ACTIONS[0]):
+    """ parse raw AVRO bytes once, ingest every packet and upload the same buffer, returns the packet(s) """
+
+    # check input(s)
+    if not isinstance(data, (bytes, bytearray, memoryview)) or len(data) == 0:
+        raise Exception('ingest_bytes() entry: data is empty')
+
+    # get data (BytesIO shares an immutable bytes buffer rather than copying it)
     try:
-        freader = fastavro.reader(io.BytesIO(f_data))
-        for packet in freader:
-            logger.info('Calling ingest_avro()')
-            ingest_avro(packet)
+        packets = list(fastavro.reader(io.BytesIO(data)))
     except Exception as e:
+        METRICS.inc('sassy_ingest_alerts_rejected_total')
         raise Exception(f'Packet read error, unable to ingest data, error={e}')
+    METRICS.inc('sassy_ingest_alerts_decoded_total', len(packets))
 
-    # if using AWS, upload the file to the S3 bucket
-    if AWS_USE_S3:
-        try:
-            freader = fastavro.reader(io.BytesIO(f_data))
-            for packet in freader:
-                fname = '{}.avro'.format(packet['candid'])
-                logger.info('Calling upload_avro()')
-                upload_avro(io.BytesIO(f_data), fname, packet)
-        except Exception as e:
-            raise Exception(f'Packet upload error, unable to upload data, error={e}')
+    for packet in packets:
+        logger.info('Calling ingest_avro()')
+        ingest_avro(packet, on_conflict)
+
+    # if archiving (S3 and/or local), queue the same buffer
+    if get_archivers():
+        for packet in packets:
+            logger.info('Calling upload_avro()')
+            upload_avro(data, '{}.avro'.format(packet['candid']), packet)
+    return packets
 
 
 # +
 # function: ingest_avro
 # -
-def ingest_avro(packet=None):
+def ingest_avro(packet=None, on_conflict=CONFLICT_ACTIONS[0]):
 
     # check input(s)
     if packet is None or 'candidate' not in packet or 'prv_candidates' not in packet:
         raise Exception('ingest_avro() entry: packet is empty!')
 
-    # ingest data
+    # ingest data (the alert_candid unique index decides whether the alert is new)
     with app.app_context():
-
-        ra = packet['candidate'].pop('ra')
-        dec = packet['candidate'].pop('dec')
-        location = f'srid=4035;POINT({ra} {dec})'
-        c = SkyCoord(ra, dec, unit='deg')
-        galactic = c.galactic
-
-        deltamaglatest = None
-        if packet['prv_candidates']:
-            prv_candidates = sorted(packet['prv_candidates'], key=lambda x: x['jd'], reverse=True)
-            for candidate in prv_candidates:
-                if packet['candidate']['fid'] == candidate['fid'] and candidate['magpsf']:
-                    deltamaglatest = packet['candidate']['magpsf'] - candidate['magpsf']
-                    break
-
-        deltamagref = None
-        if packet['candidate']['distnr'] < 2:
-            deltamagref = packet['candidate']['magnr'] - packet['candidate']['magpsf']
-
-        alert = ZtfAlert(
-            objectId=packet['objectId'],
-            publisher=packet.get('publisher', ''),
-            alert_candid=packet['candid'],
-            location=location,
-            deltamaglatest=deltamaglatest,
-            deltamagref=deltamagref,
-            gal_l=galactic.l.value,
-            gal_b=galactic.b.value,
-            **packet['candidate']
-            )
-
-        # is it alread in the database?
-        _rec = None
+        row = packet_to_row(packet)
         try:
-            _rec = db.session.query(ZtfAlert).first()
-        except Exception:
-            _rec = None
-
-        if _rec is not None:
-            logger.warn('object already exists in database', extra={'tags': {'candid': alert.alert_candid}})
+            logger.info('Updating object database', extra={'tags': {'candid': row['alert_candid']}})
+            inserted, updated, skipped = write_batch([row], WRITERS[0], on_conflict)
+        except (exc.SQLAlchemyError, psycopg2.Error):
+            db.session.rollback()
+            logger.warn('Failed to update object into database', extra={'tags': {'candid': row['alert_candid']}})
         else:
-            try:
-                logger.info('Updating object database', extra={'tags': {'candid': alert.alert_candid}})
-                # db.session.update(alert)
-                db.session.add(alert)
-                db.session.commit()
-                logger.info('Updated object into database', extra={'tags': {'candid': alert.alert_candid}})
-            except exc.SQLAlchemyError:
-                db.session.rollback()
-                logger.warn('Failed to update object into database', extra={'tags': {'candid': alert.alert_candid}})
+            if skipped:
+                logger.warn('object already exists in database', extra={'tags': {'candid': row['alert_candid']}})
+            else:
+                logger.info('Updated object into database', extra={'tags': {'candid': row['alert_candid']}})
 
 
 # +
@@ -181,28 +219,17 @@ def upload_avro(f=None, fname='', packet=None):
     if packet is None:
         raise Exception('upload_avro() entry: packet is empty')
 
-    date_key = _packet_path(packet)
-    filename = '{}{}'.format(date_key, fname)
+    # queue for the background archive(s), the key is derived from the already parsed packet
+    filename = packet_key(packet, fname)
     logger.info('filename={}'.format(filename))
-
-    if AWS_USE_S3:
-        try:
-            s3.Object(BUCKET_NAME, filename).put(
-                Body=f,
-                ContentDisposition=f'attachment; filename={filename}',
-                ContentType='avro/binary'
-            )
-            logger.info('Successfully uploaded file to s3', extra={'tags': {'filename': filename}})
-        except ClientError as e:
-            logger.warn('Failed to upload file to s3 (e={})'.format(e), extra={'tags': {'filename': filename}})
-    else:
-        pass
+    for _archiver in get_archivers():
+        _archiver.submit(f, filename)
 
 
 # +
 # function: start_consumer()
 # -
-def start_consumer():
+def start_consumer(on_conflict=CONFLICT_ACTIONS[0]):
 
     # noinspection PyBroadException
     try:
@@ -218,19 +245,290 @@ def start_consumer():
         # process message(s)
         for msg in consumer:
             if hasattr(msg, 'value'):
-                alert = msg.value
                 logger.debug('Received alert from stream, ingesting ...')
-                do_ingest(base64.b64encode(alert).decode('UTF-8'))
+                ingest_bytes(msg.value, on_conflict)
                 logger.debug('Ingested alert, committing index to Kafka producer')
                 consumer.commit()
                 logger.debug('Committed index to Kafka producer')
+                record_lag(consumer)
             else:
                 logger.error('Alert has now value!')
 
 
+# +
+# function: write_batch()
+# -
+def write_batch(rows=None, writer=WRITERS[0], on_conflict=CONFLICT_ACTIONS[0]):
+    """ upsert rows with a single multi-row insert (or COPY), returns (inserted, updated, skipped) """
+
+    # check input(s)
+    if not rows:
+        return 0, 0, 0
+    writer = writer if writer in WRITERS else WRITERS[0]
+    on_conflict = on_conflict if on_conflict in CONFLICT_ACTIONS else CONFLICT_ACTIONS[0]
+
+    # time the write and commit, and count the outcome
+    _start = time.monotonic()
+    try:
+        inserted, updated, skipped = _write_batch(rows, writer, on_conflict)
+    except Exception:
+        METRICS.inc('sassy_ingest_write_errors_total', writer=writer)
+        raise
+    METRICS.observe('sassy_ingest_write_seconds', time.monotonic() - _start, writer=writer)
+    METRICS.observe('sassy_ingest_batch_size', len(rows), writer=writer)
+    for _result, _value in (('inserted', inserted), ('updated', updated), ('skipped', skipped)):
+        METRICS.inc('sassy_ingest_rows_total', _value, result=_result)
+
+    # fold the batch into the latest alert per object (its own transaction, a rebuild repairs any failure)
+    # and tell the web app(s) to refresh their cached latest alert (throttled)
+    if inserted + updated > 0:
+        try:
+            ztf_latest_update(db.session, [_r[CONFLICT_KEY] for _r in rows])
+        except exc.SQLAlchemyError as e:
+            logger.warn(f'Failed to update latest_alert_per_object, error={e}', extra={'tags': {'rows': len(rows)}})
+        notify_stats(db.session, ZtfAlert.__tablename__)
+    return inserted, updated, skipped
+
+
+# +
+# (hidden) function: _write_batch()
+# -
+def _write_batch(rows=None, writer=WRITERS[0], on_conflict=CONFLICT_ACTIONS[0]):
+
+    # a statement may not touch the same alert_candid twice, so keep the last copy of each
+    _unique = list({_r[CONFLICT_KEY]: _r for _r in rows}.values())
+
+    # one statement, one transaction for the whole batch
+    try:
+        if writer in COPY_FORMATS:
+            inserted, updated = copy_rows(_unique, writer, on_conflict=on_conflict)
+        else:
+            inserted, updated = _execute_upsert(_unique, on_conflict)
+            db.session.commit()
+        return inserted, updated, len(rows) - inserted - updated
+    except (exc.IntegrityError, psycopg2.IntegrityError):
+        db.session.rollback()
+        logger.warn('Batch insert rejected, falling back to per-row insert', extra={'tags': {'rows': len(rows)}})
+
+    # isolate the offending row(s) so the remainder of the batch is still durable
+    inserted, updated = 0, 0
+    for _row in _unique:
+        try:
+            _inserted, _updated = _execute_upsert([_row], on_conflict)
+            db.session.commit()
+            inserted, updated = inserted + _inserted, updated + _updated
+        except exc.IntegrityError as e:
+            db.session.rollback()
+            logger.warn(f'Failed to insert object, error={e}', extra={'tags': {'candid': _row[CONFLICT_KEY]}})
+    return inserted, updated, len(rows) - inserted - updated
+
+
+# +
+# (hidden) function: _execute_upsert()
+# -
+def _execute_upsert(rows=None, on_conflict=CONFLICT_ACTIONS[0]):
+    """ insert ... on conflict (alert_candid), returns (inserted, updated) """
+    _stmt = pg_insert(ZtfAlert.__table__).values(rows)
+    if on_conflict == 'update':
+        _stmt = _stmt.on_conflict_do_update(
+            index_elements=[CONFLICT_KEY],
+            set_={_k: _stmt.excluded[_k] for _k in ALERT_COLUMN_DEFAULTS if _k != CONFLICT_KEY})
+    else:
+        _stmt = _stmt.on_conflict_do_nothing(index_elements=[CONFLICT_KEY])
+
+    # xmax is zero only for freshly inserted tuples, conflicting rows that were skipped are not returned
+    _returned = [_r[0] for _r in db.session.execute(_stmt.returning(literal_column('(xmax = 0)')))]
+    return sum(_returned), len(_returned) - sum(_returned)
+
+
+# +
+# (hidden) function: _poll_batch()
+# -
+def _poll_batch(consumer=None, batch_size=BATCH_SIZE, batch_ms=BATCH_MS):
+    """ poll until batch_size messages have arrived or batch_ms has elapsed """
+    messages = []
+    deadline = time.monotonic() + batch_ms / 1000.0
+    while len(messages) < batch_size:
+        remaining_ms = int((deadline - time.monotonic()) * 1000.0)
+        if remaining_ms <= 0:
+            break
+        records = consumer.poll(timeout_ms=remaining_ms, max_records=batch_size - len(messages))
+        for _tp, _msgs in records.items():
+            messages.extend(_msgs)
+    return messages
+
+
+# +
+# (hidden) function: _rewind_batch()
+# -
+def _rewind_batch(consumer=None, messages=None):
+    """ seek each partition back to the first offset of an undurable batch """
+    first = {}
+    for _m in messages:
+        _tp = TopicPartition(_m.topic, _m.partition)
+        first[_tp] = min(first.get(_tp, _m.offset), _m.offset)
+    for _tp, _offset in first.items():
+        consumer.seek(_tp, _offset)
+
+
+# +
+# (hidden) function: _rows_by_packet()
+# -
+def _rows_by_packet(worker=0, packets=None, rejected=0):
+    """ transform packets one at a time so that a malformed packet cannot sink its batch """
+    rows, kept = [], []
+    for _data, _packet in packets:
+        try:
+            rows.append(packet_to_row(_packet))
+            kept.append((_data, _packet))
+        except Exception as e:
+            rejected += 1
+            logger.error(f'Worker {worker} unable to transform candid {_packet.get("candid")}, error={e}')
+    return rows, kept, rejected
+
+
+# +
+# function: consume_batches()
+# -
+# noinspection PyBroadException
+def consume_batches(worker=0, batch_size=BATCH_SIZE, batch_ms=BATCH_MS, writer=WRITERS[0], stop=None,
+                    on_conflict=CONFLICT_ACTIONS[0]):
+
+    # get consumer (offsets are committed by hand once a batch is durable)
+    try:
+        consumer = KafkaConsumer(bootstrap_servers=f'{PRODUCER_HOST}:{PRODUCER_PORT}', group_id=GROUP_ID,
+                                 enable_auto_commit=False, max_poll_records=batch_size)
+        consumer.subscribe(pattern=TOPIC)
+        logger.info(f'Worker {worker} subscribed to Kafka topic',
+                    extra={'tags': {'subscribed_topics': list(consumer.subscription())}})
+    except Exception as e:
+        logger.error(f'Worker {worker} failed to subscribe to Kafka {PRODUCER_HOST}:{PRODUCER_PORT} '
+                     f'for group {GROUP_ID}, error={e}')
+        return
+
+    # process micro-batch(es)
+    with app.app_context():
+        while stop is None or not stop.is_set():
+
+            messages = _poll_batch(consumer, batch_size, batch_ms)
+            if not messages:
+                continue
+            _start = time.monotonic()
+
+            # decode, then derive field(s) for the whole batch at once
+            packets, rejected = [], 0
+            for _m in messages:
+                try:
+                    packets.extend([(_m.value, _packet) for _packet in fastavro.reader(io.BytesIO(_m.value))])
+                except Exception as e:
+                    rejected += 1
+                    logger.error(f'Worker {worker} unable to decode message at offset {_m.offset}, error={e}')
+            METRICS.inc('sassy_ingest_alerts_decoded_total', len(packets))
+            try:
+                rows = packets_to_rows([_packet for _data, _packet in packets])
+            except Exception as e:
+                logger.warn(f'Worker {worker} unable to transform batch, falling back to per-packet, error={e}')
+                rows, packets, rejected = _rows_by_packet(worker, packets, rejected)
+
+            # write, then commit offsets only once the batch is durable
+            try:
+                inserted, updated, skipped = write_batch(rows, writer, on_conflict)
+            except (exc.SQLAlchemyError, psycopg2.Error) as e:
+                db.session.rollback()
+                logger.error(f'Worker {worker} failed to write batch, retrying in {BATCH_RETRY_SECONDS}s, error={e}')
+                _rewind_batch(consumer, messages)
+                time.sleep(BATCH_RETRY_SECONDS)
+                continue
+            consumer.commit()
+            METRICS.inc('sassy_ingest_alerts_rejected_total', rejected)
+            record_lag(consumer)
+
+            # if archiving (S3 and/or local), queue the file(s)
+            if get_archivers():
+                for _data, _packet in packets:
+                    upload_avro(_data, '{}.avro'.format(_packet['candid']), _packet)
+
+            # report
+            _elapsed = time.monotonic() - _start
+            logger.info(f'Worker {worker} batch of {len(messages)} message(s): inserted={inserted}, '
+                        f'updated={updated}, skipped={skipped}, rejected={rejected}, elapsed={_elapsed:.3f}s, '
+                        f'rate={len(messages) / max(_elapsed, 1.0e-6):.1f} alerts/s')
+
+    consumer.close()
+
+
+# +
+# function: start_batch_consumer()
+# -
+def start_batch_consumer(workers=BATCH_WORKERS, batch_size=BATCH_SIZE, batch_ms=BATCH_MS, writer=WRITERS[0],
+                         on_conflict=CONFLICT_ACTIONS[0]):
+
+    # check input(s)
+    workers = workers if (isinstance(workers, int) and workers > 0) else BATCH_WORKERS
+    batch_size = batch_size if (isinstance(batch_size, int) and batch_size > 0) else BATCH_SIZE
+    batch_ms = batch_ms if (isinstance(batch_ms, int) and batch_ms > 0) else BATCH_MS
+
+    # one consumer per worker, kafka balances the topic partitions across the group
+    stop = threading.Event()
+    threads = [threading.Thread(target=consume_batches, name=f'ingest-{_w}',
+                                args=(_w, batch_size, batch_ms, writer, stop, on_conflict), daemon=True)
+               for _w in range(workers)]
+    for _t in threads:
+        _t.start()
+    logger.info(f'Started {workers} batch consumer(s), batch_size={batch_size}, batch_ms={batch_ms}, '
+                f'writer={writer}, on_conflict={on_conflict}')
+
+    try:
+        for _t in threads:
+            _t.join()
+    except KeyboardInterrupt:
+        logger.info('Stopping batch consumer(s)')
+        stop.set()
+        for _t in threads:
+            _t.join()
+
+
 # +
 # main()
 # -
 if __name__ == '__main__':
+
+    # get command line argument(s)
+    # noinspection PyTypeChecker
+    _parser = argparse.ArgumentParser(description='Ingest ZTF alerts from Kafka',
+                                      formatter_class=argparse.RawTextHelpFormatter)
+    _parser.add_argument('--batch', default=False, action='store_true',
+                         help="""if present, ingest in micro-batches using a pool of consumers""")
+    _parser.add_argument('--workers', default=BATCH_WORKERS, type=int,
+                         help="""number of consumer workers, defaults to %(default)s""")
+    _parser.add_argument('--batch-size', default=BATCH_SIZE, type=int,
+                         help="""maximum alerts per batch, defaults to %(default)s""")
+    _parser.add_argument('--batch-ms', default=BATCH_MS, type=int,
+                         help="""maximum milliseconds to wait for a batch to fill, defaults to %(default)s""")
+    _parser.add_argument('--writer', default=WRITERS[0], choices=WRITERS,
+                         help="""batch writer (multi-row insert or COPY format), defaults to %(default)s""")
+    _parser.add_argument('--on-conflict', default=CONFLICT_ACTIONS[0], choices=CONFLICT_ACTIONS,
+                         help="""action when alert_candid already exists (skip or overwrite), defaults to %(default)s""")
+    _parser.add_argument('--archive-dir', default='',
+                         help="""if present, also write each packet to <dir>/YYYY/MM/DD/<candid>.avro, eg %s""" %
+                         ARCHIVE_ROOT)
+    _parser.add_argument('--rebuild-latest', default=False, action='store_true',
+                         help="""if present, rebuild latest_alert_per_object from the alert table and exit""")
+    _parser.add_argument('--metrics-port', default=0, type=int,
+                         help="""if > 0, serve Prometheus metrics on this port, defaults to %(default)s""")
+    _parser.add_argument('--stats-seconds', default=0.0, type=float,
+                         help="""if > 0, log ingest rates every this many seconds, defaults to %(default)s""")
+    args = _parser.parse_args()
+
+    # execute
+    if args.archive_dir.strip() != '':
+        set_local_archive(args.archive_dir)
+    start_metrics_server(args.metrics_port)
+    start_stats_logger(args.stats_seconds)
     db.create_all()
-    start_consumer()
+    if args.rebuild_latest:
+        logger.info(f'Rebuilt latest_alert_per_object with {ztf_latest_rebuild(db.session)} objects')
+    elif args.batch:
+        start_batch_consumer(args.workers, args.batch_size, args.batch_ms, args.writer, args.on_conflict)
+    else:
+        start_consumer(args.on_conflict)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from src import jd_to_path
+from src.utils.utils import UtilsLogger
+
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import BotoCoreError
+from botocore.exceptions import ClientError
+
+import atexit
+import boto3
+import io
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    Archive ingested AVRO packets from a pool of background threads so that ingest never waits on storage.
+
+    S3Uploader puts each packet to S3, retrying with exponential backoff and sending large objects as
+    multipart uploads. Set S3_ENDPOINT_URL to point at a local stand-in (moto server, MinIO) for testing.
+
+    LocalArchiver writes each packet into the YYYY/MM/DD/<candid>.avro layout served by the web app
+    (the first SASSY_ZTF_AVRO directory by default) via a temporary file and an atomic rename.
+
+    >>> from src.ingest_archive import S3Uploader, packet_key
+    >>> uploader = S3Uploader('my-bucket', workers=4).start()
+    >>> uploader.submit(data, packet_key(packet))
+    >>> uploader.close()
+"""
+
+
+# +
+# constant(s)
+# -
+AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID", None)
+AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY", None)
+AWS_USE_S3 = False if AWS_ACCESS_KEY is None else True
+BUCKET_NAME = os.getenv("S3_BUCKET", None)
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", None)
+
+ARCHIVE_BUFFER = 1024 * 1024
+ARCHIVE_MODE = 0o644
+ARCHIVE_RETRIES = 2
+ARCHIVE_ROOT = os.getenv("SASSY_ZTF_AVRO", "/dataraid6/ztf:/data/ztf").split(':')[0]
+ARCHIVE_WORKERS = 2
+
+STOP = None
+
+UPLOAD_BACKOFF = 0.5
+UPLOAD_BACKOFF_MAX = 30.0
+UPLOAD_CONTENT_TYPE = 'avro/binary'
+UPLOAD_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+UPLOAD_QUEUE_DEPTH = 1000
+UPLOAD_RETRIES = 5
+UPLOAD_WORKERS = 8
+
+
+# +
+# logging
+# -
+logger = UtilsLogger('ingest_archive').logger
+
+
+# +
+# function: packet_key()
+# -
+def packet_key(packet=None, fname=''):
+    """ return the archive key 'YYYY/MM/DD/<candid>.avro' for a packet """
+    if packet is None or 'candidate' not in packet:
+        return fname
+    fname = fname if (isinstance(fname, str) and fname.strip() != '') else f"{packet.get('candid')}.avro"
+    return f"{jd_to_path(packet['candidate'].get('jd'))}{fname}"
+
+
+# +
+# function: write_avro()
+# -
+def write_avro(root='', key='', data=None, overwrite=False):
+    """ write data to <root>/<key> through a temporary file and an atomic rename, returns the path """
+
+    # check input(s)
+    if not isinstance(root, str) or root.strip() == '' or not isinstance(key, str) or key.strip() == '':
+        raise Exception('write_avro() entry: root or key is empty')
+    if data is None:
+        raise Exception('write_avro() entry: data is empty')
+
+    _path = os.path.join(os.path.abspath(os.path.expanduser(root)), key)
+    if not overwrite and os.path.exists(_path):
+        return _path
+    _dir = os.path.dirname(_path)
+    os.makedirs(_dir, exist_ok=True)
+
+    # readers never see a partial file: write alongside the target, then rename over it
+    _fd, _tmp = tempfile.mkstemp(dir=_dir, prefix=f'.{os.path.basename(_path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(_fd, 'wb', buffering=ARCHIVE_BUFFER) as _f:
+            _f.write(data)
+        os.chmod(_tmp, ARCHIVE_MODE)
+        os.replace(_tmp, _path)
+    except Exception:
+        if os.path.exists(_tmp):
+            os.remove(_tmp)
+        raise
+    return _path
+
+
+# +
+# class: ArchiveQueue()
+# -
+class ArchiveQueue(object):
+
+    # +
+    # method: __init__()
+    # -
+    def __init__(self, name='archive', workers=UPLOAD_WORKERS, depth=UPLOAD_QUEUE_DEPTH, retries=UPLOAD_RETRIES,
+                 backoff=UPLOAD_BACKOFF, errors=(OSError,)):
+
+        # private variable(s)
+        self.__name = name
+        self.__workers = workers if (isinstance(workers, int) and workers > 0) else UPLOAD_WORKERS
+        self.__retries = retries if (isinstance(retries, int) and retries >= 0) else UPLOAD_RETRIES
+        self.__backoff = backoff if (isinstance(backoff, (int, float)) and backoff > 0.0) else UPLOAD_BACKOFF
+        self.__errors = errors
+        self.__queue = queue.Queue(maxsize=depth if (isinstance(depth, int) and depth > 0) else UPLOAD_QUEUE_DEPTH)
+        self.__threads = []
+        self.__lock = threading.Lock()
+        self.__counts = {'stored': 0, 'failed': 0, 'retried': 0}
+
+    # +
+    # property(s)
+    # -
+    @property
+    def counts(self):
+        with self.__lock:
+            return dict(self.__counts, pending=self.__queue.qsize())
+
+    @property
+    def depth(self):
+        return self.__queue.qsize()
+
+    @property
+    def name(self):
+        return self.__name
+
+    # +
+    # method: store()
+    # -
+    def store(self, data=None, key=''):
+        """ store one object, implemented by each archive """
+        raise NotImplementedError(f'{self.__class__.__name__}.store()')
+
+    # +
+    # method: start()
+    # -
+    def start(self):
+        """ start the worker thread(s) """
+        if not self.__threads:
+            self.__threads = [threading.Thread(target=self.__run, name=f'{self.__name}-{_w}', daemon=True)
+                              for _w in range(self.__workers)]
+            for _t in self.__threads:
+                _t.start()
+            logger.info(f'Started {self.__workers} {self.__name} worker(s)')
+        return self
+
+    # +
+    # method: submit()
+    # -
+    def submit(self, data=None, key='', timeout=None):
+        """ queue data for storage under key, blocks (up to timeout) while the queue is full """
+        if data is None or not isinstance(key, str) or key.strip() == '':
+            raise Exception(f'{self.__class__.__name__}.submit() entry: data or key is empty')
+        if not self.__threads:
+            self.start()
+        _data = data.tobytes() if isinstance(data, memoryview) else data
+        self.__queue.put((_data, key), timeout=timeout)
+
+    # +
+    # method: close()
+    # -
+    def close(self, timeout=None):
+        """ drain the queue and stop the worker thread(s) """
+        if not self.__threads:
+            return
+        for _ in self.__threads:
+            self.__queue.put(STOP)
+        for _t in self.__threads:
+            _t.join(timeout)
+        self.__threads = []
+        logger.info(f'Stopped {self.__name} worker(s), counts={self.counts}')
+
+    # +
+    # (hidden) method: __run()
+    # -
+    def __run(self):
+        while True:
+            _item = self.__queue.get()
+            if _item is STOP:
+                break
+            _data, _key = _item
+            for _attempt in range(self.__retries + 1):
+                try:
+                    self.store(_data, _key)
+                    with self.__lock:
+                        self.__counts['stored'] += 1
+                    logger.debug(f'Successfully stored file in {self.__name}', extra={'tags': {'filename': _key}})
+                    break
+                except self.__errors as e:
+                    if _attempt == self.__retries:
+                        with self.__lock:
+                            self.__counts['failed'] += 1
+                        logger.warn(f'Failed to store file in {self.__name} (e={e})',
+                                    extra={'tags': {'filename': _key}})
+                        break
+                    with self.__lock:
+                        self.__counts['retried'] += 1
+                    _delay = min(UPLOAD_BACKOFF_MAX, self.__backoff * 2 ** _attempt)
+                    time.sleep(_delay * random.uniform(0.5, 1.0))
+
+                # anything else is not worth retrying, but must not kill the worker (and so block submit())
+                except Exception as e:
+                    with self.__lock:
+                        self.__counts['failed'] += 1
+                    logger.error(f'Failed to store file in {self.__name} (unexpected e={e!r})',
+                                 extra={'tags': {'filename': _key}})
+                    break
+
+
+# +
+# class: S3Uploader()
+# -
+class S3Uploader(ArchiveQueue):
+
+    # +
+    # method: __init__()
+    # -
+    def __init__(self, bucket=BUCKET_NAME, workers=UPLOAD_WORKERS, depth=UPLOAD_QUEUE_DEPTH,
+                 retries=UPLOAD_RETRIES, backoff=UPLOAD_BACKOFF, client=None, endpoint_url=S3_ENDPOINT_URL):
+
+        # check input(s)
+        if not isinstance(bucket, str) or bucket.strip() == '':
+            raise Exception('S3Uploader() entry: bucket is empty')
+        super().__init__(f's3-{bucket}', workers, depth, retries, backoff,
+                         (BotoCoreError, ClientError, S3UploadFailedError))
+
+        # boto3 clients are thread-safe, one is shared by every worker
+        self.__bucket = bucket
+        self.__client = client if client is not None else boto3.client(
+            's3', endpoint_url=endpoint_url, aws_access_key_id=AWS_ACCESS_KEY,
+            aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+        self.__config = TransferConfig(multipart_threshold=UPLOAD_MULTIPART_THRESHOLD, use_threads=False)
+
+    # +
+    # method: store()
+    # -
+    def store(self, data=None, key=''):
+        """ upload one object (as a multipart upload above UPLOAD_MULTIPART_THRESHOLD) """
+        self.__client.upload_fileobj(
+            io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data, self.__bucket, key,
+            ExtraArgs={'ContentDisposition': f'attachment; filename={key}', 'ContentType': UPLOAD_CONTENT_TYPE},
+            Config=self.__config)
+
+
+# +
+# class: LocalArchiver()
+# -
+class LocalArchiver(ArchiveQueue):
+
+    # +
+    # method: __init__()
+    # -
+    def __init__(self, root=ARCHIVE_ROOT, workers=ARCHIVE_WORKERS, depth=UPLOAD_QUEUE_DEPTH,
+                 retries=ARCHIVE_RETRIES, backoff=UPLOAD_BACKOFF, overwrite=False):
+
+        # check input(s)
+        if not isinstance(root, str) or root.strip() == '':
+            raise Exception('LocalArchiver() entry: root is empty')
+        super().__init__(f'local-{os.path.basename(root.rstrip(os.sep))}', workers, depth, retries, backoff,
+                         (OSError,))
+        self.__root = os.path.abspath(os.path.expanduser(root))
+        self.__overwrite = overwrite
+
+    # +
+    # method: store()
+    # -
+    def store(self, data=None, key=''):
+        """ write one object into <root>/YYYY/MM/DD/<candid>.avro """
+        write_avro(self.__root, key, data, self.__overwrite)
+
+
+# +
+# function: get_uploader(), get_archivers(), set_local_archive()
+# -
+_ARCHIVERS = {}
+_ARCHIVERS_LOCK = threading.Lock()
+
+
+def get_uploader():
+    """ return the process-wide S3 uploader (created and started on first use), or None if S3 is not configured """
+    if not AWS_USE_S3 or BUCKET_NAME is None:
+        return None
+    with _ARCHIVERS_LOCK:
+        if 's3' not in _ARCHIVERS:
+            _ARCHIVERS['s3'] = S3Uploader(BUCKET_NAME).start()
+            atexit.register(_ARCHIVERS['s3'].close)
+    return _ARCHIVERS['s3']
+
+
+def set_local_archive(root=ARCHIVE_ROOT, overwrite=False):
+    """ enable the process-wide local archive under root, returns the archiver """
+    with _ARCHIVERS_LOCK:
+        if 'local' in _ARCHIVERS:
+            _ARCHIVERS['local'].close()
+        _ARCHIVERS['local'] = LocalArchiver(root, overwrite=overwrite).start()
+        atexit.register(_ARCHIVERS['local'].close)
+    logger.info(f'Archiving AVRO packet(s) under {root}')
+    return _ARCHIVERS['local']
+
+
+def get_archivers():
+    """ return every active archive (S3 and/or local) """
+    _uploader = get_uploader()
+    with _ARCHIVERS_LOCK:
+        _local = _ARCHIVERS.get('local', None)
+    return [_a for _a in (_uploader, _local) if _a is not None]
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+from src.ingest_archive import ArchiveQueue
+from src.ingest_archive import S3Uploader
+
+import time
+
+
+# +
+# __doc__
+# -
+__doc__ = """
+    % python3 -m pytest -p no:warnings ingest_archive_test.py
+"""
+
+
+# +
+# constant(s)
+# -
+TEST_BUCKET = 'sassy-test'
+TEST_DATA = b'Obj\x01' + bytes(range(256)) * 4
+TEST_KEY = '2020/06/01/1234567890123456789.avro'
+TEST_TIMEOUT = 10.0
+
+
+# +
+# (hidden) function: _mock_aws()
+# -
+def _mock_aws():
+    return moto.mock_aws() if hasattr(moto, 'mock_aws') else moto.mock_s3()
+
+
+# +
+# (hidden) function: _wait()
+# -
+def _wait(archive=None, total=0, timeout=TEST_TIMEOUT):
+    _end = time.monotonic() + timeout
+    while time.monotonic() < _end:
+        _counts = archive.counts
+        if _counts['stored'] + _counts['failed'] >= total and _counts['pending'] == 0:
+            return _counts
+        time.sleep(0.01)
+    return archive.counts
+
+
+# +
+# class: _Broken(), inherits from ArchiveQueue
+# -
+class _Broken(ArchiveQueue):
+    def store(self, data=None, key=''):
+        raise ValueError(f'cannot store {key}')
+
+
+# +
+# test: S3Uploader() stores an object
+# -
+def test_s3_uploader_stored():
+    with _mock_aws():
+        _client = boto3.client('s3', region_name='us-east-1')
+        _client.create_bucket(Bucket=TEST_BUCKET)
+        _uploader = S3Uploader(TEST_BUCKET, workers=1, retries=0, client=_client).start()
+        _uploader.submit(TEST_DATA, TEST_KEY)
+        assert _wait(_uploader, 1)['stored'] == 1
+        _uploader.close()
+        assert _client.get_object(Bucket=TEST_BUCKET, Key=TEST_KEY)['Body'].read() == TEST_DATA
+
+
+# +
+# test: S3Uploader() retries a failing put (S3UploadFailedError), counts it as failed and keeps working
+# -
+def test_s3_uploader_failed_put():
+    with _mock_aws():
+        _client = boto3.client('s3', region_name='us-east-1')
+        _uploader = S3Uploader(TEST_BUCKET, workers=1, depth=1, retries=1, backoff=0.01, client=_client).start()
+        _uploader.submit(TEST_DATA, TEST_KEY, timeout=TEST_TIMEOUT)
+        _counts = _wait(_uploader, 1)
+        assert _counts['failed'] == 1 and _counts['retried'] == 1
+
+        # the worker survived: more submissions than the queue depth neither block nor get lost
+        _client.create_bucket(Bucket=TEST_BUCKET)
+        for _i in range(3):
+            _uploader.submit(TEST_DATA, f'{_i}-{TEST_KEY}', timeout=TEST_TIMEOUT)
+        assert _wait(_uploader, 4)['stored'] == 3
+        _uploader.close()
+
+
+# +
+# test: ArchiveQueue() workers survive an unexpected exception
+# -
+def test_archive_queue_unexpected_error():
+    _archive = _Broken('broken', workers=1, depth=1, retries=3, backoff=0.01).start()
+    for _i in range(3):
+        _archive.submit(TEST_DATA, f'{_i}-{TEST_KEY}', timeout=TEST_TIMEOUT)
+    _counts = _wait(_archive, 3)
+    assert _counts['failed'] == 3 and _counts['retried'] == 0
+    _archive.close()
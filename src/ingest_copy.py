@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from src.models.ztf import ZtfAlert
+from src.models.ztf import db
+from src.utils.utils import UtilsLogger
+
+import io
+import math
+import struct
+import time
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    Bulk load alert rows (as built by src.ingest.packet_to_row()) with PostgreSQL COPY FROM STDIN.
+
+    Rows are streamed into a temporary staging table that mirrors the alert table except that
+    location is plain text, then moved into alert with INSERT ... SELECT so that the geography
+    is built server-side by ST_GeogFromText(). Both CSV and binary COPY formats are supported.
+
+    Rows whose alert_candid already exists are skipped (ON CONFLICT DO NOTHING) or overwritten
+    (ON CONFLICT DO UPDATE) so that replaying a tarball or Kafka partition is idempotent.
+
+    >>> from src.ingest_copy import copy_rows
+    >>> with app.app_context():
+    ...     copy_rows(rows, 'binary')
+"""
+
+
+# +
+# constant(s)
+# -
+CONFLICT_ACTIONS = ['nothing', 'update']
+CONFLICT_KEY = 'alert_candid'
+COPY_FORMATS = ['csv', 'binary']
+COPY_TABLE = 'alert_copy'
+
+PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('>h', -1)
+
+
+# +
+# logging
+# -
+logger = UtilsLogger('ingest_copy').logger
+
+
+# +
+# (hidden) function: _column_kind()
+# -
+def _column_kind(column=None):
+    _type = column.type
+    if isinstance(_type, db.BigInteger):
+        return 'int8'
+    elif isinstance(_type, db.SmallInteger):
+        return 'int2'
+    elif isinstance(_type, db.Integer):
+        return 'int4'
+    elif isinstance(_type, db.Float):
+        return 'float8'
+    else:
+        return 'text'
+
+
+# +
+# constant(s) derived from the model (location is staged as text)
+# -
+COPY_COLUMNS = [(_c.name, 'text' if _c.name == 'location' else _column_kind(_c))
+                for _c in ZtfAlert.__table__.columns if not _c.primary_key]
+COPY_NAMES = ', '.join([f'"{_n}"' for _n, _k in COPY_COLUMNS])
+COPY_SELECT = ', '.join([f'ST_GeogFromText("{_n}")' if _n == 'location' else f'"{_n}"' for _n, _k in COPY_COLUMNS])
+COPY_STAGE = ', '.join([f'"{_n}"::text AS "{_n}"' if _n == 'location' else f'"{_n}"' for _n, _k in COPY_COLUMNS])
+COPY_UPDATE = ', '.join([f'"{_n}" = EXCLUDED."{_n}"' for _n, _k in COPY_COLUMNS if _n != CONFLICT_KEY])
+
+
+# +
+# function: conflict_clause()
+# -
+def conflict_clause(action=CONFLICT_ACTIONS[0]):
+    """ return the ON CONFLICT clause for the alert_candid unique index """
+    if action == 'update':
+        return f'ON CONFLICT ("{CONFLICT_KEY}") DO UPDATE SET {COPY_UPDATE}'
+    return f'ON CONFLICT ("{CONFLICT_KEY}") DO NOTHING'
+
+
+# +
+# (hidden) function: _float_text()
+# -
+def _float_text(value=math.nan):
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    elif math.isinf(value):
+        return 'Infinity' if value > 0.0 else '-Infinity'
+    return repr(value)
+
+
+# +
+# (hidden) function: _csv_field()
+# -
+def _csv_field(value=None, kind='text'):
+    if value is None:
+        return ''
+    elif kind == 'float8':
+        return _float_text(value)
+    elif kind in ['int2', 'int4', 'int8']:
+        return f'{int(value)}'
+    _value = f'{value}'.replace('"', '""')
+    return f'"{_value}"'
+
+
+# +
+# (hidden) function: _binary_field()
+# -
+def _binary_field(value=None, kind='text'):
+    if value is None:
+        return b'\xff\xff\xff\xff'
+    elif kind == 'float8':
+        return b'\x00\x00\x00\x08' + struct.pack('>d', float(value))
+    elif kind == 'int8':
+        return b'\x00\x00\x00\x08' + struct.pack('>q', int(value))
+    elif kind == 'int4':
+        return b'\x00\x00\x00\x04' + struct.pack('>i', int(value))
+    elif kind == 'int2':
+        return b'\x00\x00\x00\x02' + struct.pack('>h', int(value))
+    _value = f'{value}'.encode('utf-8')
+    return struct.pack('>i', len(_value)) + _value
+
+
+# +
+# function: rows_to_csv()
+# -
+def rows_to_csv(rows=None):
+    """ encode rows as a COPY (FORMAT csv) stream """
+    _buffer = io.StringIO()
+    for _row in rows:
+        _buffer.write(','.join([_csv_field(_row.get(_n), _k) for _n, _k in COPY_COLUMNS]))
+        _buffer.write('\n')
+    _buffer.seek(0)
+    return _buffer
+
+
+# +
+# function: rows_to_binary()
+# -
+def rows_to_binary(rows=None):
+    """ encode rows as a COPY (FORMAT binary) stream """
+    _buffer = io.BytesIO()
+    _buffer.write(PGCOPY_HEADER)
+    _count = struct.pack('>h', len(COPY_COLUMNS))
+    for _row in rows:
+        _buffer.write(_count)
+        _buffer.write(b''.join([_binary_field(_row.get(_n), _k) for _n, _k in COPY_COLUMNS]))
+    _buffer.write(PGCOPY_TRAILER)
+    _buffer.seek(0)
+    return _buffer
+
+
+# +
+# function: copy_rows()
+# -
+def copy_rows(rows=None, fmt=COPY_FORMATS[0], session=None, on_conflict=CONFLICT_ACTIONS[0]):
+    """ stream rows into alert via COPY FROM STDIN and commit, returns (inserted, updated) """
+
+    # check input(s)
+    if not rows:
+        return 0, 0
+    fmt = fmt.lower() if (isinstance(fmt, str) and fmt.lower() in COPY_FORMATS) else COPY_FORMATS[0]
+    on_conflict = on_conflict if on_conflict in CONFLICT_ACTIONS else CONFLICT_ACTIONS[0]
+    session = session if session is not None else db.session
+
+    # encode
+    _start = time.monotonic()
+    _stream = rows_to_binary(rows) if fmt == 'binary' else rows_to_csv(rows)
+
+    # stage and move within the session's transaction
+    try:
+        _cursor = session.connection().connection.cursor()
+        _cursor.execute(f'CREATE TEMPORARY TABLE IF NOT EXISTS {COPY_TABLE} ON COMMIT DELETE ROWS AS '
+                        f'SELECT {COPY_STAGE} FROM alert WITH NO DATA')
+        _cursor.copy_expert(f'COPY {COPY_TABLE} ({COPY_NAMES}) FROM STDIN WITH (FORMAT {fmt})', _stream)
+        # xmax is zero only for freshly inserted tuples, so RETURNING separates inserts from updates
+        _cursor.execute(f'INSERT INTO alert ({COPY_NAMES}) SELECT {COPY_SELECT} FROM {COPY_TABLE} '
+                        f'{conflict_clause(on_conflict)} RETURNING (xmax = 0)')
+        _returned = [_r[0] for _r in _cursor.fetchall()]
+        _inserted, _updated = sum(_returned), len(_returned) - sum(_returned)
+        _cursor.close()
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    # report
+    _elapsed = time.monotonic() - _start
+    logger.info(f'COPY ({fmt}) of {len(rows)} row(s) inserted {_inserted}, updated {_updated}, '
+                f'skipped {len(rows) - _inserted - _updated} in {_elapsed:.3f}s '
+                f'({len(rows) / max(_elapsed, 1.0e-6):.1f} rows/s)')
+    return _inserted, _updated
@@ -5,13 +5,33 @@
 # import(s)
 # -
 
-from src.ingest import do_ingest
+from src.app import app
+from src.ingest import CONFLICT_ACTIONS
+from src.ingest import WRITERS
+from src.ingest import ingest_bytes
+from src.ingest import packet_to_row
+from src.ingest import packets_to_rows
+from src.ingest import upload_avro
+from src.ingest_archive import ARCHIVE_ROOT
+from src.ingest_archive import get_archivers
+from src.ingest_archive import get_uploader
+from src.ingest_archive import packet_key
+from src.ingest_archive import set_local_archive
+from src.ingest_archive import write_avro
+from src.ingest import write_batch
 from src.utils.utils import *
 
+from concurrent.futures import ProcessPoolExecutor
+
 import argparse
-import base64
+import collections
+import fastavro
+import io
+import queue
 import sys
 import tarfile
+import threading
+import time
 
 
 # +
@@ -22,23 +42,64 @@ __doc__ = """
 """
 
 
+# +
+# constant(s)
+# -
+PARSE_CHUNK = 64
+QUEUE_DEPTH = 4
+STOP = None
+
+
 # +
 # logging
 # -
 logger = UtilsLogger('ingest_from_gzip').logger
 
 
+# +
+# (hidden) function: _flush()
+# -
+def _flush(rows=None, writer=WRITERS[0], totals=None, on_conflict=CONFLICT_ACTIONS[0]):
+    _start = time.monotonic()
+    _inserted, _updated, _skipped = write_batch(rows, writer, on_conflict)
+    _elapsed = time.monotonic() - _start
+    totals['inserted'] += _inserted
+    totals['updated'] += _updated
+    totals['skipped'] += _skipped
+    logger.info(f'wrote batch of {len(rows)} row(s) with {writer}: inserted={_inserted}, updated={_updated}, '
+                f'skipped={_skipped}, elapsed={_elapsed:.3f}s, rate={len(rows) / max(_elapsed, 1.0e-6):.1f} alerts/s')
+
+
+# +
+# (hidden) function: _transform()
+# -
+def _transform(packets=None):
+    """ packets to rows for the whole batch, falling back to one at a time if any packet is malformed """
+    try:
+        return packets_to_rows(packets), []
+    except Exception:
+        rows, errors = [], []
+        for _packet in packets:
+            try:
+                rows.append(packet_to_row(_packet))
+            except Exception as e:
+                errors.append(f'unable to transform candid {_packet.get("candid")}, error={e}')
+        return rows, errors
+
+
 # +
 # function: read_avro_file()
 # -
-def read_avro_file(infile=''):
+def read_avro_file(infile='', batch_size=0, writer=WRITERS[0], on_conflict=CONFLICT_ACTIONS[0]):
 
     # check input(s)
     if not os.path.isfile(infile):
         raise Exception('read_avros() entry: infile is empty')
+    batch_size = batch_size if (isinstance(batch_size, int) and batch_size > 0) else 0
 
     # read file
-    with tarfile.open(name=infile, mode='r|gz') as _tar:
+    packets, totals = [], {'inserted': 0, 'updated': 0, 'skipped': 0}
+    with app.app_context(), tarfile.open(name=infile, mode='r|gz') as _tar:
 
         # do while ...
         while True:
@@ -51,9 +112,178 @@ def read_avro_file(infile=''):
                 break
 
             with _tar.extractfile(member) as _f:
-                fencoded = base64.b64encode(_f.read()).decode('UTF-8')
-                logger.info('ingesting {}'.format(member.name))
-                do_ingest(fencoded)
+
+                # one alert at a time
+                if batch_size == 0:
+                    logger.info('ingesting {}'.format(member.name))
+                    ingest_bytes(_f.read(), on_conflict)
+                    continue
+
+                # or accumulate packets and transform and write them in bulk
+                try:
+                    _data = _f.read()
+                    _packets = list(fastavro.reader(io.BytesIO(_data)))
+                except Exception as e:
+                    logger.error(f'unable to decode {member.name}, error={e}')
+                    continue
+                packets.extend(_packets)
+                if get_archivers():
+                    for _packet in _packets:
+                        upload_avro(_data, f"{_packet['candid']}.avro", _packet)
+
+            if len(packets) >= batch_size:
+                _flush_packets(packets, writer, totals, on_conflict)
+                packets = []
+
+        # flush remainder
+        if packets:
+            _flush_packets(packets, writer, totals, on_conflict)
+
+    if batch_size > 0:
+        logger.info(f"ingested {infile}: inserted={totals['inserted']}, updated={totals['updated']}, "
+                    f"skipped={totals['skipped']}")
+
+
+# +
+# (hidden) function: _flush_packets()
+# -
+def _flush_packets(packets=None, writer=WRITERS[0], totals=None, on_conflict=CONFLICT_ACTIONS[0]):
+    rows, errors = _transform(packets)
+    for _e in errors:
+        logger.error(_e)
+    if rows:
+        _flush(rows, writer, totals, on_conflict)
+
+
+# +
+# (hidden) function: _parse_members()
+# -
+def _parse_members(members=None, archive_dir=''):
+    """ runs in a worker process: decode (and archive) a chunk of tar members and transform them as one batch,
+        returns (members, rows, errors, keys) where keys are the (member index, archive key) of every packet """
+    packets, errors, keys = [], [], []
+    for _index, (_name, _data) in enumerate(members):
+        try:
+            _packets = list(fastavro.reader(io.BytesIO(_data)))
+        except Exception as e:
+            errors.append(f'unable to decode {_name}, error={e}')
+            continue
+        packets.extend(_packets)
+        keys.extend([(_index, packet_key(_packet, f"{_packet['candid']}.avro")) for _packet in _packets])
+        for _packet in (_packets if archive_dir else []):
+            try:
+                write_avro(archive_dir, packet_key(_packet), _data)
+            except Exception as e:
+                errors.append(f'unable to archive {_name}, error={e}')
+    rows, _errors = _transform(packets)
+    return len(members), rows, errors + _errors, keys
+
+
+# +
+# (hidden) function: _read_members()
+# -
+# noinspection PyBroadException
+def _read_members(infile='', members=None, errors=None):
+    """ reader stage: stream tar members onto a bounded queue """
+    try:
+        with tarfile.open(name=infile, mode='r|gz') as _tar:
+            for _member in _tar:
+                if not _member.isfile():
+                    continue
+                with _tar.extractfile(_member) as _f:
+                    members.put((_member.name, _f.read()))
+    except Exception as e:
+        errors.append(f'reader failed on {infile}, error={e}')
+    finally:
+        members.put(STOP)
+
+
+# +
+# (hidden) function: _write_rows()
+# -
+# noinspection PyBroadException
+def _write_rows(rows_queue=None, batch_size=0, writer=WRITERS[0], totals=None, errors=None,
+                on_conflict=CONFLICT_ACTIONS[0]):
+    """ writer stage: batch decoded rows into bulk writes """
+    rows = []
+    with app.app_context():
+        while True:
+            _rows = rows_queue.get()
+            if _rows is not STOP:
+                rows.extend(_rows)
+            if rows and (_rows is STOP or len(rows) >= batch_size):
+                try:
+                    _flush(rows, writer, totals, on_conflict)
+                except Exception as e:
+                    errors.append(f'writer failed on batch of {len(rows)} row(s), error={e}')
+                rows = []
+            if _rows is STOP:
+                break
+
+
+# +
+# function: read_avro_file_pipelined()
+# -
+def read_avro_file_pipelined(infile='', workers=4, batch_size=1000, writer=WRITERS[0],
+                             on_conflict=CONFLICT_ACTIONS[0], archive_dir=''):
+
+    # check input(s)
+    if not os.path.isfile(infile):
+        raise Exception('read_avro_file_pipelined() entry: infile is empty')
+    workers = workers if (isinstance(workers, int) and workers > 0) else 4
+    batch_size = batch_size if (isinstance(batch_size, int) and batch_size > 0) else 1000
+
+    # bounded queues between the stages
+    members = queue.Queue(maxsize=QUEUE_DEPTH * workers)
+    rows_queue = queue.Queue(maxsize=QUEUE_DEPTH * workers)
+    totals, errors, decoded = {'inserted': 0, 'updated': 0, 'skipped': 0}, [], 0
+    _start = time.monotonic()
+
+    # the S3 uploader (if configured) is a thread pool in this process, so the bytes are queued from here
+    _uploader = get_uploader()
+
+    # reader -> process pool -> writer
+    with ProcessPoolExecutor(max_workers=workers) as _pool:
+        _reader = threading.Thread(target=_read_members, name='ingest-reader', args=(infile, members, errors),
+                                   daemon=True)
+        _writer = threading.Thread(target=_write_rows, name='ingest-writer',
+                                   args=(rows_queue, batch_size, writer, totals, errors, on_conflict), daemon=True)
+        _reader.start()
+        _writer.start()
+
+        # parse members in chunks of PARSE_CHUNK so each process transforms a batch at once, keep at
+        # most QUEUE_DEPTH * workers chunks in flight, and hand rows on in archive order
+        in_flight, chunk = collections.deque(), []
+        while True:
+            _item = members.get()
+            if _item is not STOP:
+                chunk.append(_item)
+            if chunk and (_item is STOP or len(chunk) >= PARSE_CHUNK):
+                in_flight.append((_pool.submit(_parse_members, chunk, archive_dir), chunk))
+                chunk = []
+            while in_flight and (_item is STOP or len(in_flight) >= QUEUE_DEPTH * workers or in_flight[0][0].done()):
+                _future, _chunk = in_flight.popleft()
+                _count, _rows, _errors, _keys = _future.result()
+                for _e in _errors:
+                    logger.error(_e)
+                decoded += _count
+                rows_queue.put(_rows)
+                for _index, _key in (_keys if _uploader is not None else []):
+                    _uploader.submit(_chunk[_index][1], _key)
+            if _item is STOP:
+                break
+
+        rows_queue.put(STOP)
+        _reader.join()
+        _writer.join()
+
+    # report
+    for _e in errors:
+        logger.error(_e)
+    _elapsed = time.monotonic() - _start
+    logger.info(f"ingested {infile}: members={decoded}, inserted={totals['inserted']}, "
+                f"updated={totals['updated']}, skipped={totals['skipped']}, elapsed={_elapsed:.3f}s, "
+                f"rate={decoded / max(_elapsed, 1.0e-6):.1f} alerts/s")
 
 
 # +
@@ -66,10 +296,27 @@ if __name__ == '__main__':
     _parser = argparse.ArgumentParser(description='Ingest AVRO file manually',
                                       formatter_class=argparse.RawTextHelpFormatter)
     _parser.add_argument('-f', '--file', default='', help="""Input file""")
+    _parser.add_argument('--batch-size', default=0, type=int,
+                         help="""alerts per bulk write, 0 ingests one alert at a time, defaults to %(default)s""")
+    _parser.add_argument('--workers', default=0, type=int,
+                         help="""parser processes for the pipelined reader, 0 reads serially, defaults to %(default)s""")
+    _parser.add_argument('--writer', default=WRITERS[0], choices=WRITERS,
+                         help="""bulk writer (multi-row insert or COPY format), defaults to %(default)s""")
+    _parser.add_argument('--on-conflict', default=CONFLICT_ACTIONS[0], choices=CONFLICT_ACTIONS,
+                         help="""action when alert_candid already exists (skip or overwrite), defaults to %(default)s""")
+    _parser.add_argument('--archive-dir', default='',
+                         help="""if present, also write each packet to <dir>/YYYY/MM/DD/<candid>.avro, eg %s""" %
+                         ARCHIVE_ROOT)
     args = _parser.parse_args()
 
     # execute
-    if os.path.isfile(os.path.abspath(os.path.expanduser(args.file))):
-        read_avro_file(os.path.abspath(os.path.expanduser(args.file)))
+    if args.archive_dir.strip() != '' and args.workers <= 0:
+        set_local_archive(args.archive_dir)
+    if os.path.isfile(os.path.abspath(os.path.expanduser(args.file))) and args.workers > 0:
+        read_avro_file_pipelined(os.path.abspath(os.path.expanduser(args.file)), args.workers,
+                                 args.batch_size, args.writer, args.on_conflict, args.archive_dir.strip())
+    elif os.path.isfile(os.path.abspath(os.path.expanduser(args.file))):
+        read_avro_file(os.path.abspath(os.path.expanduser(args.file)), args.batch_size, args.writer,
+                       args.on_conflict)
     else:
         print(f'<<ERROR>> Insufficient command line arguments specified\nUse: python3 {sys.argv[0]} --help')
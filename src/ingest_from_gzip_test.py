@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+import src.ingest_archive as ingest_archive
+import src.ingest_from_gzip as ingest_from_gzip
+
+import fastavro
+import io
+import tarfile
+
+
+# +
+# __doc__
+# -
+__doc__ = """
+    % python3 -m pytest -p no:warnings ingest_from_gzip_test.py
+"""
+
+
+# +
+# constant(s)
+# -
+TEST_ALERTS = 100
+TEST_BUCKET = 'sassy-test'
+TEST_CANDID = 1234567890000000000
+TEST_JD = 2459000.75
+TEST_SCHEMA = fastavro.parse_schema({
+    'type': 'record', 'name': 'alert', 'fields': [
+        {'name': 'objectId', 'type': 'string'}, {'name': 'candid', 'type': 'long'},
+        {'name': 'candidate', 'type': {'type': 'record', 'name': 'candidate',
+                                       'fields': [{'name': 'jd', 'type': 'double'}]}}]})
+
+
+# +
+# (hidden) function: _mock_aws()
+# -
+def _mock_aws():
+    return moto.mock_aws() if hasattr(moto, 'mock_aws') else moto.mock_s3()
+
+
+# +
+# (hidden) function: _tarball()
+# -
+def _tarball(path=None, number=TEST_ALERTS):
+    """ write a .tar.gz of number single-packet AVRO members, returns {candid: bytes} """
+    _avros = {}
+    with tarfile.open(name=f'{path}', mode='w:gz') as _tar:
+        for _i in range(number):
+            _buffer = io.BytesIO()
+            _packet = {'objectId': f'ZTF20test{_i:04d}', 'candid': TEST_CANDID + _i, 'candidate': {'jd': TEST_JD}}
+            fastavro.writer(_buffer, TEST_SCHEMA, [_packet])
+            _avros[_packet['candid']] = _buffer.getvalue()
+            _info = tarfile.TarInfo(name=f"{_packet['candid']}.avro")
+            _info.size = len(_avros[_packet['candid']])
+            _tar.addfile(_info, io.BytesIO(_avros[_packet['candid']]))
+    return _avros
+
+
+# +
+# test: read_avro_file_pipelined() (--workers > 0) uploads every packet when S3 is configured
+# -
+def test_pipelined_uploads_to_s3(tmp_path, monkeypatch):
+    _avros = _tarball(tmp_path / 'ztf_public_20200531.tar.gz')
+
+    # credentials set, as in cron, and no database: only the upload path is under test
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setattr(ingest_archive, 'AWS_USE_S3', True)
+    monkeypatch.setattr(ingest_archive, 'BUCKET_NAME', TEST_BUCKET)
+    monkeypatch.setattr(ingest_archive, '_ARCHIVERS', {})
+    monkeypatch.setattr(ingest_from_gzip, '_flush', lambda *args, **kwargs: None)
+
+    with _mock_aws():
+        _client = boto3.client('s3', region_name='us-east-1')
+        _client.create_bucket(Bucket=TEST_BUCKET)
+        ingest_from_gzip.read_avro_file_pipelined(f"{tmp_path / 'ztf_public_20200531.tar.gz'}", workers=2,
+                                                  batch_size=10)
+        _uploader = ingest_archive.get_uploader()
+        _uploader.close()
+        assert _uploader.counts['stored'] == TEST_ALERTS
+
+        _keys = {_o['Key'] for _o in _client.list_objects_v2(Bucket=TEST_BUCKET, MaxKeys=1000)['Contents']}
+        assert _keys == {ingest_archive.packet_key({'candid': _c, 'candidate': {'jd': TEST_JD}}, f'{_c}.avro')
+                         for _c in _avros}
+        for _candid, _data in list(_avros.items())[:5]:
+            _key = ingest_archive.packet_key({'candid': _candid, 'candidate': {'jd': TEST_JD}}, f'{_candid}.avro')
+            assert _client.get_object(Bucket=TEST_BUCKET, Key=_key)['Body'].read() == _data
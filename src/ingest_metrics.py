@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from src.utils.utils import UtilsLogger
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import bisect
+import math
+import threading
+import time
+import weakref
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    In-process ingest metrics: counters, gauges and histograms, exposed as Prometheus text on
+    http://<host>:<port>/metrics and/or summarised to the log every few seconds.
+
+    >>> from src.ingest_metrics import METRICS, start_metrics_server
+    >>> METRICS.inc('sassy_ingest_alerts_decoded_total', 10)
+    >>> METRICS.observe('sassy_ingest_write_seconds', 0.12, writer='insert')
+    >>> start_metrics_server(9108)
+"""
+
+
+# +
+# constant(s)
+# -
+LAG_SECONDS = 10.0
+METRICS_HOST = '0.0.0.0'
+METRICS_PATH = '/metrics'
+STATS_SECONDS = 60.0
+
+BUCKETS_SECONDS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+BUCKETS_SIZE = [1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+METRIC_HELP = {
+    'sassy_ingest_alerts_decoded_total': ('counter', 'AVRO packets decoded'),
+    'sassy_ingest_alerts_rejected_total': ('counter', 'messages or packets that could not be decoded or transformed'),
+    'sassy_ingest_rows_total': ('counter', 'alert rows written, by result (inserted, updated, skipped)'),
+    'sassy_ingest_batch_size': ('histogram', 'alerts per batch write'),
+    'sassy_ingest_write_seconds': ('histogram', 'database write and commit latency per batch'),
+    'sassy_ingest_write_errors_total': ('counter', 'batch writes that failed and were retried'),
+    'sassy_ingest_consumer_lag': ('gauge', 'kafka end offset minus consumer position'),
+    'sassy_ingest_archive_queue_depth': ('gauge', 'packets waiting in each archive upload queue'),
+    'sassy_ingest_archive_total': ('counter', 'archive results, by archive and result')
+}
+
+
+# +
+# logging
+# -
+logger = UtilsLogger('ingest_metrics').logger
+
+
+# +
+# (hidden) function: _labels()
+# -
+def _labels(labels=None):
+    """ return a hashable, sorted label key """
+    return tuple(sorted([(f'{_k}', f'{_v}') for _k, _v in (labels or {}).items()]))
+
+
+# +
+# (hidden) function: _format()
+# -
+def _format(name='', labels=(), extra=None):
+    _pairs = list(labels) + list(extra or [])
+    if not _pairs:
+        return name
+    _text = ','.join([f'{_k}="{_v}"'.replace('\n', ' ') for _k, _v in _pairs])
+    return f'{name}{{{_text}}}'
+
+
+# +
+# class: Metrics()
+# -
+class Metrics(object):
+
+    # +
+    # method: __init__()
+    # -
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__counters = {}
+        self.__gauges = {}
+        self.__histograms = {}
+        self.__callbacks = []
+        self.__start = time.time()
+
+    # +
+    # method: inc()
+    # -
+    def inc(self, name='', value=1, **labels):
+        """ increment a counter """
+        _key = (name, _labels(labels))
+        with self.__lock:
+            self.__counters[_key] = self.__counters.get(_key, 0) + value
+
+    # +
+    # method: set()
+    # -
+    def set(self, name='', value=0.0, **labels):
+        """ set a gauge """
+        with self.__lock:
+            self.__gauges[(name, _labels(labels))] = value
+
+    # +
+    # method: observe()
+    # -
+    def observe(self, name='', value=0.0, buckets=None, **labels):
+        """ add an observation to a histogram (buckets are fixed by the first observation) """
+        _key = (name, _labels(labels))
+        with self.__lock:
+            if _key not in self.__histograms:
+                _buckets = buckets or (BUCKETS_SIZE if name.endswith('_size') else BUCKETS_SECONDS)
+                self.__histograms[_key] = {'buckets': list(_buckets), 'counts': [0] * (len(_buckets) + 1),
+                                           'sum': 0.0, 'count': 0}
+            _h = self.__histograms[_key]
+            _h['counts'][bisect.bisect_left(_h['buckets'], value)] += 1
+            _h['sum'] += value
+            _h['count'] += 1
+
+    # +
+    # method: register()
+    # -
+    def register(self, callback=None):
+        """ register a callable run before every snapshot, used to refresh gauges (eg queue depths) """
+        with self.__lock:
+            self.__callbacks.append(callback)
+
+    # +
+    # method: snapshot()
+    # -
+    def snapshot(self):
+        """ return copies of (counters, gauges, histograms) """
+        with self.__lock:
+            _callbacks = list(self.__callbacks)
+        for _c in _callbacks:
+            try:
+                _c(self)
+            except Exception as e:
+                logger.warn(f'metrics callback failed, error={e}')
+        with self.__lock:
+            return (dict(self.__counters), dict(self.__gauges),
+                    {_k: {'buckets': _v['buckets'], 'counts': list(_v['counts']), 'sum': _v['sum'],
+                          'count': _v['count']} for _k, _v in self.__histograms.items()})
+
+    # +
+    # method: render()
+    # -
+    def render(self):
+        """ return the Prometheus text exposition of every metric """
+        _counters, _gauges, _histograms = self.snapshot()
+        _lines, _seen = [], set()
+
+        def _header(_name=''):
+            if _name not in _seen:
+                _seen.add(_name)
+                _type, _help = METRIC_HELP.get(_name, ('untyped', _name))
+                _lines.extend([f'# HELP {_name} {_help}', f'# TYPE {_name} {_type}'])
+
+        for (_name, _labels_key), _value in sorted(_counters.items()):
+            _header(_name)
+            _lines.append(f'{_format(_name, _labels_key)} {_value}')
+        for (_name, _labels_key), _value in sorted(_gauges.items()):
+            _header(_name)
+            _lines.append(f'{_format(_name, _labels_key)} {_value}')
+        for (_name, _labels_key), _h in sorted(_histograms.items()):
+            _header(_name)
+            _cumulative = 0
+            for _le, _count in zip(_h['buckets'] + ['+Inf'], _h['counts']):
+                _cumulative += _count
+                _lines.append(f"{_format(f'{_name}_bucket', _labels_key, [('le', _le)])} {_cumulative}")
+            _lines.append(f"{_format(f'{_name}_sum', _labels_key)} {_h['sum']}")
+            _lines.append(f"{_format(f'{_name}_count', _labels_key)} {_h['count']}")
+        _lines.append(f'sassy_ingest_uptime_seconds {time.time() - self.__start:.3f}')
+        return '\n'.join(_lines) + '\n'
+
+
+# +
+# global metrics
+# -
+METRICS = Metrics()
+
+
+# +
+# function: record_lag()
+# -
+_LAG_SAMPLED = weakref.WeakKeyDictionary()
+_LAG_SAMPLED_LOCK = threading.Lock()
+
+
+def record_lag(consumer=None, metrics=METRICS, seconds=LAG_SECONDS):
+    """ set sassy_ingest_consumer_lag for each partition assigned to a kafka consumer, at most once every
+        seconds per consumer (end_offsets() is a broker round trip) """
+    if consumer is None:
+        return
+    _now = time.monotonic()
+    with _LAG_SAMPLED_LOCK:
+        if _now - _LAG_SAMPLED.get(consumer, -math.inf) < seconds:
+            return
+        _LAG_SAMPLED[consumer] = _now
+    try:
+        _assigned = list(consumer.assignment())
+        if not _assigned:
+            return
+        _ends = consumer.end_offsets(_assigned)
+        for _tp in _assigned:
+            metrics.set('sassy_ingest_consumer_lag', max(0, _ends.get(_tp, 0) - consumer.position(_tp)),
+                        topic=_tp.topic, partition=_tp.partition)
+    except Exception as e:
+        logger.warn(f'unable to compute consumer lag, error={e}')
+
+
+# +
+# function: record_archives()
+# -
+def record_archives(metrics=METRICS):
+    """ refresh archive queue depth and result gauges (registered as a snapshot callback) """
+    from src.ingest_archive import get_archivers
+    for _archiver in get_archivers():
+        _counts = _archiver.counts
+        metrics.set('sassy_ingest_archive_queue_depth', _counts.pop('pending', 0), archive=_archiver.name)
+        for _result, _value in _counts.items():
+            metrics.set('sassy_ingest_archive_total', _value, archive=_archiver.name, result=_result)
+
+
+# +
+# class: _MetricsHandler()
+# -
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    metrics = METRICS
+
+    # noinspection PyPep8Naming
+    def do_GET(self):
+        if self.path.split('?')[0] != METRICS_PATH:
+            self.send_error(404)
+            return
+        _body = self.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', f'{len(_body)}')
+        self.end_headers()
+        self.wfile.write(_body)
+
+    def log_message(self, *args):
+        pass
+
+
+# +
+# function: start_metrics_server()
+# -
+def start_metrics_server(port=0, host=METRICS_HOST, metrics=METRICS):
+    """ serve metrics.render() on http://host:port/metrics from a daemon thread, returns the server """
+    if not isinstance(port, int) or port <= 0:
+        return None
+    _handler = type('MetricsHandler', (_MetricsHandler,), {'metrics': metrics})
+    _server = ThreadingHTTPServer((host, port), _handler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name='ingest-metrics', daemon=True).start()
+    logger.info(f'Serving ingest metrics on http://{host}:{port}{METRICS_PATH}')
+    return _server
+
+
+# +
+# function: start_stats_logger()
+# -
+def start_stats_logger(seconds=STATS_SECONDS, metrics=METRICS, stop=None):
+    """ log per-second rates, lag and queue depths every seconds from a daemon thread, returns the thread """
+    if not isinstance(seconds, (int, float)) or seconds <= 0.0:
+        return None
+    stop = stop if stop is not None else threading.Event()
+
+    def _run():
+        _last, _then = {}, time.monotonic()
+        while not stop.wait(seconds):
+            _counters, _gauges, _histograms = metrics.snapshot()
+            _now = time.monotonic()
+            _elapsed, _then = max(_now - _then, 1.0e-6), _now
+
+            # collapse labels to one total per counter (rows keep their result label)
+            _totals = {}
+            for (_name, _labels_key), _value in _counters.items():
+                _suffix = ''.join([f'.{_v}' for _k, _v in _labels_key if _k == 'result'])
+                _totals[f'{_name}{_suffix}'] = _totals.get(f'{_name}{_suffix}', 0) + _value
+            _rates = ', '.join([f"{_k.replace('sassy_ingest_', '').replace('_total', '')}="
+                                f"{(_v - _last.get(_k, 0)) / _elapsed:.1f}/s" for _k, _v in sorted(_totals.items())])
+            _last = _totals
+
+            _lag = sum([_v for (_n, _l), _v in _gauges.items() if _n == 'sassy_ingest_consumer_lag'])
+            _depth = sum([_v for (_n, _l), _v in _gauges.items() if _n == 'sassy_ingest_archive_queue_depth'])
+            _writes = [_h for (_n, _l), _h in _histograms.items() if _n == 'sassy_ingest_write_seconds']
+            _count = sum([_h['count'] for _h in _writes])
+            _mean = sum([_h['sum'] for _h in _writes]) / max(_count, 1)
+            logger.info(f'ingest stats: {_rates or "idle"}, lag={_lag}, archive_queue={_depth}, '
+                        f'writes={_count}, mean_write={_mean:.3f}s')
+
+    _thread = threading.Thread(target=_run, name='ingest-stats', daemon=True)
+    _thread.start()
+    return _thread
+
+
+# +
+# refresh archive gauge(s) on every snapshot
+# -
+METRICS.register(record_archives)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from astropy.coordinates import SkyCoord
+
+import math
+import numpy as np
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    Derive the per-alert fields that are not in the AVRO candidate record for a whole batch of packets:
+
+        gal_l, gal_b      galactic coordinates (one SkyCoord transform for the batch)
+        deltamaglatest    magpsf minus the most recent previous magpsf in the same filter
+        deltamagref       magnr minus magpsf when the nearest reference source is within 2 pixels
+
+    >>> from src.ingest_transform import derive_fields
+    >>> derive_fields(packets)
+    [{'gal_l': ..., 'gal_b': ..., 'deltamaglatest': ..., 'deltamagref': ...}, ...]
+"""
+
+
+# +
+# constant(s)
+# -
+DISTNR_LIMIT = 2.0
+
+
+# +
+# (hidden) function: _as_float()
+# -
+def _as_float(value=None):
+    return math.nan if value is None else float(value)
+
+
+# +
+# (hidden) function: _as_optional()
+# -
+def _as_optional(values=None):
+    return [_v if math.isfinite(_v) else None for _v in values.tolist()]
+
+
+# +
+# function: galactic()
+# -
+def galactic(ra=None, dec=None):
+    """ return (gal_l, gal_b) arrays for ra, dec arrays in degrees """
+    _galactic = SkyCoord(ra=np.asarray(ra, dtype=np.float64), dec=np.asarray(dec, dtype=np.float64),
+                         unit='deg').galactic
+    return _galactic.l.value, _galactic.b.value
+
+
+# +
+# function: latest_delta_mag()
+# -
+def latest_delta_mag(fid=None, magpsf=None, prv_candidates=None):
+    """ magpsf minus the latest previous magpsf in the same filter, NaN where there is none """
+
+    # flatten previous candidates to (owner, position, jd, fid, magpsf)
+    _owner, _position, _jd, _fid, _mag = [], [], [], [], []
+    for _i, _prvs in enumerate(prv_candidates):
+        for _j, _prv in enumerate(_prvs or []):
+            _owner.append(_i)
+            _position.append(_j)
+            _jd.append(_as_float(_prv.get('jd')))
+            _fid.append(_prv.get('fid', -1))
+            _mag.append(_as_float(_prv.get('magpsf')))
+
+    _delta = np.full(len(fid), np.nan)
+    if not _owner:
+        return _delta
+    _owner, _position = np.asarray(_owner), np.asarray(_position)
+    _jd, _fid, _mag = np.asarray(_jd), np.asarray(_fid), np.asarray(_mag)
+
+    # keep detections in the alert's filter with a usable magnitude
+    _keep = (_fid == np.asarray(fid)[_owner]) & np.isfinite(_mag) & (_mag != 0.0) & np.isfinite(_jd)
+    if not _keep.any():
+        return _delta
+    _owner, _position, _jd, _mag = _owner[_keep], _position[_keep], _jd[_keep], _mag[_keep]
+
+    # sort by owner then jd (ties go to the earliest listed), the last entry per owner is the latest
+    _order = np.lexsort((-_position, _jd, _owner))
+    _owner, _mag = _owner[_order], _mag[_order]
+    _last = np.append(_owner[1:] != _owner[:-1], True)
+    _delta[_owner[_last]] = np.asarray(magpsf, dtype=np.float64)[_owner[_last]] - _mag[_last]
+    return _delta
+
+
+# +
+# function: reference_delta_mag()
+# -
+def reference_delta_mag(distnr=None, magnr=None, magpsf=None):
+    """ magnr minus magpsf where distnr < DISTNR_LIMIT, NaN elsewhere """
+    _distnr = np.asarray(distnr, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        return np.where(_distnr < DISTNR_LIMIT,
+                        np.asarray(magnr, dtype=np.float64) - np.asarray(magpsf, dtype=np.float64), np.nan)
+
+
+# +
+# function: derive_fields()
+# -
+def derive_fields(packets=None):
+    """ return one dict of derived fields per packet, computed with array operations over the batch """
+
+    # check input(s)
+    if not packets:
+        return []
+
+    # gather the candidate column(s) once
+    _candidates = [_p['candidate'] for _p in packets]
+    _ra = [_as_float(_c['ra']) for _c in _candidates]
+    _dec = [_as_float(_c['dec']) for _c in _candidates]
+    _fid = [_c['fid'] for _c in _candidates]
+    _magpsf = [_as_float(_c.get('magpsf')) for _c in _candidates]
+
+    # transform
+    _gal_l, _gal_b = galactic(_ra, _dec)
+    _latest = latest_delta_mag(_fid, _magpsf, [_p['prv_candidates'] for _p in packets])
+    _reference = reference_delta_mag([_as_float(_c.get('distnr')) for _c in _candidates],
+                                     [_as_float(_c.get('magnr')) for _c in _candidates], _magpsf)
+
+    # return plain python value(s) so that the database driver can adapt them
+    return [{'gal_l': _l, 'gal_b': _b, 'deltamaglatest': _dl, 'deltamagref': _dr}
+            for _l, _b, _dl, _dr in zip(_gal_l.tolist(), _gal_b.tolist(), _as_optional(_latest),
+                                        _as_optional(_reference))]
@@ -6,7 +6,7 @@
 # -
 from astropy.time import Time
 from datetime import datetime
-from flask_sqlalchemy import SQLAlchemy
+from src.database import SassySQLAlchemy
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
@@ -78,7 +78,7 @@ SORT_VALUE = ['id', 'hostName', 'discoverer', 'prefix', 'objectname', 'redshift'
 # +
 # initialize sqlalchemy (deferred)
 # -
-db = SQLAlchemy()
+db = SassySQLAlchemy()
 
 
 # +
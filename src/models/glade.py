@@ -4,7 +4,7 @@
 # +
 # import(s)
 # -
-from flask_sqlalchemy import SQLAlchemy
+from src.database import SassySQLAlchemy
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
@@ -84,7 +84,7 @@ SORT_VALUE = ['id', 'pgc', 'gwgc', 'hyperleda', 'twomass', 'sdss', 'flag1', 'ra'
 # +
 # initialize sqlalchemy (deferred)
 # -
-db = SQLAlchemy()
+db = SassySQLAlchemy()
 
 
 # +
@@ -4,7 +4,7 @@
 # +
 # import(s)
 # -
-from flask_sqlalchemy import SQLAlchemy
+from src.database import SassySQLAlchemy
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
@@ -132,7 +132,7 @@ SORT_VALUE = ['id', 'pgc', 'name', 'ra', 'dec', 'tt', 'b_app', 'a', 'e_a', 'b',
 # +
 # initialize sqlalchemy (deferred)
 # -
-db = SQLAlchemy()
+db = SassySQLAlchemy()
 
 
 # +
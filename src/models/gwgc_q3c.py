@@ -5,7 +5,7 @@
 # import(s)
 # -
 from astropy.coordinates import SkyCoord
-from flask_sqlalchemy import SQLAlchemy
+from src.database import SassySQLAlchemy
 from sqlalchemy import create_engine
 from sqlalchemy import func
 from sqlalchemy.orm import sessionmaker
@@ -147,7 +147,7 @@ def _get_astropy_coords(_oname=''):
 # +
 # initialize sqlalchemy (deferred)
 # -
-db = SQLAlchemy()
+db = SassySQLAlchemy()
 
 
 # +
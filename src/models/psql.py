@@ -6,10 +6,16 @@
 # -
 from src.utils.utils import UtilsLogger
 
+from psycopg2.pool import PoolError
+from psycopg2.pool import ThreadedConnectionPool
+
 import argparse
+import os
 import pprint
 import psycopg2
 import sys
+import threading
+import uuid
 
 
 # +
@@ -17,6 +23,19 @@ import sys
 # -
 __doc__ = """
     % python3 psql.py --help
+
+    Connections come from a ThreadedConnectionPool shared by every Psql with the same credentials
+    (at most PSQL_POOL_MAX connections each). Commands run in a read-only transaction with a
+    statement_timeout of PSQL_TIMEOUT_MS, through a named (server-side) cursor that fetches
+    PSQL_PAGE_ROWS rows at a time and stops after PSQL_ROW_LIMIT rows, so a large result is never
+    held in memory. A named cursor only accepts a single SELECT (or VALUES) statement.
+
+    >>> _p = Psql('sassy:********', 'sassy', 5432, 'localhost')
+    >>> _p.connect()
+    >>> for _page in _p.iterpages('SELECT * FROM alert', 100):
+    ...     print(len(_page))
+    >>> _p.truncated, _p.error
+    >>> _p.disconnect()
 """
 
 
@@ -29,6 +48,12 @@ FETCH_MANY = 50
 KEYS = ('authorization', 'command', 'database', 'method', 'nelms', 'port', 'server', 'verbose')
 RESULTS_PER_PAGE = 50
 
+PSQL_PAGE_ROWS = 500
+PSQL_POOL_MAX = int(os.getenv("SASSY_PSQL_POOL_MAX", 4))
+PSQL_POOL_MIN = 1
+PSQL_ROW_LIMIT = int(os.getenv("SASSY_PSQL_ROW_LIMIT", 10000))
+PSQL_TIMEOUT_MS = int(os.getenv("SASSY_PSQL_TIMEOUT_MS", 15000))
+
 SASSY_DB_AUTHORIZATION = f"sassy:********"
 SASSY_DB_HOST = "sassy.as.arizona.edu"
 SASSY_DB_NAME = "sassy"
@@ -36,6 +61,22 @@ SASSY_DB_PORT = 5432
 SASSY_CONNECT_MSG = f'{SASSY_DB_HOST}:{SASSY_DB_PORT}/{SASSY_DB_NAME}'
 
 
+# +
+# function: get_pool()
+# -
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(connection_string='', maxconn=PSQL_POOL_MAX):
+    """ return the shared connection pool for connection_string, creating it on first use """
+    with _POOLS_LOCK:
+        _pool = _POOLS.get(connection_string, None)
+        if _pool is None or _pool.closed:
+            _pool = _POOLS[connection_string] = ThreadedConnectionPool(PSQL_POOL_MIN, maxconn, connection_string)
+        return _pool
+
+
 # +
 # class: Psql()
 # -
@@ -46,7 +87,8 @@ class Psql(object):
     # method: __init__()
     # -
     def __init__(self, authorization=SASSY_DB_AUTHORIZATION, database=SASSY_DB_NAME, 
-                 port=SASSY_DB_PORT, server=SASSY_DB_HOST, logger=None):
+                 port=SASSY_DB_PORT, server=SASSY_DB_HOST, logger=None, limit=PSQL_ROW_LIMIT,
+                 timeout_ms=PSQL_TIMEOUT_MS):
 
         # get input(s)
         self.authorization = authorization
@@ -54,13 +96,17 @@ class Psql(object):
         self.port = port
         self.server = server
         self.logger = logger
+        self.limit = limit
+        self.timeout_ms = timeout_ms
 
         # private variable(s)
         self.__connection = None
-        self.__cursor = None
         self.__connection_string = None
+        self.__error = None
+        self.__pool = None
         self.__result = None
         self.__results = None
+        self.__truncated = False
 
     # +
     # decorator(s)
@@ -108,92 +154,135 @@ class Psql(object):
     def logger(self, logger):
         self.__logger = logger
 
+    @property
+    def limit(self):
+        return self.__limit
+
+    @limit.setter
+    def limit(self, limit):
+        self.__limit = limit if (isinstance(limit, int) and 0 < limit <= PSQL_ROW_LIMIT) else PSQL_ROW_LIMIT
+
+    @property
+    def timeout_ms(self):
+        return self.__timeout_ms
+
+    @timeout_ms.setter
+    def timeout_ms(self, timeout_ms):
+        self.__timeout_ms = timeout_ms if (isinstance(timeout_ms, int) and 0 < timeout_ms <= PSQL_TIMEOUT_MS) \
+            else PSQL_TIMEOUT_MS
+
+    @property
+    def error(self):
+        return self.__error
+
+    @property
+    def truncated(self):
+        return self.__truncated
+
     # +
     # method: connect()
     # -
     def connect(self):
-        """ connect to database """
+        """ borrow a read-only connection from the shared pool """
 
         # set variable(s)
         self.__connection = None
-        self.__connection_string = f"host='{self.__server}' dbname='{self.__database}' " \
+        self.__connection_string = f"host='{self.__server}' port='{self.__port}' dbname='{self.__database}' " \
             f"user='{self.__username}' password='{self.__password}'"
-        self.__cursor = None
+        self.__error = None
 
         # get connection
         if self.__logger:
             self.__logger.info(f'Connecting to {SASSY_CONNECT_MSG}')
         try:
+            self.__pool = get_pool(self.__connection_string)
+            self.__connection = self.__pool.getconn()
+            self.__connection.set_session(readonly=True, autocommit=False)
+        except PoolError as e:
+            self.__release()
+            self.__error = f'too many concurrent queries, please try again later'
             if self.__logger:
-                self.__logger.info(f'{self.__connection_string}')
-            self.__connection = psycopg2.connect(self.__connection_string)
+                self.__logger.error(f'failed connecting to {SASSY_CONNECT_MSG}, error={e}')
         except Exception as e:
-            self.__connection = None
+            self.__release(close=True)
+            self.__error = f'{e}'.strip()
             if self.__logger:
                 self.__logger.error(f'failed connecting to {SASSY_CONNECT_MSG}, error={e}')
         else:
             if self.__logger:
                 self.__logger.info(f'Connected to {SASSY_CONNECT_MSG}')
 
-        # get cursor
-        if self.__logger:
-            self.__logger.info(f'Getting cursor for {SASSY_CONNECT_MSG}')
-        try:
-            self.__cursor = self.__connection.cursor()
-        except Exception as e:
-            self.__cursor = None
-            if self.__logger:
-                self.__logger.error(f'failed getting cursor for {SASSY_CONNECT_MSG}, error={e}')
-        else:
-            if self.__logger:
-                self.__logger.info(f'Got cursor for {SASSY_CONNECT_MSG}')
-
     # +
     # method: disconnect()
     # -
     def disconnect(self):
-        """ disconnect from database """
-
-        # disconnect cursor
-        if self.__cursor is not None:
-            if self.__logger:
-                self.__logger.info(f'Disconnecting cursor')
-            self.__cursor.close()
-
-        # disconnect connection
+        """ return the connection to the pool """
         if self.__connection is not None:
             if self.__logger:
                 self.__logger.info(f'Disconnecting connection')
-            self.__connection.close()
-
-        # reset variable(s)
-        self.__connection = None
-        self.__cursor = None
+            self.__release()
 
     # +
-    # method: fetchall()
+    # method: iterpages()
     # -
-    def fetchall(self, command=''):
-        """ execute fetchall() command """
+    def iterpages(self, command='', number=PSQL_PAGE_ROWS):
+        """ yield lists of up to number rows from a server-side cursor, stopping after self.limit rows """
 
         # check input(s)
+        self.__truncated = False
         if not isinstance(command, str) or command.strip() == '':
+            self.__error = f'invalid input, command={command}'
             if self.__logger:
-                self.__logger.error(f'invalid input, command={command}')
-            return f''
-
-        # execute query
+                self.__logger.error(self.__error)
+            return
+        if self.__connection is None:
+            self.__error = self.__error or f'not connected to {SASSY_CONNECT_MSG}'
+            return
+        number = number if (isinstance(number, int) and number > 0) else PSQL_PAGE_ROWS
+
+        # execute query in a read-only transaction with a statement timeout
         if self.__logger:
             self.__logger.info(f'Executing "{command}"')
+        self.__error = None
+        _cursor = None
+        _count = 0
         try:
-            self.__cursor.execute(command)
-            self.__results = self.__cursor.fetchall()
-        except Exception:
-            self.__results = None
+            with self.__connection.cursor() as _c:
+                _c.execute("SELECT set_config('statement_timeout', %s, true)", (f'{self.__timeout_ms}',))
+            _cursor = self.__connection.cursor(name=f'psql_{uuid.uuid4().hex}')
+            _cursor.itersize = number
+            _cursor.execute(command)
+            while _count < self.__limit:
+                _page = _cursor.fetchmany(min(number, self.__limit - _count))
+                if not _page:
+                    break
+                _count += len(_page)
+                yield _page
+            self.__truncated = _count >= self.__limit and bool(_cursor.fetchmany(1))
+        except Exception as e:
+            self.__error = f'{e}'.strip()
+            if self.__logger:
+                self.__logger.error(f'failed executing "{command}", error={e}')
+        finally:
+            self.__end(_cursor)
         if self.__logger:
-            self.__logger.info(f'Executed "{command}"')
+            self.__logger.info(f'Executed "{command}", {_count} rows{", truncated" if self.__truncated else ""}')
 
-        # return result(s)
+    # +
+    # method: iterrows()
+    # -
+    def iterrows(self, command=''):
+        """ yield rows from a server-side cursor, stopping after self.limit rows """
+        for _page in self.iterpages(command):
+            yield from _page
+
+    # +
+    # method: fetchall()
+    # -
+    def fetchall(self, command=''):
+        """ execute fetchall() command (at most self.limit rows) """
+        self.__results = list(self.iterrows(command))
+        self.__results = self.__results if self.__error is None else None
         return self.__results
 
     # +
@@ -201,29 +290,14 @@ class Psql(object):
     # -
     def fetchmany(self, command='', number=0):
         """ execute fetchmany() command """
-
-        # check input(s)
-        if not isinstance(command, str) or command.strip() == '':
-            if self.__logger:
-                self.__logger.error(f'invalid input, command={command}')
-            return f''
         if not isinstance(number, int) or number <= 0:
             if self.__logger:
                 self.__logger.error(f'invalid input, number={number}')
             return f''
-
-        # execute query
-        if self.__logger:
-            self.__logger.info(f'Executing "{command}"')
-        try:
-            self.__cursor.execute(command)
-            self.__results = self.__cursor.fetchmany(number)
-        except Exception:
-            self.__results = None
-        if self.__logger:
-            self.__logger.info(f'Executed "{command}"')
-
-        # return result(s)
+        _pages = self.iterpages(command, min(number, self.__limit))
+        self.__results = next(_pages, [])
+        _pages.close()
+        self.__results = self.__results if self.__error is None else None
         return self.__results
 
     # +
@@ -231,26 +305,34 @@ class Psql(object):
     # -
     def fetchone(self, command=''):
         """ execute fetchone() command """
+        _pages = self.iterpages(command, 1)
+        _page = next(_pages, [])
+        _pages.close()
+        self.__result = _page[0] if (_page and self.__error is None) else None
+        return self.__result
 
-        # check input(s)
-        if not isinstance(command, str) or command.strip() == '':
-            if self.__logger:
-                self.__logger.error(f'invalid input, command={command}')
-            return f''
-
-        # execute query
-        if self.__logger:
-            self.__logger.info(f'Executing {command}')
+    # +
+    # (hidden) method: __end(), __release()
+    # -
+    # noinspection PyBroadException
+    def __end(self, cursor=None):
+        """ close the cursor and end the (read-only) transaction """
         try:
-            self.__cursor.execute(command)
-            self.__result = self.__cursor.fetchone()
+            if cursor is not None:
+                cursor.close()
+            self.__connection.rollback()
         except Exception:
-            self.__result = None
-        if self.__logger:
-            self.__logger.info(f'Executed {command}')
-
-        # return result
-        return self.__result
+            pass
+
+    # noinspection PyBroadException
+    def __release(self, close=False):
+        """ put the connection back into the pool (closing it if it is broken) """
+        if self.__pool is not None and self.__connection is not None:
+            try:
+                self.__pool.putconn(self.__connection, close=bool(close or self.__connection.closed))
+            except Exception:
+                pass
+        self.__connection = None
 
 
 # +
@@ -5,7 +5,7 @@
 # import(s)
 # -
 from src import *
-from flask_sqlalchemy import SQLAlchemy
+from src.database import SassySQLAlchemy
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
@@ -95,7 +95,7 @@ SASSY_DB_PORT = os.getenv('SASSY_DB_PORT', None)
 # +
 # initialize sqlalchemy (deferred)
 # -
-db = SQLAlchemy()
+db = SassySQLAlchemy()
 
 
 # +
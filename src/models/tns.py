@@ -6,7 +6,7 @@
 # -
 from astropy.time import Time
 from datetime import datetime
-from flask_sqlalchemy import SQLAlchemy
+from src.database import SassySQLAlchemy
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
@@ -120,7 +120,7 @@ TRUE_VALUES = ['true', 't', '1']
 # +
 # initialize sqlalchemy (deferred)
 # -
-db = SQLAlchemy()
+db = SassySQLAlchemy()
 
 
 # +
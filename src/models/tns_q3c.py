@@ -7,7 +7,7 @@
 from astropy.coordinates import SkyCoord
 from astropy.time import Time
 from datetime import datetime
-from flask_sqlalchemy import SQLAlchemy
+from src.database import SassySQLAlchemy
 from sqlalchemy import create_engine
 from sqlalchemy import func
 from sqlalchemy.orm import sessionmaker
@@ -134,7 +134,7 @@ TRUE_VALUES = ['true', 't', '1']
 # +
 # initialize sqlalchemy (deferred)
 # -
-db = SQLAlchemy()
+db = SassySQLAlchemy()
 
 
 # +
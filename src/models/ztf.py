@@ -6,17 +6,27 @@
 # -
 from astropy.coordinates import SkyCoord
 from astropy.time import Time
-from flask_sqlalchemy import SQLAlchemy
+from src.database import SassySQLAlchemy
 from geoalchemy2 import shape
 from geoalchemy2 import Geography
 from geoalchemy2 import Geometry
+from sqlalchemy import and_
 from sqlalchemy import cast
 from sqlalchemy import create_engine
+from sqlalchemy import func
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import array
+from sqlalchemy.orm import aliased
+from sqlalchemy.orm import object_session
 from sqlalchemy.orm import sessionmaker
 
+from src.avro_cache import AVRO_CACHE
+from src.time_utils import jd_to_datetime
+from src.time_utils import jd_to_isot_array
+from src.time_utils import jd_to_isot as _jd_to_isot
+
 import argparse
-import fastavro
-import io
+import heapq
 import json
 import math
 import os
@@ -71,10 +81,16 @@ Most modifiers correspond to columns displayed in the main table, with the excep
 
 jd:                   Modify alerts by JD instead of gregorian date.
 candid:               The value of the candid field of the alert. Exact match.
+Distinct Object:      Return only the latest alert of each object (API: distinct_object=true). The other
+                      modifiers then apply to that latest alert.
 Cone Search:          Returns results contained within the radius of a given point, in degrees. 
                       For example: 43.2,-30.2,0.2. The format is ra,dec,radius in degrees.
 Cone Search (Object): Returns results contained within the radius of a given point, obtained via 
                       looking up an object name with astropy. For example: m51,5.
+Ellipse Search:       Returns results contained within an ellipse, in degrees. For example: 202.1,47.2,5.0,0.5,25.0.
+                      The format is ra,dec,semi_major_axis,axis_ratio,position_angle.
+Polygon Search:       Returns results contained within a polygon of 3 or more vertices, in degrees. For example:
+                      202.0,47.0,203.0,47.0,203.0,48.0. The format is ra1,dec1,ra2,dec2,ra3,dec3,...
 Nearby Objects:       Each alert contains the names of the 3 closest objects from the Panstarrs-1 catalog. 
                       Modifying on a PS1 object id will return alerts for which this object is listed as close by.
 Classtar:             Return alerts where the The Star/Galaxy classification score from SExtractor is within 
@@ -107,6 +123,9 @@ SASSY_DB_PASS = os.getenv('SASSY_DB_PASS', None)
 SASSY_DB_NAME = os.getenv('SASSY_DB_NAME', None)
 SASSY_DB_PORT = os.getenv('SASSY_DB_PORT', None)
 
+ZTF_CONE_BACKENDS = ['q3c', 'postgis']
+ZTF_CONE_BACKEND = os.getenv('SASSY_ZTF_CONE', ZTF_CONE_BACKENDS[0]).lower()
+ZTF_CUTOUTS = ['Science', 'Template', 'Difference']
 ZTF_FILTERS = ['g', 'r', 'i']
 ZTF_PREVIOUS_CANDIDATES_RADIUS = 0.000416667
 
@@ -114,19 +133,28 @@ ZTF_PREVIOUS_CANDIDATES_RADIUS = 0.000416667
 # +
 # function: jd_to_isot()
 # -
-# noinspection PyBroadException
 def jd_to_isot(jd=math.nan):
     """ return isot from jd """
-    try:
-        return Time(jd, format='jd', precision=6).isot
-    except:
-        return None
+    return _jd_to_isot(jd)
+
+
+# +
+# function: ztf_avro_url()
+# -
+def ztf_avro_url(wall_time_format='', alert_candid=0):
+    """ return the url of <wall_time_format>/<alert_candid>.avro """
+    if SASSY_APP_HOST.lower() == 'localhost' and int(SASSY_APP_PORT) == 5000:
+        _old_str = f'{SASSY_APP_HOST.lower()}'
+        _new_str = f'{SASSY_APP_HOST.lower()}:{SASSY_APP_PORT}'
+        return f'{SASSY_APP_ZTF_FILES_URL}/{wall_time_format}/{alert_candid}.avro'.replace(_old_str, _new_str)
+    else:
+        return f'{SASSY_APP_ZTF_FILES_URL}/{wall_time_format}/{alert_candid}.avro'
 
 
 # +
 # initialize sqlalchemy (deferred)
 # -
-db = SQLAlchemy()
+db = SassySQLAlchemy()
 
 
 # +
@@ -153,8 +181,7 @@ class NonDetection(db.Model):
     # -
     @property
     def wall_time(self):
-        t = Time(self.jd, format='jd')
-        return t.datetime
+        return jd_to_datetime(self.jd)[0]
 
     @property
     def filter(self):
@@ -212,6 +239,8 @@ class ZtfAlert(db.Model):
     xpos = db.Column(db.Float, nullable=True, default=None)
     ypos = db.Column(db.Float, nullable=True, default=None)
     location = db.Column(Geography('POINT', srid=DB_SRID), nullable=False, index=True)
+    ra_deg = db.Column('ra', db.Float, nullable=True, default=None, index=True)
+    dec_deg = db.Column('dec', db.Float, nullable=True, default=None, index=True)
     magpsf = db.Column(db.Float, nullable=False, index=True)
     sigmapsf = db.Column(db.Float, nullable=False, index=True)
     deltamaglatest = db.Column(db.Float, nullable=True, default=None, index=True)
@@ -311,6 +340,8 @@ class ZtfAlert(db.Model):
     # -
     @property
     def ra(self):
+        if self.ra_deg is not None:
+            return self.ra_deg
         ra = shape.to_shape(self.location).x
         if ra <= 0.0:
             ra += 360.0
@@ -318,26 +349,26 @@ class ZtfAlert(db.Model):
 
     @property
     def dec(self):
-        return shape.to_shape(self.location).y
+        return self.dec_deg if self.dec_deg is not None else shape.to_shape(self.location).y
 
     @property
     def prv_candidate(self):
-        point = db.session.scalar(self.location.ST_AsText())
-        query = db.session.query(ZtfAlert).filter(
-            ZtfAlert.id != self.id,
-            ZtfAlert.location.ST_DWithin(
-                f'srid={DB_SRID};{point}', _degrees_to_meters(ZTF_PREVIOUS_CANDIDATES_RADIUS)))
-        return query.order_by(ZtfAlert.jd.desc())
+        return list(reversed(ZtfAlert.load_lightcurves([self])[self.id][0]))
 
     @property
     def non_detection(self):
-        query = db.session.query(NonDetection).filter(NonDetection.objectid == self.objectId)
-        return query.order_by(NonDetection.jd.desc())
+        return list(reversed(ZtfAlert.load_lightcurves([self])[self.id][1]))
+
+    @property
+    def lightcurve(self):
+        """ previous detections and non-detections, serialized and merged in ascending jd """
+        _detections, _non_detections = ZtfAlert.load_lightcurves([self])[self.id]
+        return list(heapq.merge(ZtfAlert.serialize_list(_detections), NonDetection.serialize_list(_non_detections),
+                                key=lambda _c: _c['candidate']['jd']))
 
     @property
     def wall_time(self):
-        t = Time(self.jd, format='jd')
-        return t.datetime
+        return jd_to_datetime(self.jd)[0]
 
     @property
     def wall_time_format(self):
@@ -346,33 +377,23 @@ class ZtfAlert(db.Model):
     @property
     def avro(self):
         """ http://localhost/sassy/ztf/files/2020/05/22/1237486751415010006.avro """
-        if SASSY_APP_HOST.lower() == 'localhost' and int(SASSY_APP_PORT) == 5000:
-            _old_str = f'{SASSY_APP_HOST.lower()}'
-            _new_str = f'{SASSY_APP_HOST.lower()}:{SASSY_APP_PORT}'
-            return f'{SASSY_APP_ZTF_FILES_URL}/{self.wall_time_format}/{self.alert_candid}.avro'.replace(_old_str, _new_str)
-        else:
-            return f'{SASSY_APP_ZTF_FILES_URL}/{self.wall_time_format}/{self.alert_candid}.avro'
+        return ztf_avro_url(self.wall_time_format, self.alert_candid)
 
     @property
     def avro_packet(self):
-        response = requests.get(self.avro)
-        freader = fastavro.reader(io.BytesIO(response.content))
-        for packet in freader:
-            if packet['candidate']['candid'] == self.candid:
-                return packet
-        return None
+        return AVRO_CACHE.get(self.alert_candid, self.jd, url=self.avro, match=self.candid)
 
     @property
     def cutoutScience(self):
-        return self.avro_packet['cutoutScience']
+        return (self.avro_packet or {}).get('cutoutScience', None)
 
     @property
     def cutoutTemplate(self):
-        return self.avro_packet['cutoutTemplate']
+        return (self.avro_packet or {}).get('cutoutTemplate', None)
 
     @property
     def cutoutDifference(self):
-        return self.avro_packet['cutoutDifference']
+        return (self.avro_packet or {}).get('cutoutDifference', None)
 
     @property
     def pretty_serialized(self):
@@ -502,31 +523,44 @@ class ZtfAlert(db.Model):
             }
         }
         if prv_candidate:
-            prv_candidate = ZtfAlert.serialize_list(self.prv_candidate)
-            non_detections = NonDetection.serialize_list(self.non_detection)
-            ZtfAlert.add_candidates(prv_candidate, non_detections)
-            alert['prv_candidate'] = prv_candidate
+            alert['prv_candidate'] = self.lightcurve
         return alert
 
+    # +
+    # (static) method: load_lightcurves()
+    # -
     @staticmethod
-    def add_candidates(candidates, new_candidates):
-        for candidate in new_candidates:
-            low = 0
-            high = len(candidates)
-            while low < high:
-                mid = (low+high)//2
-                if candidates[mid]['candidate']['jd'] < candidate['candidate']['jd']:
-                    low = mid+1
-                else:
-                    high = mid
-            candidates.insert(low, candidate)
-        return candidates
+    def load_lightcurves(alerts=None, session=None, radius=ZTF_PREVIOUS_CANDIDATES_RADIUS, backend=None):
+        """ fetch (detections, non_detections) in ascending jd for every alert in 2 queries, returns {id: ...} """
+
+        # only alerts that have not been loaded yet cost a query
+        alerts = [_a for _a in (alerts or []) if _a is not None]
+        _pending = [_a for _a in alerts if getattr(_a, '_ZtfAlert__lightcurve', None) is None]
+        if _pending:
+            session = session or object_session(_pending[0]) or db.session
+            _detections = {_a.id: [] for _a in _pending}
+            _non_detections = {_a.objectId: [] for _a in _pending}
+
+            # previous detections: a self-join on position, no per-alert round trip for the point
+            _owner = aliased(ZtfAlert)
+            _query = session.query(_owner.id, ZtfAlert).select_from(ZtfAlert).join(_owner, and_(
+                _owner.id.in_(list(_detections)), ZtfAlert.id != _owner.id,
+                ztf_cone_join(_owner, radius, backend)))
+            for _id, _prv in _query.order_by(_owner.id, ZtfAlert.jd.asc()).all():
+                _detections[_id].append(_prv)
+
+            # non-detections: one lookup by objectId for the whole batch
+            _query = session.query(NonDetection).filter(NonDetection.objectid.in_(list(_non_detections)))
+            for _nd in _query.order_by(NonDetection.objectid, NonDetection.jd.asc()).all():
+                _non_detections[_nd.objectid].append(_nd)
+
+            for _a in _pending:
+                _a.__lightcurve = (_detections[_a.id], _non_detections[_a.objectId])
+        return {_a.id: _a.__lightcurve for _a in alerts}
 
     def get_photometry_old(self):
         filter_mapping = ['g', 'r', 'i']
-        prv_candidates = ZtfAlert.serialize_list(self.prv_candidate)
-        non_detections = NonDetection.serialize_list(self.non_detection)
-        ZtfAlert.add_candidates(prv_candidates, non_detections)
+        prv_candidates = self.lightcurve
         photometry = {}
         index = 0
         for candidate in prv_candidates:
@@ -549,9 +583,8 @@ class ZtfAlert(db.Model):
 
     def get_photometry(self):
         filter_mapping = ['', 'g', 'r', 'i']
-        prv_candidates = ZtfAlert.serialize_list(self.prv_candidate)
-        non_detections = NonDetection.serialize_list(self.non_detection)
-        ZtfAlert.add_candidates(prv_candidates, non_detections)
+        prv_candidates = self.lightcurve
+        isots = jd_to_isot_array([_c['candidate']['jd'] for _c in prv_candidates] + [self.jd], precision=3).tolist()
         photometry = {}
         index = 0
         for candidate in prv_candidates:
@@ -564,11 +597,11 @@ class ZtfAlert(db.Model):
                     photometry[index]['filter'] = filter_mapping[values[key]]
                 elif key == 'jd':
                     photometry[index][key] = values[key]
-                    photometry[index]['isot'] = Time(values[key], format='jd').isot
+                    photometry[index]['isot'] = isots[index]
             index += 1
         photometry[index] = {
             'jd': self.jd,
-            'isot': Time(self.jd, format='jd').isot,
+            'isot': isots[index],
             'filter': filter_mapping[self.fid],
             'magpsf': self.magpsf,
             'sigmapsf': self.sigmapsf,
@@ -585,12 +618,14 @@ class ZtfAlert(db.Model):
     def get_non_detections(self):
         non_detections = []
         filter_mapping = {1: 'g', 2: 'r', 3: 'i'}
-        for _prv in self.avro_packet['prv_candidates']:
+        for _prv in (self.avro_packet or {}).get('prv_candidates', None) or []:
             if 'candid' in _prv and _prv['candid'] is None:
                 if all(_k in _prv for _k in ['diffmaglim', 'jd', 'fid']):
                     non_detections.append(
                         {'diffmaglim': float(_prv['diffmaglim']), 'jd': float(_prv['jd']),
-                         'filter': filter_mapping.get(_prv['fid'], ''), 'isot': jd_to_isot(_prv['jd'])})
+                         'filter': filter_mapping.get(_prv['fid'], '')})
+        for _nd, _isot in zip(non_detections, jd_to_isot_array([_nd['jd'] for _nd in non_detections]).tolist()):
+            _nd['isot'] = None if _isot == 'NaT' else _isot
         return non_detections
 
     # +
@@ -603,8 +638,95 @@ class ZtfAlert(db.Model):
     # (static) method: serialize_list()
     # -
     @staticmethod
-    def serialize_list(m_alerts):
-        return [_a.serialized() for _a in m_alerts]
+    def serialize_list(m_alerts, prv_candidate=False):
+        if prv_candidate:
+            m_alerts = list(m_alerts)
+            ZtfAlert.load_lightcurves(m_alerts)
+        return [_a.serialized(prv_candidate) for _a in m_alerts]
+
+
+# ra and dec are persisted next to location so that range and cone (q3c) searches can use an index
+db.Index('idx_alert_q3c_ang2ipix', func.q3c_ang2ipix(ZtfAlert.ra_deg, ZtfAlert.dec_deg))
+
+
+# +
+# class: ZtfLatestAlert(), inherits from db.Model
+# -
+# noinspection PyPep8Naming,PyUnresolvedReferences
+class ZtfLatestAlert(db.Model):
+
+    # +
+    # member variable(s)
+    # -
+
+    # define table name
+    __tablename__ = 'latest_alert_per_object'
+
+    objectid = db.Column(db.String(DB_OBJCHAR), primary_key=True)
+    alert_id = db.Column(db.Integer, db.ForeignKey('alert.id', ondelete='CASCADE'), nullable=False, unique=True)
+    jd = db.Column(db.Float, nullable=False, index=True)
+
+    def serialized(self):
+        return {
+            'objectid': self.objectid,
+            'sid': int(self.alert_id),
+            'jd': float(self.jd)
+        }
+
+
+# +
+# constant(s) for the latest alert per object: the newest (jd, id) of each objectId wins
+# -
+ZTF_LATEST_SELECT = """
+    SELECT DISTINCT ON ("objectId") "objectId", id, jd FROM alert
+    WHERE "objectId" IS NOT NULL {where}
+    ORDER BY "objectId", jd DESC, id DESC
+"""
+ZTF_LATEST_UPSERT = f"""
+    INSERT INTO latest_alert_per_object (objectid, alert_id, jd)
+    {ZTF_LATEST_SELECT.format(where='AND alert_candid = ANY(:candids)')}
+    ON CONFLICT (objectid) DO UPDATE SET alert_id = EXCLUDED.alert_id, jd = EXCLUDED.jd
+    WHERE (EXCLUDED.jd, EXCLUDED.alert_id) >= (latest_alert_per_object.jd, latest_alert_per_object.alert_id)
+"""
+ZTF_LATEST_REBUILD = f"""
+    INSERT INTO latest_alert_per_object (objectid, alert_id, jd)
+    {ZTF_LATEST_SELECT.format(where='')}
+"""
+
+
+# +
+# function: ztf_latest_update()
+# -
+def ztf_latest_update(session=None, candids=None):
+    """ fold the alerts with alert_candid in candids into latest_alert_per_object and commit, returns rows changed """
+    candids = [int(_c) for _c in (candids or []) if _c is not None]
+    if session is None or not candids:
+        return 0
+    try:
+        _rowcount = session.execute(text(ZTF_LATEST_UPSERT), {'candids': candids}).rowcount
+        session.commit()
+        return _rowcount
+    except Exception:
+        session.rollback()
+        raise
+
+
+# +
+# function: ztf_latest_rebuild()
+# -
+def ztf_latest_rebuild(session=None):
+    """ rebuild latest_alert_per_object from the whole alert table in one transaction, returns rows written """
+    if session is None:
+        raise Exception('ztf_latest_rebuild() entry: session is empty')
+    try:
+        session.execute(text('LOCK TABLE latest_alert_per_object IN EXCLUSIVE MODE'))
+        session.execute(text('DELETE FROM latest_alert_per_object'))
+        _rowcount = session.execute(text(ZTF_LATEST_REBUILD)).rowcount
+        session.commit()
+        return _rowcount
+    except Exception:
+        session.rollback()
+        raise
 
 
 # +
@@ -623,6 +745,47 @@ def _meters_to_degrees(meters=0.0):
     return _meters % 360.0
 
 
+# +
+# function: ztf_cone()
+# -
+def ztf_cone(ra=0.0, dec=0.0, radius=0.0, backend=None):
+    """ return the clause for alerts within radius degrees of (ra, dec): q3c on ra/dec, or postgis on location """
+    if (backend or ZTF_CONE_BACKEND) == 'postgis':
+        return ZtfAlert.location.ST_DWithin(f'srid={DB_SRID};POINT({float(ra)} {float(dec)})',
+                                            _degrees_to_meters(float(radius)))
+    return func.q3c_radial_query(ZtfAlert.ra_deg, ZtfAlert.dec_deg, float(ra), float(dec), float(radius))
+
+
+# +
+# function: ztf_cone_join()
+# -
+def ztf_cone_join(other=None, radius=0.0, backend=None):
+    """ return the clause joining alerts within radius degrees of the (aliased) alert other """
+    if (backend or ZTF_CONE_BACKEND) == 'postgis':
+        return ZtfAlert.location.ST_DWithin(other.location, _degrees_to_meters(float(radius)))
+    return func.q3c_join(other.ra_deg, other.dec_deg, ZtfAlert.ra_deg, ZtfAlert.dec_deg, float(radius))
+
+
+# +
+# function: ztf_ellipse()
+# -
+def ztf_ellipse(ra=0.0, dec=0.0, semi_major=0.0, ratio=1.0, angle=0.0):
+    """ return the q3c clause for alerts within an ellipse (semi-major axis and position angle in degrees) """
+    return func.q3c_ellipse_query(ZtfAlert.ra_deg, ZtfAlert.dec_deg, float(ra), float(dec), float(semi_major),
+                                  float(ratio), float(angle))
+
+
+# +
+# function: ztf_polygon()
+# -
+def ztf_polygon(vertices=None):
+    """ return the q3c clause for alerts within a polygon of [ra1, dec1, ra2, dec2, ...] degrees """
+    vertices = [float(_v) for _v in (vertices or [])]
+    if len(vertices) < 6 or len(vertices) % 2 != 0:
+        raise Exception(f'ztf_polygon() entry: need 3 or more ra,dec vertices, got {vertices}')
+    return func.q3c_poly_query(ZtfAlert.ra_deg, ZtfAlert.dec_deg, array(vertices))
+
+
 # +
 # (hidden) function: _get_simbad2k_coords()
 # -
@@ -733,9 +896,7 @@ def ztf_filters(query, request_args):
     if request_args.get('astrocone'):
         objectname, radius = request_args['astrocone'].split(',')
         ra, dec = _get_astropy_coords(objectname)
-        query = query.filter(
-            ZtfAlert.location.ST_DWithin(f'srid={DB_SRID};POINT({ra} {dec})', _degrees_to_meters(float(radius)))
-        )
+        query = query.filter(ztf_cone(ra, dec, radius))
 
     # return records with galactic b >= value in degrees (API: ?b__gte=20.0)
     if request_args.get('b__gte'):
@@ -760,17 +921,15 @@ def ztf_filters(query, request_args):
     # return records within a cone search with csv-args: ra, dec, radius (API: ?cone=23.5,29.2,0.5)
     if request_args.get('cone'):
         ra, dec, radius = request_args['cone'].split(',')
-        query = query.filter(
-            ZtfAlert.location.ST_DWithin(f'srid={DB_SRID};POINT({ra} {dec})', _degrees_to_meters(float(radius)))
-        )
+        query = query.filter(ztf_cone(ra, dec, radius))
 
     # return records with an Dec >= value in degrees (API: ?dec__gte=20.0)
     if request_args.get('dec__gte'):
-        query = query.filter(cast(ZtfAlert.location, Geometry).ST_Y() >= float(request_args['dec__gte']))
+        query = query.filter(ZtfAlert.dec_deg >= float(request_args['dec__gte']))
 
     # return records with an Dec <= value in degrees (API: ?dec__lte=20.0)
     if request_args.get('dec__lte'):
-        query = query.filter(cast(ZtfAlert.location, Geometry).ST_Y() <= float(request_args['dec__lte']))
+        query = query.filter(ZtfAlert.dec_deg <= float(request_args['dec__lte']))
 
     # return records with a magnitude difference >= abs value (API: ?deltamaglatest__gte=1.0)
     if request_args.get('deltamaglatest__gte'):
@@ -788,6 +947,10 @@ def ztf_filters(query, request_args):
     if request_args.get('deltamagref__lte'):
         query = query.filter(ZtfAlert.deltamagref <= float(request_args['deltamagref__lte']))
 
+    # return only the latest alert of each object, other filters apply to that alert (API: ?distinct_object=true)
+    if f"{request_args.get('distinct_object', '')}".lower() in ['true', '1', 'yes']:
+        query = query.join(ZtfLatestAlert, ZtfLatestAlert.alert_id == ZtfAlert.id)
+
     # return records where the distance to the nearest source >= value (API: ?distnr__gte=1.0)
     if request_args.get('distnr__gte'):
         query = query.filter(ZtfAlert.distnr >= float(request_args['distnr__gte']))
@@ -804,6 +967,12 @@ def ztf_filters(query, request_args):
     if request_args.get('drb__lte'):
         query = query.filter(ZtfAlert.drb <= float(request_args['drb__lte']))
 
+    # return records within an ellipse search with csv-args: ra, dec, semi_major_axis, axis_ratio, position_angle
+    # (API: ?ellipse=202.1,47.2,5.0,0.5,25.0)
+    if request_args.get('ellipse'):
+        ra, dec, semi_major, ratio, angle = request_args['ellipse'].split(',')
+        query = query.filter(ztf_ellipse(ra, dec, semi_major, ratio, angle))
+
     # return records where the exposure time >= value (API: ?exptime__gte=30.0)
     if request_args.get('exptime__gte'):
         query = query.filter(ZtfAlert.exptime >= float(request_args['exptime__gte']))
@@ -860,9 +1029,7 @@ def ztf_filters(query, request_args):
     if request_args.get('objectcone'):
         objectname, radius = request_args['objectcone'].split(',')
         ra, dec = _get_simbad2k_coords(objectname)
-        query = query.filter(
-            ZtfAlert.location.ST_DWithin(f'srid={DB_SRID};POINT({ra} {dec})', _degrees_to_meters(float(radius)))
-        )
+        query = query.filter(ztf_cone(ra, dec, radius))
 
     # return records near a PS1 object ID (API: ?objectidps=178183210973037920)
     if request_args.get('objectidps'):
@@ -874,15 +1041,20 @@ def ztf_filters(query, request_args):
     if request_args.get('objectId'):
         query = query.filter(ZtfAlert.objectId == request_args['objectId'])
 
+    # return records within a polygon search with csv-args: ra1, dec1, ra2, dec2, ra3, dec3, ...
+    # (API: ?polygon=202.0,47.0,203.0,47.0,203.0,48.0)
+    if request_args.get('polygon'):
+        query = query.filter(ztf_polygon(request_args['polygon'].split(',')))
+
     # return records with an RA >= value in degrees (API: ?ra__gte=20.0)
     if request_args.get('ra__gte'):
         ra = float(request_args['ra__gte'])
-        query = query.filter(cast(ZtfAlert.location, Geometry).ST_X() >= ra)
+        query = query.filter(ZtfAlert.ra_deg >= ra)
 
     # return records with an RA <= value in degrees (API: ?ra__lte=20.0)
     if request_args.get('ra__lte'):
         ra = float(request_args['ra__lte'])
-        query = query.filter(cast(ZtfAlert.location, Geometry).ST_X() <= ra)
+        query = query.filter(ZtfAlert.ra_deg <= ra)
 
     # return records with a real/bogus score >= value (API: ?rb__gte=0.3)
     if request_args.get('rb__gte'):
@@ -938,6 +1110,102 @@ def ztf_filters(query, request_args):
     return query
 
 
+# +
+# constant(s) for the column-projected serializer, in ZtfAlert.serialized() order
+# -
+ZTF_ALERT_FIELDS = ['sid', 'objectId', 'publisher', 'candid', 'avro']
+ZTF_CANDIDATE_FIELDS = [
+    'jd', 'wall_time', 'fid', 'filter', 'pid', 'diffmaglim', 'pdiffimfilename', 'programpi', 'programid', 'candid',
+    'isdiffpos', 'tblid', 'nid', 'rcid', 'field', 'xpos', 'ypos', 'ra', 'dec', 'l', 'b', 'magpsf', 'sigmapsf',
+    'deltamaglatest', 'deltamagref', 'chipsf', 'magap', 'distnr', 'sigmagap', 'magnr', 'sigmagnr', 'chinr',
+    'sharpnr', 'sky', 'magdiff', 'fwhm', 'classtar', 'mindtoedge', 'magfromlim', 'seeratio', 'aimage', 'bimage',
+    'aimagerat', 'bimagerat', 'elong', 'nneg', 'nbad', 'rb', 'rbversion', 'ssdistnr', 'ssmagnr', 'ssnamenr',
+    'sumrat', 'magapbig', 'sigmagapbig', 'ranr', 'decnr', 'ndethist', 'ncovhist', 'jdstarthist', 'jdendhist',
+    'scorr', 'tooflag', 'objectidps1', 'sgmag1', 'srmag1', 'simag1', 'szmag1', 'sgscore1', 'distpsnr1',
+    'objectidps2', 'sgmag2', 'srmag2', 'simag2', 'szmag2', 'sgscore2', 'distpsnr2', 'objectidps3', 'sgmag3',
+    'srmag3', 'simag3', 'szmag3', 'sgscore3', 'distpsnr3', 'nmtchps', 'rfid', 'jdstartref', 'jdendref', 'nframesref',
+    'dsnrms', 'ssnrms', 'dsdiff', 'magzpsci', 'magzpsciunc', 'magzpscirms', 'nmatches', 'clrcoeff', 'clrcounc',
+    'zpclrcov', 'zpmed', 'clrmed', 'clrrms', 'neargaia', 'neargaiabright', 'maggaia', 'maggaiabright', 'exptime',
+    'drb', 'drbversion'
+]
+ZTF_FIELD_COLUMNS = {'sid': ['id'], 'candid': ['alert_candid', 'candid'], 'avro': ['jd', 'alert_candid'],
+                     'wall_time': ['jd'], 'filter': ['fid'], 'ra': ['st_x'], 'dec': ['st_y'], 'l': ['gal_l'],
+                     'b': ['gal_b']}
+
+
+# +
+# function: ztf_fields()
+# -
+def ztf_fields(fields=None):
+    """ return the (alert, candidate) keys selected by fields (a list or comma-separated str, empty for all) """
+    if isinstance(fields, str):
+        fields = [_f.strip() for _f in fields.split(',') if _f.strip() != '']
+    _fields = set(fields or [])
+    if not _fields:
+        return list(ZTF_ALERT_FIELDS), list(ZTF_CANDIDATE_FIELDS)
+    return [_f for _f in ZTF_ALERT_FIELDS if _f in _fields], [_f for _f in ZTF_CANDIDATE_FIELDS if _f in _fields]
+
+
+# +
+# function: ztf_columns()
+# -
+def ztf_columns(fields=None):
+    """ return the labelled column(s) needed to serialize fields, ra and dec fall back to ST_X() and ST_Y() """
+    _alert, _candidate = ztf_fields(fields)
+    _names = []
+    for _f in _alert + _candidate:
+        for _n in ZTF_FIELD_COLUMNS.get(_f, [_f]):
+            if _n not in _names:
+                _names.append(_n)
+    _point = cast(ZtfAlert.location, Geometry)
+    _sql = {'st_x': func.coalesce(ZtfAlert.ra_deg, func.ST_X(_point)),
+            'st_y': func.coalesce(ZtfAlert.dec_deg, func.ST_Y(_point))}
+    return [_sql[_n].label(_n) if _n in _sql else getattr(ZtfAlert, _n).label(_n) for _n in _names]
+
+
+# +
+# function: ztf_serialize_rows()
+# -
+def ztf_serialize_rows(rows=None, fields=None):
+    """ serialize rows selected with ztf_columns(fields) in the shape of ZtfAlert.serialized() """
+    rows = list(rows or [])
+    _alert, _candidate = ztf_fields(fields)
+
+    # one vectorized jd to datetime conversion for the whole page
+    _times = []
+    if rows and ('avro' in _alert or 'wall_time' in _candidate):
+        _times = jd_to_datetime([_r.jd for _r in rows])
+
+    _results = []
+    for _i, _r in enumerate(rows):
+        _values = {}
+        for _f in _alert + _candidate:
+            if _f == 'sid':
+                _values[_f] = _r.id
+            elif _f == 'candid':
+                _values[_f] = _r.alert_candid
+            elif _f == 'avro':
+                _values[_f] = ztf_avro_url(f'{_times[_i].year}/{_times[_i].month:02d}/{_times[_i].day:02d}',
+                                           _r.alert_candid)
+            elif _f == 'wall_time':
+                _values[_f] = _times[_i]
+            elif _f == 'filter':
+                _values[_f] = ZTF_FILTERS[_r.fid - 1]
+            elif _f == 'ra':
+                _values[_f] = _r.st_x + 360.0 if _r.st_x <= 0.0 else _r.st_x
+            elif _f == 'dec':
+                _values[_f] = _r.st_y
+            elif _f in ZTF_FIELD_COLUMNS:
+                _values[_f] = getattr(_r, ZTF_FIELD_COLUMNS[_f][0])
+            else:
+                _values[_f] = getattr(_r, _f)
+        _result = {_f: _values[_f] for _f in _alert}
+        if _candidate:
+            _result['candidate'] = {_f: (_r.candid if _f == 'candid' else _values[_f]) for _f in _candidate}
+        _results.append(_result)
+    return _results
+
+
 # +
 # function: nd_cli_db()
 # -
@@ -1077,6 +1345,8 @@ def ztf_cli_db(iargs=None):
         request_args['deltamagref__gte'] = f'{iargs.deltamagref__gte}'
     if iargs.deltamagref__lte:
         request_args['deltamagref__lte'] = f'{iargs.deltamagref__lte}'
+    if iargs.distinct_object:
+        request_args['distinct_object'] = 'true'
     if iargs.distnr__gte:
         request_args['distnr__gte'] = f'{iargs.distnr__gte}'
     if iargs.distnr__lte:
@@ -1085,6 +1355,8 @@ def ztf_cli_db(iargs=None):
         request_args['drb__gte'] = f'{iargs.drb__gte}'
     if iargs.drb__lte:
         request_args['drb__lte'] = f'{iargs.drb__lte}'
+    if iargs.ellipse:
+        request_args['ellipse'] = f'{iargs.ellipse}'
     if iargs.exptime__gte:
         request_args['exptime__gte'] = f'{iargs.exptime__gte}'
     if iargs.exptime__lte:
@@ -1117,6 +1389,8 @@ def ztf_cli_db(iargs=None):
         request_args['objectidps'] = f'{iargs.objectidps}'
     if iargs.objectId:
         request_args['objectId'] = f'{iargs.objectId}'
+    if iargs.polygon:
+        request_args['polygon'] = f'{iargs.polygon}'
     if iargs.ra__gte:
         request_args['ra__gte'] = f'{iargs.ra__gte}'
     if iargs.ra__lte:
@@ -1319,10 +1593,13 @@ if __name__ == '__main__':
     _p.add_argument(f'--deltamaglatest__lte', help=f'DeltaMagLatest <= <float>')
     _p.add_argument(f'--deltamagref__gte', help=f'DeltaMagRef >= <float>')
     _p.add_argument(f'--deltamagref__lte', help=f'DeltaMagRef <= <float>')
+    _p.add_argument(f'--distinct_object', default=False, action='store_true',
+                    help=f'if present, return only the latest alert of each object')
     _p.add_argument(f'--distnr__gte', help=f'Distance to nearest object >= <float>')
     _p.add_argument(f'--distnr__lte', help=f'Distance to nearest object <= <float>')
     _p.add_argument(f'--drb__gte', help=f'Deep-Learning Real-Bogus score >= <float>')
     _p.add_argument(f'--drb__lte', help=f'Deep-Learning Real-Bogus score <= <float>')
+    _p.add_argument(f'--ellipse', help=f'Ellipse search <ra,dec,semi_major_axis,axis_ratio,position_angle>')
     _p.add_argument(f'--exptime__gte', help=f'Exposire time >= <float>')
     _p.add_argument(f'--exptime__lte', help=f'Exposire time <= <float>')
     _p.add_argument(f'--filter', help=f'filter <str>')
@@ -1339,6 +1616,7 @@ if __name__ == '__main__':
     _p.add_argument(f'--objectcone', help=f'Cone search by name <str, str>')
     _p.add_argument(f'--objectidps', help=f'IDPS object <int>')
     _p.add_argument(f'--objectId', help=f'Object ID <str>')
+    _p.add_argument(f'--polygon', help=f'Polygon search <ra1,dec1,ra2,dec2,ra3,dec3,...>')
     _p.add_argument(f'--ra__gte', help=f'RA >= <float>')
     _p.add_argument(f'--ra__lte', help=f'RA <= <float>')
     _p.add_argument(f'--rb__gte', help=f'Real-Bogus score >= <float>')
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from src.query_guard import guard_count
+from src.query_guard import guard_query
+from src.utils.utils import UtilsLogger
+
+from datetime import date
+from datetime import datetime
+from sqlalchemy import and_
+from sqlalchemy import text
+from sqlalchemy import tuple_
+from sqlalchemy.dialects import postgresql
+
+import base64
+import binascii
+import json
+import math
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    Keyset (seek) pagination for list endpoints.
+
+    Pages are addressed by opaque cursor tokens rather than page numbers: a token records the sort
+    column, direction and the (sort value, id) of the row at the edge of the page, so the next page is
+    a WHERE (value, id) > (v, i) ... LIMIT n on an index instead of an OFFSET scan. Sort columns that
+    are nullable cannot be compared that way and fall back to an OFFSET carried inside the token.
+
+    The total is estimated from pg_class (no filters) or EXPLAIN (with filters) unless ?count=exact.
+    Given a route, the page statement as executed (with any OFFSET) and the exact count are checked by
+    src.query_guard first, raising QueryTooExpensive if either is over the route's limits.
+
+    >>> from src.pagination import keyset_paginate
+    >>> paginator = keyset_paginate(query, ZtfAlert, request.args, 'jd', 'desc', route='ztf')
+    >>> paginator.items, paginator.next, paginator.prev, paginator.total
+"""
+
+
+# +
+# constant(s)
+# -
+DESCENDING = ['desc', 'descending']
+RESULTS_PER_PAGE = 50
+
+
+# +
+# logging
+# -
+logger = UtilsLogger('pagination').logger
+
+
+# +
+# (hidden) function: _encode_value()
+# -
+def _encode_value(value=None):
+    if isinstance(value, datetime):
+        return {'t': 'dt', 'v': value.isoformat()}
+    elif isinstance(value, date):
+        return {'t': 'd', 'v': value.isoformat()}
+    return {'v': value}
+
+
+# +
+# (hidden) function: _decode_value()
+# -
+def _decode_value(value=None):
+    if value.get('t') == 'dt':
+        return datetime.fromisoformat(value['v'])
+    elif value.get('t') == 'd':
+        return date.fromisoformat(value['v'])
+    return value['v']
+
+
+# +
+# function: encode_cursor()
+# -
+def encode_cursor(payload=None):
+    """ return an opaque, url-safe token for payload """
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+
+# +
+# function: decode_cursor()
+# -
+def decode_cursor(token=''):
+    """ return the payload of a token, or None if it is missing or malformed """
+    if not isinstance(token, str) or token.strip() == '':
+        return None
+    try:
+        _payload = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except (binascii.Error, UnicodeError, ValueError) as e:
+        logger.warning(f'ignoring malformed cursor {token}, error={e}')
+        return None
+    if not _valid_cursor(_payload):
+        logger.warning(f'ignoring malformed cursor {token}, payload={_payload!r}')
+        return None
+    return _payload
+
+
+# +
+# (hidden) function: _valid_cursor()
+# -
+def _valid_cursor(payload=None):
+    """ return True if payload has the keys and types that keyset_paginate() writes """
+
+    def _is_int(_v=None):
+        return isinstance(_v, int) and not isinstance(_v, bool)
+
+    if not isinstance(payload, dict) or not isinstance(payload.get('c'), str) or \
+            not isinstance(payload.get('o'), bool) or payload.get('d') not in ['n', 'p'] or \
+            not _is_int(payload.get('n')) or payload['n'] < 1:
+        return False
+    if 'i' in payload:
+        _value = payload.get('v')
+        return _is_int(payload['i']) and isinstance(_value, dict) and 'v' in _value and \
+            (_value.get('t') is None or (_value['t'] in ['dt', 'd'] and isinstance(_value['v'], str)))
+    return _is_int(payload.get('f')) and payload['f'] >= 0
+
+
+# +
+# function: estimate_count()
+# -
+# noinspection PyBroadException
+def estimate_count(query=None, model=None):
+    """ return the planner's row estimate for query (pg_class.reltuples when unfiltered) """
+    try:
+        _statement = query.order_by(None).limit(None).offset(None).statement
+        if _statement.whereclause is None:
+            _reltuples = query.session.execute(text('SELECT reltuples FROM pg_class WHERE oid = CAST(:t AS regclass)'),
+                                               {'t': model.__tablename__}).scalar()
+            if _reltuples is not None and _reltuples >= 0.0:
+                return int(_reltuples)
+            return query.order_by(None).count()
+        _compiled = _statement.compile(dialect=postgresql.dialect())
+        _plan = query.session.connection().execute(f'EXPLAIN (FORMAT JSON) {_compiled}', _compiled.params).scalar()
+        _plan = json.loads(_plan) if isinstance(_plan, str) else _plan
+        return int(_plan[0]['Plan']['Plan Rows'])
+    except Exception as e:
+        logger.warning(f'unable to estimate count, falling back to exact, error={e}')
+        query.session.rollback()
+        return query.order_by(None).count()
+
+
+# +
+# class: KeysetPage()
+# -
+class KeysetPage(object):
+
+    def __init__(self, items=None, page=1, per_page=RESULTS_PER_PAGE, total=0, estimated=True, next_token='',
+                 prev_token=''):
+        self.items = items or []
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.total_is_estimate = estimated
+        self.next = next_token
+        self.prev = prev_token
+        self.has_next = next_token != ''
+        self.has_prev = prev_token != ''
+        self.pages = max(1, int(math.ceil(total / per_page))) if per_page > 0 else 1
+
+    def serialized(self):
+        return {'total': self.total, 'total_is_estimate': self.total_is_estimate, 'pages': self.pages,
+                'page': self.page, 'has_next': self.has_next, 'has_prev': self.has_prev, 'next': self.next,
+                'prev': self.prev}
+
+
+# +
+# function: keyset_paginate()
+# -
+def keyset_paginate(query=None, model=None, request_args=None, default_value='id', default_order='asc',
+                    per_page=RESULTS_PER_PAGE, columns=None, route=''):
+    """ return a KeysetPage for query ordered by (?sort_value, id) and positioned by ?cursor, items are rows of
+        the labelled columns if given (the id and sort columns are added if missing), the page and exact count
+        are checked by guard_query() for route if given """
+
+    # check input(s)
+    request_args = request_args if request_args is not None else {}
+    _columns = model.__table__.columns
+    sort_value = request_args.get('sort_value', default_value)
+    sort_value = sort_value if sort_value in _columns else default_value
+    sort_order = f"{request_args.get('sort_order', default_order)}".lower()
+    descending = sort_order in DESCENDING
+    exact = f"{request_args.get('count', '')}".lower() == 'exact'
+
+    # the primary key breaks ties so that the ordering is total
+    _pk = list(model.__table__.primary_key.columns)[0]
+    _key = getattr(model, _pk.name)
+    _sort = getattr(model, sort_value)
+    _seek = not _columns[sort_value].nullable
+
+    # decode and validate the cursor against the current sort
+    cursor = decode_cursor(request_args.get('cursor', ''))
+    if cursor is not None and (cursor['c'] != sort_value or cursor['o'] != descending or
+                               ('i' in cursor) != _seek):
+        cursor = None
+
+    # a cursor whose edge value does not decode is treated as missing
+    _value = None
+    if cursor is not None and 'i' in cursor:
+        try:
+            _value = _decode_value(cursor['v'])
+        except (TypeError, ValueError) as e:
+            logger.warning(f'ignoring cursor with malformed value {cursor["v"]!r}, error={e}')
+            cursor = None
+    _backward = cursor is not None and cursor.get('d') == 'p'
+    try:
+        page = max(1, int(cursor.get('n', 1) if cursor is not None else request_args.get('page', 1) or 1))
+    except (TypeError, ValueError):
+        page = 1
+
+    # filters are kept, only the order (and optionally the projection) is replaced
+    _query = query.order_by(None)
+    if columns:
+        _labels = [_c.key for _c in columns]
+        _query = _query.with_entities(*(list(columns) + [_c.label(_n) for _c, _n in (
+            (_key, _pk.name), (_sort, sort_value)) if _n not in _labels]))
+    _forward_desc = descending != _backward
+    _order = [_sort.desc(), _key.desc()] if _forward_desc else [_sort.asc(), _key.asc()]
+
+    # seek past the edge row, or fall back to an offset for nullable sort columns
+    _offset = 0
+    if _seek and cursor is not None and 'i' in cursor:
+        _id = cursor['i']
+        if _forward_desc:
+            _query = _query.filter(and_(_sort <= _value, tuple_(_sort, _key) < tuple_(_value, _id)))
+        else:
+            _query = _query.filter(and_(_sort >= _value, tuple_(_sort, _key) > tuple_(_value, _id)))
+    elif _seek and cursor is None and page > 1:
+        _offset = (page - 1) * per_page
+    elif not _seek:
+        _offset = cursor['f'] if cursor is not None else (page - 1) * per_page
+        _order = [_sort.desc().nullslast(), _key.desc()] if descending else [_sort.asc().nullsfirst(), _key.asc()]
+
+    # refuse the page (and the exact count) the planner expects to be too expensive
+    _page = _query.order_by(*_order).offset(_offset).limit(per_page + 1)
+    if route:
+        guard_query(_page, route)
+        if exact:
+            guard_count(query, route)
+    _rows = _page.all()
+    _more = len(_rows) > per_page
+    items = _rows[:per_page]
+    if _backward and _seek:
+        items.reverse()
+
+    # build the token(s) for the adjacent page(s)
+    _base = {'c': sort_value, 'o': descending}
+    next_token, prev_token = '', ''
+    if items and _seek:
+        _has_next = True if _backward else _more
+        _has_prev = (_more if _backward else (cursor is not None or page > 1))
+        if _has_next:
+            next_token = encode_cursor(dict(_base, d='n', n=page + 1, i=getattr(items[-1], _pk.name),
+                                            v=_encode_value(getattr(items[-1], sort_value))))
+        if _has_prev:
+            prev_token = encode_cursor(dict(_base, d='p', n=max(1, page - 1), i=getattr(items[0], _pk.name),
+                                            v=_encode_value(getattr(items[0], sort_value))))
+    elif items:
+        if _more:
+            next_token = encode_cursor(dict(_base, d='n', n=page + 1, f=_offset + per_page))
+        if _offset > 0:
+            prev_token = encode_cursor(dict(_base, d='p', n=max(1, page - 1), f=max(0, _offset - per_page)))
+
+    # total
+    total = query.order_by(None).count() if exact else estimate_count(query, model)
+    return KeysetPage(items, page, per_page, total, not exact, next_token, prev_token)
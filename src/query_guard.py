@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from src.utils.utils import UtilsLogger
+
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql
+
+import json
+import os
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    Pre-flight planner check for user-built (ztf_filters, catalog filters) queries.
+
+    guard_query() runs EXPLAIN (FORMAT JSON) on the query and compares the planner's total cost and
+    row estimate with the limits of the route (QUERY_GUARD_LIMITS, else SASSY_QUERY_GUARD_COST and
+    SASSY_QUERY_GUARD_ROWS). A query over the limits is downgraded to LIMIT <rows> if the caller allows
+    it and that brings the cost under the limit, otherwise QueryTooExpensive is raised with the
+    estimate and a hint on how to narrow the search. SASSY_QUERY_GUARD=off disables the check and
+    SASSY_QUERY_GUARD=reject never downgrades. If EXPLAIN itself fails the query is let through.
+
+    guard_page() checks a page as it is executed (LIMIT and OFFSET) and, optionally, the SELECT count(*)
+    of the whole result; guard_count() checks the count alone.
+
+    >>> from src.query_guard import guard_query
+    >>> query, warning = guard_query(ztf_filters(db.session.query(ZtfAlert), args), 'ztf', downgrade=True)
+    >>> guard_page(glade_q3c_filters(db.session.query(GladeQ3cRecord), args), 'glade_q3c', page=20, count=True)
+"""
+
+
+# +
+# constant(s)
+# -
+QUERY_GUARD_COST = float(os.getenv("SASSY_QUERY_GUARD_COST", 1.0e6))
+QUERY_GUARD_MODES = ['downgrade', 'reject', 'off']
+QUERY_GUARD_MODE = os.getenv("SASSY_QUERY_GUARD", QUERY_GUARD_MODES[0]).lower()
+QUERY_GUARD_PAGE = 50
+QUERY_GUARD_ROWS = int(os.getenv("SASSY_QUERY_GUARD_ROWS", 100000))
+
+QUERY_GUARD_LIMITS = {
+    'ztf': {'cost': QUERY_GUARD_COST, 'rows': QUERY_GUARD_ROWS},
+    'sassy_cron': {'cost': QUERY_GUARD_COST, 'rows': QUERY_GUARD_ROWS},
+    'glade': {'cost': 0.5 * QUERY_GUARD_COST, 'rows': QUERY_GUARD_ROWS},
+    'glade_q3c': {'cost': 0.5 * QUERY_GUARD_COST, 'rows': QUERY_GUARD_ROWS}
+}
+QUERY_GUARD_HINTS = {
+    'ztf': 'add a cone, astrocone, objectcone, ellipse or polygon search, an objectId or candid, or a narrower '
+           'jd__gte/jd__lte (time__gte/time__lte) or ra__*/dec__* range; l__* and b__* bounds alone cannot use '
+           'an index',
+    'sassy_cron': 'add a zoid or zcandid, or a narrower zjd__gte/zjd__lte range',
+    'glade': 'add a cone search or a narrower ra/dec range',
+    'glade_q3c': 'add a cone search or a narrower ra/dec range'
+}
+QUERY_GUARD_HINT = 'add more selective filters'
+
+
+# +
+# logging
+# -
+logger = UtilsLogger('query_guard').logger
+
+
+# +
+# class: QueryTooExpensive(), inherits from Exception
+# -
+class QueryTooExpensive(Exception):
+
+    # +
+    # method: __init__()
+    # -
+    def __init__(self, route='', cost=0.0, rows=0, limits=None):
+        self.route = route
+        self.cost = cost
+        self.rows = rows
+        self.limits = limits or {'cost': QUERY_GUARD_COST, 'rows': QUERY_GUARD_ROWS}
+        self.hint = QUERY_GUARD_HINTS.get(route, QUERY_GUARD_HINT)
+        Exception.__init__(self, f'query too expensive: estimated cost {cost:.0f} and {rows} rows, limits are '
+                                 f'{self.limits["cost"]:.0f} and {self.limits["rows"]} rows, {self.hint}')
+
+    # +
+    # method: serialized()
+    # -
+    def serialized(self):
+        return {'error': f'{self}', 'route': self.route, 'estimated_cost': self.cost, 'estimated_rows': self.rows,
+                'max_cost': self.limits['cost'], 'max_rows': self.limits['rows'], 'hint': self.hint}
+
+
+# +
+# function: explain_query()
+# -
+# noinspection PyBroadException
+def explain_query(query=None):
+    """ return the planner's {'cost', 'rows'} for query, or None if it cannot be explained """
+    try:
+        _statement = query.statement
+        _compiled = _statement.compile(dialect=postgresql.dialect())
+        _plan = query.session.connection(clause=_statement).execute(
+            f'EXPLAIN (FORMAT JSON) {_compiled}', _compiled.params).scalar()
+        _plan = json.loads(_plan) if isinstance(_plan, str) else _plan
+        return {'cost': float(_plan[0]['Plan']['Total Cost']), 'rows': int(_plan[0]['Plan']['Plan Rows'])}
+    except Exception as e:
+        logger.warning(f'unable to explain query, error={e}')
+        return None
+
+
+# +
+# function: guard_query()
+# -
+def guard_query(query=None, route='', downgrade=False):
+    """ return (query, warning) if the planner's estimate is within the route's limits, the query may be
+        downgraded to LIMIT <rows> (with a warning) if downgrade is True, else raise QueryTooExpensive """
+
+    # check input(s)
+    if query is None:
+        raise Exception('guard_query() entry: query is empty')
+    if QUERY_GUARD_MODE == 'off':
+        return query, None
+    _limits = QUERY_GUARD_LIMITS.get(route, {'cost': QUERY_GUARD_COST, 'rows': QUERY_GUARD_ROWS})
+
+    # within limits (or no estimate)
+    _plan = explain_query(query)
+    if _plan is None or (_plan['cost'] <= _limits['cost'] and _plan['rows'] <= _limits['rows']):
+        return query, None
+
+    # cap the rows if that makes the query cheap enough
+    if downgrade and QUERY_GUARD_MODE == 'downgrade':
+        _limited = query.limit(int(_limits['rows']))
+        _limited_plan = explain_query(_limited)
+        if _limited_plan is not None and _limited_plan['cost'] <= _limits['cost']:
+            logger.info(f'downgraded {route} query, estimated cost {_plan["cost"]:.0f}, rows {_plan["rows"]}')
+            return _limited, f'results limited to {_limits["rows"]} rows (about {_plan["rows"]} match), ' \
+                             f'{QUERY_GUARD_HINTS.get(route, QUERY_GUARD_HINT)}'
+
+    logger.warning(f'rejected {route} query, estimated cost {_plan["cost"]:.0f}, rows {_plan["rows"]}')
+    raise QueryTooExpensive(route, _plan['cost'], _plan['rows'], _limits)
+
+
+# +
+# function: guard_count()
+# -
+def guard_count(query=None, route=''):
+    """ raise QueryTooExpensive if the planner expects SELECT count(*) over query to be beyond the route's limits """
+
+    # check input(s)
+    if query is None:
+        raise Exception('guard_count() entry: query is empty')
+    guard_query(query.session.query(func.count()).select_from(query.order_by(None).subquery()), route)
+
+
+# +
+# function: guard_page()
+# -
+def guard_page(query=None, route='', page=1, per_page=QUERY_GUARD_PAGE, count=False):
+    """ raise QueryTooExpensive if LIMIT per_page OFFSET (page - 1) * per_page of query, or (if count is True)
+        its SELECT count(*), is beyond the route's limits """
+
+    # check input(s)
+    if query is None:
+        raise Exception('guard_page() entry: query is empty')
+    page = page if (isinstance(page, int) and page > 0) else 1
+    guard_query(query.limit(per_page).offset((page - 1) * per_page), route)
+    if count:
+        guard_count(query, route)
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from src.avro_cache import private_dir
+from src.utils.utils import UtilsLogger
+
+from collections import OrderedDict
+from flask import make_response
+from flask import request
+from functools import wraps
+from urllib.parse import urlencode
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    Cache rendered GET responses of read-only routes, with ETag / If-None-Match support.
+
+    Entries are keyed on the route path, the normalized (sorted) query string, the format the view will
+    render (request_wants_json(), the views' own decision) and the current generation of the table behind
+    the route. Invalidating a table drops its entries and bumps its generation, so a response rendered from
+    the old data is never stored under the new one; TableStats does this whenever ingest, a reader or a
+    scraper NOTIFYs that the table changed. Each table has its own TTL (RESPONSE_CACHE_TTLS). Responses
+    carry Vary: Accept, since the body depends on it.
+
+    The backend is chosen by SASSY_RESPONSE_CACHE: 'memory' (an in-process LRU, the default),
+    'file:<directory>' (shared by every worker on the host) or 'none'. A file cache stores each body next
+    to a JSON metadata file (nothing is unpickled) and is disabled unless <directory> is private: owned by
+    the web app's user and not accessible by anyone else.
+
+    >>> from src.response_cache import RESPONSE_CACHE
+    >>> @app.route('/sassy/glade/<int:dbid>/')
+    ... @RESPONSE_CACHE.cached('glade')
+    ... def glade_id(dbid=0): ...
+    >>> RESPONSE_CACHE.invalidate('glade')
+"""
+
+
+# +
+# constant(s)
+# -
+RESPONSE_CACHE_BACKEND = os.getenv("SASSY_RESPONSE_CACHE", "memory")
+RESPONSE_CACHE_ENTRIES = int(os.getenv("SASSY_RESPONSE_CACHE_ENTRIES", 1024))
+RESPONSE_CACHE_PRUNE = 1000
+RESPONSE_CACHE_TTL = 300
+RESPONSE_CACHE_TTLS = {
+    'glade': 86400, 'glade_q3c': 86400, 'gwgc': 86400, 'gwgc_q3c': 86400,
+    'ligo': 3600, 'ligo_q3c': 3600, 'tns': 600, 'tns_q3c': 600
+}
+
+
+# +
+# logging
+# -
+logger = UtilsLogger('response_cache').logger
+
+
+# +
+# function: request_wants_json()
+# -
+def request_wants_json():
+    """ return True if the current request asks for json (?format=json, or json strictly preferred to html) """
+    if request.args.get('format', 'html', type=str) == 'json':
+        return True
+    _best = request.accept_mimetypes.best_match(['application/json', 'text/html'])
+    return _best == 'application/json' and request.accept_mimetypes[_best] > request.accept_mimetypes['text/html']
+
+
+# +
+# class: MemoryBackend()
+# -
+class MemoryBackend(object):
+
+    # +
+    # method: __init__()
+    # -
+    def __init__(self, entries=RESPONSE_CACHE_ENTRIES):
+        self.__entries = entries if (isinstance(entries, int) and entries > 0) else RESPONSE_CACHE_ENTRIES
+        self.__lock = threading.Lock()
+        self.__cache = OrderedDict()
+
+    # +
+    # method: get(), set(), clear()
+    # -
+    def get(self, key='', table=''):
+        with self.__lock:
+            _entry = self.__cache.get((table, key), None)
+            if _entry is None:
+                return None
+            if _entry['expires'] < time.time():
+                del self.__cache[(table, key)]
+                return None
+            self.__cache.move_to_end((table, key))
+            return _entry
+
+    def set(self, key='', entry=None, table=''):
+        with self.__lock:
+            self.__cache[(table, key)] = entry
+            self.__cache.move_to_end((table, key))
+            while len(self.__cache) > self.__entries:
+                self.__cache.popitem(last=False)
+
+    def clear(self, table=None):
+        with self.__lock:
+            for _k in [_k for _k in self.__cache if table is None or _k[0] == table]:
+                del self.__cache[_k]
+
+
+# +
+# class: FileBackend()
+# -
+class FileBackend(object):
+
+    # +
+    # method: __init__()
+    # -
+    def __init__(self, directory=''):
+        if not isinstance(directory, str) or directory.strip() == '':
+            raise Exception('FileBackend() entry: directory is empty')
+        self.__dir = os.path.abspath(os.path.expanduser(directory))
+        self.__lock = threading.Lock()
+        self.__sets = 0
+        self.__private = None
+
+    # +
+    # property(s)
+    # -
+    @property
+    def private(self):
+        """ check (once) that the cache directory is private, the backend is disabled if it is not """
+        with self.__lock:
+            if self.__private is None:
+                self.__private = private_dir(self.__dir)
+                if not self.__private:
+                    logger.warning(f'disabling the response cache in {self.__dir}')
+            return self.__private
+
+    # +
+    # method: get(), set(), clear()
+    # -
+    def get(self, key='', table=''):
+        if not self.private:
+            return None
+        _path = self.__path(key, table)
+        try:
+            with open(f'{_path}.json', 'r') as _f:
+                _entry = json.load(_f)
+            with open(f'{_path}.body', 'rb') as _f:
+                _entry['body'] = _f.read()
+        except FileNotFoundError:
+            return None
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f'discarding unreadable cache entry {_path}, error={e}')
+            self.__remove(_path)
+            return None
+
+        # a body replaced under its metadata no longer matches the etag
+        if _entry.get('key') != key or hashlib.sha1(_entry['body']).hexdigest() != _entry.get('etag') or \
+                not isinstance(_entry.get('expires'), (int, float)) or _entry['expires'] < time.time():
+            self.__remove(_path)
+            return None
+        return _entry
+
+    def set(self, key='', entry=None, table=''):
+        if not self.private:
+            return
+        _path = self.__path(key, table)
+        _meta = {_k: _v for _k, _v in entry.items() if _k != 'body'}
+        try:
+            os.makedirs(os.path.dirname(_path), mode=0o700, exist_ok=True)
+
+            # body first, then the metadata (which makes the entry visible), each via an atomic rename
+            for _suffix, _mode, _data in [('.body', 'wb', entry['body']),
+                                          ('.json', 'w', json.dumps(dict(_meta, key=key)))]:
+                _fd, _tmp = tempfile.mkstemp(dir=os.path.dirname(_path), suffix='.tmp')
+                with os.fdopen(_fd, _mode) as _f:
+                    _f.write(_data)
+                os.replace(_tmp, f'{_path}{_suffix}')
+        except OSError as e:
+            logger.warning(f'unable to write cache entry {_path}, error={e}')
+            return
+
+        # entries orphaned by an invalidation are never read again, so sweep out expired ones now and then
+        with self.__lock:
+            self.__sets += 1
+            _prune = self.__sets % RESPONSE_CACHE_PRUNE == 0
+        if _prune:
+            self.prune()
+
+    def clear(self, table=None):
+        self.prune(float('inf'), table)
+
+    # +
+    # method: prune()
+    # -
+    def prune(self, now=None, table=None):
+        """ remove entries (of table, default all) that expired before now (default: the current time) """
+        if not self.private:
+            return
+        now = time.time() if now is None else now
+        for _root, _dirs, _files in os.walk(self.__dir if table is None else os.path.join(self.__dir, table or '_')):
+            for _name in [_n for _n in _files if _n.endswith('.json')]:
+                _path = os.path.join(_root, _name[:-len('.json')])
+                try:
+                    with open(f'{_path}.json', 'r') as _f:
+                        _expired = json.load(_f)['expires'] < now
+                except (OSError, ValueError, KeyError, TypeError):
+                    _expired = True
+                if _expired:
+                    self.__remove(_path)
+
+    # +
+    # (hidden) method: __path(), __remove()
+    # -
+    def __path(self, key='', table=''):
+        _digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.__dir, table or '_', _digest[:2], _digest)
+
+    @staticmethod
+    def __remove(path=''):
+        for _suffix in ['.json', '.body']:
+            try:
+                os.remove(f'{path}{_suffix}')
+            except OSError:
+                pass
+
+
+# +
+# class: ResponseCache()
+# -
+class ResponseCache(object):
+
+    # +
+    # method: __init__()
+    # -
+    def __init__(self, backend=None, ttls=None):
+        self.__backend = backend
+        self.__ttls = ttls if isinstance(ttls, dict) else RESPONSE_CACHE_TTLS
+        self.__lock = threading.Lock()
+        self.__generations = {}
+        self.__counts = {'hit': 0, 'miss': 0, 'not_modified': 0, 'invalidated': 0}
+
+    # +
+    # property(s)
+    # -
+    @property
+    def counts(self):
+        with self.__lock:
+            return dict(self.__counts)
+
+    # +
+    # method: generation()
+    # -
+    def generation(self, table=''):
+        with self.__lock:
+            return self.__generations.get(table, 0)
+
+    # +
+    # method: invalidate()
+    # -
+    def invalidate(self, table=None):
+        """ forget every cached response for table (or for every table) """
+        if self.__backend is None:
+            return
+        with self.__lock:
+            self.__counts['invalidated'] += 1
+            for _t in ([table] if table is not None else list(self.__generations)):
+                self.__generations[_t] = self.__generations.get(_t, 0) + 1
+        self.__backend.clear(table)
+        logger.debug(f'invalidated cached responses for {table or "every table"}')
+
+    # +
+    # method: key()
+    # -
+    def key(self, table=''):
+        """ return the cache key of the current request """
+        _args = urlencode(sorted(request.args.items(multi=True)))
+        _format = 'json' if request_wants_json() else 'html'
+        return f'{table}:{self.generation(table)}|{request.path}?{_args}|{_format}'
+
+    # +
+    # method: cached()
+    # -
+    def cached(self, table='', ttl=None):
+        """ decorator: serve GET responses of a route from the cache for ttl (default: the table's) seconds """
+        ttl = ttl if isinstance(ttl, (int, float)) and ttl > 0 else self.__ttls.get(table, RESPONSE_CACHE_TTL)
+
+        def _decorator(view=None):
+
+            @wraps(view)
+            def _wrapper(*args, **kwargs):
+                if self.__backend is None or request.method != 'GET':
+                    return view(*args, **kwargs)
+
+                # hit
+                _key = self.key(table)
+                _entry = self.__backend.get(_key, table)
+                if _entry is not None:
+                    _response = self.__to_response(_entry)
+                    self.__count('not_modified' if _response.status_code == 304 else 'hit')
+                    return _response
+
+                # miss: cache only complete, successful responses
+                self.__count('miss')
+                _response = make_response(view(*args, **kwargs))
+                if _response.status_code != 200 or _response.is_streamed or _response.direct_passthrough:
+                    return _response
+                _entry = {'body': _response.get_data(), 'status': _response.status_code,
+                          'mimetype': _response.mimetype, 'expires': time.time() + ttl}
+                _entry['etag'] = hashlib.sha1(_entry['body']).hexdigest()
+                self.__backend.set(_key, _entry, table)
+                return self.__to_response(_entry)
+
+            return _wrapper
+        return _decorator
+
+    # +
+    # (hidden) method: __count(), __to_response()
+    # -
+    def __count(self, name=''):
+        with self.__lock:
+            self.__counts[name] += 1
+
+    @staticmethod
+    def __to_response(entry=None):
+        _response = make_response(entry['body'], entry['status'])
+        _response.mimetype = entry['mimetype']
+        _response.set_etag(entry['etag'])
+        _response.vary.add('Accept')
+        _response.headers['Cache-Control'] = f'public, max-age={int(max(0.0, entry["expires"] - time.time()))}'
+        return _response.make_conditional(request)
+
+
+# +
+# function: get_backend()
+# -
+def get_backend(spec=RESPONSE_CACHE_BACKEND):
+    """ return the backend named by spec ('memory', 'file:<directory>' or 'none') """
+    spec = f'{spec}'.strip()
+    if spec.lower() in ['', 'none', 'off']:
+        return None
+    elif spec.lower().startswith('file:'):
+        return FileBackend(spec[5:])
+    return MemoryBackend()
+
+
+# +
+# global cache
+# -
+RESPONSE_CACHE = ResponseCache(get_backend(RESPONSE_CACHE_BACKEND))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from src.query_guard import guard_query
+from src.utils.utils import UtilsLogger
+
+from flask import Response
+from flask import json
+from flask import stream_with_context
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    Stream multi-query POST results instead of building them in memory.
+
+    Rows are read through a server-side cursor (Query.yield_per) and serialized one at a time, so memory
+    is bounded by STREAM_CHUNK rows whatever the size of the result. Two formats are available:
+
+      ?stream=ndjson (or Accept: application/x-ndjson) - one JSON object per line:
+          {"query": 0, "args": {...}}            once per query
+          {"query": 0, "result": {...}}          once per row
+          {"query": 0, "num_alerts": n}          once per query
+          {"total": n}                           last line
+      ?stream=json - the usual {"results": [{"query": ..., "results": [...], "num_alerts": n}], "total": n}
+          document, written out in chunks
+
+    Given a route, every search is checked by src.query_guard.guard_query() before the response starts,
+    so an expensive search raises QueryTooExpensive (or is capped, with a "warning" next to its args).
+
+    >>> from src.streaming import stream_queries, stream_format
+    >>> if stream_format(request): return stream_queries(db.session, ZtfAlert, ztf_filters, searches, fmt)
+"""
+
+
+# +
+# constant(s)
+# -
+NDJSON_MIMETYPE = 'application/x-ndjson'
+STREAM_CHUNK = 500
+STREAM_FORMATS = ['ndjson', 'json']
+
+
+# +
+# logging
+# -
+logger = UtilsLogger('streaming').logger
+
+
+# +
+# function: stream_format()
+# -
+def stream_format(request=None):
+    """ return the requested stream format ('ndjson', 'json') or '' if the response should not be streamed """
+    _body = request.get_json(silent=True) if request.method == 'POST' else None
+    _format = f"{request.args.get('stream', '') or (_body or {}).get('stream', '') or ''}".lower()
+    if _format in STREAM_FORMATS:
+        return _format
+    _best = request.accept_mimetypes.best_match([NDJSON_MIMETYPE, 'application/json'])
+    return 'ndjson' if _best == NDJSON_MIMETYPE and request.accept_mimetypes[_best] > 0 else ''
+
+
+# +
+# function: iter_rows()
+# -
+def iter_rows(query=None, chunk=STREAM_CHUNK):
+    """ yield serialized rows from a server-side cursor, chunk rows at a time """
+    for _row in query.yield_per(chunk):
+        yield _row.serialized()
+
+
+# +
+# function: stream_queries()
+# -
+def stream_queries(session=None, model=None, filters=None, searches=None, fmt=STREAM_FORMATS[0], chunk=STREAM_CHUNK,
+                   route=''):
+    """ return a streamed Response for every search in searches, filtered by filters(query, args) """
+
+    # check input(s)
+    if session is None or model is None or filters is None:
+        raise Exception('stream_queries() entry: session, model or filters is empty')
+    searches = searches if isinstance(searches, list) else []
+    fmt = fmt if fmt in STREAM_FORMATS else STREAM_FORMATS[0]
+
+    # check every search before the first byte is sent (raises QueryTooExpensive)
+    _queries = [filters(session.query(model), _args) for _args in searches]
+    _guarded = [guard_query(_q, route, downgrade=True) if route else (_q, None) for _q in _queries]
+
+    def _ndjson():
+        _total = 0
+        for _i, _args in enumerate(searches):
+            _query, _warning = _guarded[_i]
+            yield json.dumps(dict({'query': _i, 'args': _args}, **({'warning': _warning} if _warning else {}))) + '\n'
+            _count = 0
+            for _result in iter_rows(_query, chunk):
+                yield json.dumps({'query': _i, 'result': _result}) + '\n'
+                _count += 1
+            yield json.dumps({'query': _i, 'num_alerts': _count}) + '\n'
+            _total += _count
+        yield json.dumps({'total': _total}) + '\n'
+
+    def _json():
+        _total = 0
+        yield '{"results": ['
+        for _i, _args in enumerate(searches):
+            _query, _warning = _guarded[_i]
+            _extra = f'"warning": {json.dumps(_warning)}, ' if _warning else ''
+            yield f'{", " if _i > 0 else ""}{{"query": {json.dumps(_args)}, {_extra}"results": ['
+            _count = 0
+            for _result in iter_rows(_query, chunk):
+                yield f'{", " if _count > 0 else ""}{json.dumps(_result)}'
+                _count += 1
+            yield f'], "num_alerts": {_count}}}'
+            _total += _count
+        yield f'], "total": {_total}}}'
+
+    logger.debug(f'streaming {len(searches)} {model.__tablename__} queries as {fmt}')
+    return Response(stream_with_context(_ndjson() if fmt == 'ndjson' else _json()),
+                    mimetype=NDJSON_MIMETYPE if fmt == 'ndjson' else 'application/json')
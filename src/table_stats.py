@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from src.utils.utils import UtilsLogger
+
+from sqlalchemy import func
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import os
+import select
+import threading
+import time
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    In-memory table statistics (latest row, estimated row count, JD range) for the web app.
+
+    Statistics are refreshed from a daemon thread every TABLE_STATS_SECONDS and whenever a NOTIFY
+    arrives on TABLE_STATS_CHANNEL with a table name as its payload (sent by ingest after a commit),
+    so list pages read them from memory instead of running ORDER BY ... DESC LIMIT 1 and count(*).
+    If the thread is not running, statistics older than TABLE_STATS_MAX_AGE are refreshed on demand.
+    Callbacks added with subscribe() are called with the table name whenever a table is notified or its
+    statistics change (eg to invalidate cached responses).
+
+    >>> from src.table_stats import TABLE_STATS
+    >>> TABLE_STATS.register(db_ztf, ZtfAlert, ZtfAlert.jd, ZtfAlert.jd)
+    >>> TABLE_STATS.start(app)
+    >>> TABLE_STATS.latest('alert'), TABLE_STATS.get('alert')['jd_max']
+"""
+
+
+# +
+# constant(s)
+# -
+TABLE_STATS_CHANNEL = 'sassy_table_stats'
+TABLE_STATS_NOTIFY_SECONDS = 5.0
+TABLE_STATS_RETRY_SECONDS = 30.0
+TABLE_STATS_SECONDS = float(os.getenv("SASSY_TABLE_STATS_SECONDS", 300.0))
+TABLE_STATS_MAX_AGE = 2.0 * TABLE_STATS_SECONDS
+
+
+# +
+# logging
+# -
+logger = UtilsLogger('table_stats').logger
+
+
+# +
+# function: notify_stats()
+# -
+_NOTIFIED = {}
+_NOTIFIED_LOCK = threading.Lock()
+
+
+# noinspection PyBroadException
+def notify_stats(session=None, table='', channel=TABLE_STATS_CHANNEL, seconds=TABLE_STATS_NOTIFY_SECONDS):
+    """ NOTIFY listeners that table changed, at most once every seconds per table, returns True if sent """
+    _now = time.monotonic()
+    with _NOTIFIED_LOCK:
+        if _now - _NOTIFIED.get(table, -seconds) < seconds:
+            return False
+        _NOTIFIED[table] = _now
+    try:
+        session.execute(text('SELECT pg_notify(:c, :t)'), {'c': channel, 't': table})
+        session.commit()
+        return True
+    except Exception as e:
+        session.rollback()
+        logger.warning(f'unable to notify {channel} for {table}, error={e}')
+        return False
+
+
+# +
+# class: TableStats()
+# -
+class TableStats(object):
+
+    # +
+    # method: __init__()
+    # -
+    def __init__(self, seconds=TABLE_STATS_SECONDS, max_age=TABLE_STATS_MAX_AGE, channel=TABLE_STATS_CHANNEL):
+
+        # private variable(s)
+        self.__seconds = seconds if (isinstance(seconds, (int, float)) and seconds > 0.0) else TABLE_STATS_SECONDS
+        self.__max_age = max_age if (isinstance(max_age, (int, float)) and max_age > 0.0) else TABLE_STATS_MAX_AGE
+        self.__channel = channel
+        self.__lock = threading.Lock()
+        self.__refreshing = threading.Lock()
+        self.__tables = {}
+        self.__stats = {}
+        self.__callbacks = []
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    # +
+    # property(s)
+    # -
+    @property
+    def tables(self):
+        with self.__lock:
+            return sorted(self.__tables)
+
+    # +
+    # method: register()
+    # -
+    def register(self, db=None, model=None, latest=None, jd=None):
+        """ track model (in db) whose latest row is ordered by column latest, with an optional jd column """
+        if db is None or model is None or latest is None:
+            raise Exception('TableStats.register() entry: db, model or latest is empty')
+        with self.__lock:
+            self.__tables[model.__tablename__] = (db, model, latest, jd)
+
+    # +
+    # method: subscribe()
+    # -
+    def subscribe(self, callback=None):
+        """ call callback(table) whenever table is notified or its statistics change """
+        if not callable(callback):
+            raise Exception('TableStats.subscribe() entry: callback is not callable')
+        with self.__lock:
+            self.__callbacks.append(callback)
+
+    # +
+    # method: get()
+    # -
+    def get(self, table=''):
+        """ return {latest, count, jd_min, jd_max, refreshed} for table, refreshing it if missing or stale """
+        with self.__lock:
+            _stats = self.__stats.get(table, None)
+            _known = table in self.__tables
+        if not _known:
+            return {}
+        if _stats is None or time.time() - _stats['refreshed'] > self.__max_age:
+            _stats = self.refresh([table]).get(table, _stats)
+        return dict(_stats) if _stats is not None else {}
+
+    # +
+    # method: latest(), count()
+    # -
+    def latest(self, table=''):
+        """ return the cached latest row of table (a detached instance), or None """
+        return self.get(table).get('latest', None)
+
+    def count(self, table=''):
+        """ return the cached (estimated) row count of table, or 0 """
+        return self.get(table).get('count', 0)
+
+    # +
+    # method: refresh()
+    # -
+    def refresh(self, tables=None, notified=False):
+        """ re-read the statistics of tables (default all), returns {table: stats} for the ones refreshed,
+            subscribers hear of every table that changed (and of all tables if notified) """
+        with self.__lock:
+            _tables = {_k: _v for _k, _v in self.__tables.items() if tables is None or _k in tables}
+        _results = {}
+        with self.__refreshing:
+            for _table, (_db, _model, _latest, _jd) in _tables.items():
+                try:
+                    _results[_table] = self.__read(_db, _model, _latest, _jd)
+                except Exception as e:
+                    logger.warning(f'unable to refresh statistics for {_table}, error={e}')
+        with self.__lock:
+            _changed = set(tables) if (notified and tables is not None) else set()
+            _changed |= set([_k for _k, _v in _results.items() if
+                             _k in self.__stats and self.__signature(self.__stats[_k]) != self.__signature(_v)])
+            self.__stats.update(_results)
+            _callbacks = list(self.__callbacks)
+        for _table in sorted(_changed):
+            for _callback in _callbacks:
+                try:
+                    _callback(_table)
+                except Exception as e:
+                    logger.warning(f'table statistics callback failed for {_table}, error={e}')
+        return _results
+
+    # +
+    # method: start()
+    # -
+    def start(self, app=None):
+        """ refresh every table now and then from a daemon thread (on a timer and on NOTIFY), returns the thread """
+        if app is None:
+            raise Exception('TableStats.start() entry: app is empty')
+        with self.__lock:
+            if self.__thread is not None and self.__thread.is_alive():
+                return self.__thread
+            self.__stop.clear()
+            self.__thread = threading.Thread(target=self.__run, args=(app,), name='table-stats', daemon=True)
+        self.__thread.start()
+        return self.__thread
+
+    # +
+    # method: stop()
+    # -
+    def stop(self, timeout=None):
+        """ stop the refresh thread """
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+        self.__thread = None
+
+    # +
+    # (hidden) method: __read()
+    # -
+    @staticmethod
+    def __read(db=None, model=None, latest=None, jd=None):
+        """ read one table's statistics in a private session, so the latest row is detached when it closes """
+        _session = Session(bind=db.engine)
+        try:
+            _latest = _session.query(model).order_by(latest.desc()).first()
+            _count = _session.execute(text('SELECT reltuples FROM pg_class WHERE oid = CAST(:t AS regclass)'),
+                                      {'t': model.__tablename__}).scalar()
+            if _count is None or _count < 0.0:
+                _count = _session.query(func.count()).select_from(model).scalar()
+            _jd_min, _jd_max = _session.query(func.min(jd), func.max(jd)).one() if jd is not None else (None, None)
+            return {'latest': _latest, 'count': int(_count), 'jd_min': _jd_min, 'jd_max': _jd_max,
+                    'refreshed': time.time()}
+        finally:
+            _session.close()
+
+    # +
+    # (hidden) method: __signature()
+    # -
+    @staticmethod
+    def __signature(stats=None):
+        _latest = stats.get('latest', None)
+        return stats.get('count', 0), getattr(_latest, 'id', None), stats.get('jd_max', None)
+
+    # +
+    # (hidden) method: __run()
+    # -
+    # noinspection PyBroadException
+    def __run(self, app=None):
+        with app.app_context():
+            self.refresh()
+            while not self.__stop.is_set():
+                _raw = None
+                try:
+                    with self.__lock:
+                        _db = next(iter(self.__tables.values()))[0] if self.__tables else None
+                    if _db is None:
+                        self.__stop.wait(self.__seconds)
+                        continue
+
+                    # a dedicated autocommit connection, detached from the pool, listens for ingest
+                    _raw = _db.engine.raw_connection()
+                    _raw.detach()
+                    _conn = _raw.connection
+                    _conn.autocommit = True
+                    with _conn.cursor() as _cursor:
+                        _cursor.execute(f'LISTEN {self.__channel}')
+                    logger.info(f'Listening on {self.__channel}, refreshing every {self.__seconds}s')
+
+                    _then = time.monotonic()
+                    while not self.__stop.is_set():
+                        _wait = max(0.0, self.__seconds - (time.monotonic() - _then))
+                        if select.select([_conn], [], [], min(_wait, 1.0)) != ([], [], []):
+                            _conn.poll()
+                            _tables = set([_n.payload for _n in _conn.notifies])
+                            _conn.notifies.clear()
+                            if _tables:
+                                self.refresh(_tables, notified=True)
+                        if time.monotonic() - _then >= self.__seconds:
+                            self.refresh()
+                            _then = time.monotonic()
+                except Exception as e:
+                    logger.warning(f'table statistics listener failed, retrying, error={e}')
+                    self.__stop.wait(TABLE_STATS_RETRY_SECONDS)
+                finally:
+                    if _raw is not None:
+                        try:
+                            _raw.close()
+                        except Exception:
+                            pass
+
+
+# +
+# global statistics
+# -
+TABLE_STATS = TableStats()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from astropy.time import Time
+
+import math
+import numpy as np
+
+
+# +
+# __doc__ string
+# -
+__doc__ = """
+    Vectorized UTC julian date <-> ISO time conversion.
+
+    The hot paths convert whole arrays with NumPy datetime64 arithmetic relative to the MJD epoch instead
+    of building one astropy Time object per value. UTC is treated as uniform (86400 s days), which agrees
+    with astropy to within a microsecond everywhere except inside a leap-second day, where astropy
+    stretches the day to 86401 s (none has occurred since 2017-01-01, before the first ZTF alert).
+    jd_precision() measures the worst-case difference from astropy for any set of dates.
+
+    Anything NumPy cannot parse (eg a timezone suffix) falls back to astropy.
+
+    >>> from src.time_utils import jd_to_isot_array, isot_to_jd_array
+    >>> jd_to_isot_array([2459000.5, 2459000.75], precision=3).tolist()
+    ['2020-05-31T00:00:00.000', '2020-05-31T06:00:00.000']
+    >>> isot_to_jd_array(['2020-05-31T00:00:00']).tolist()
+    [2459000.5]
+"""
+
+
+# +
+# constant(s)
+# -
+MJD_EPOCH64 = np.datetime64('1858-11-17T00:00:00', 'us')
+MJD_OFFSET = 2400000.5
+MICROSECONDS_PER_DAY = 86400.0 * 1.0e6
+TIME_UNITS = {0: ('s', 500000), 3: ('ms', 500), 6: ('us', 0)}
+
+
+# +
+# function: jd_to_datetime64()
+# -
+def jd_to_datetime64(jd=None):
+    """ return an array of datetime64[us] (NaT for non-finite values) for an array of julian dates """
+    _jd = np.atleast_1d(np.asarray(jd, dtype=float))
+    _finite = np.isfinite(_jd)
+    _us = np.rint((np.where(_finite, _jd, MJD_OFFSET) - MJD_OFFSET) * MICROSECONDS_PER_DAY).astype(np.int64)
+    _out = MJD_EPOCH64 + _us.astype('timedelta64[us]')
+    _out[~_finite] = np.datetime64('NaT')
+    return _out
+
+
+# +
+# function: jd_to_datetime()
+# -
+def jd_to_datetime(jd=None):
+    """ return a list of datetime.datetime (None for non-finite values) for an array of julian dates """
+    return jd_to_datetime64(jd).astype(object).tolist()
+
+
+# +
+# function: jd_to_isot_array()
+# -
+def jd_to_isot_array(jd=None, precision=6):
+    """ return an array of 'YYYY-MM-DDTHH:MM:SS[.fff[fff]]' strings ('NaT' for non-finite values) """
+    _unit, _half = TIME_UNITS.get(precision, TIME_UNITS[6])
+    _d = jd_to_datetime64(jd) + np.timedelta64(_half, 'us')
+    return np.datetime_as_string(_d.astype(f'datetime64[{_unit}]'), unit=_unit)
+
+
+# +
+# function: isot_to_jd_array()
+# -
+def isot_to_jd_array(isot=None):
+    """ return an array of julian dates (nan for unparseable values) for an array of ISO strings """
+    _isot = [f'{_s}'.strip().replace(' ', 'T') for _s in np.atleast_1d(np.asarray(isot, dtype=object))]
+    try:
+        _d = np.array(_isot, dtype='datetime64[us]')
+    except ValueError:
+        return np.array([_isot_to_jd_astropy(_s) for _s in _isot], dtype=float)
+    _jd = (_d - MJD_EPOCH64).astype(np.int64) / MICROSECONDS_PER_DAY + MJD_OFFSET
+    _jd[np.isnat(_d)] = math.nan
+    return _jd
+
+
+# +
+# (hidden) function: _isot_to_jd_astropy()
+# -
+# noinspection PyBroadException
+def _isot_to_jd_astropy(isot=''):
+    try:
+        return float(Time(isot).jd)
+    except Exception:
+        return math.nan
+
+
+# +
+# function: jd_to_isot()
+# -
+def jd_to_isot(jd=math.nan, precision=6):
+    """ return isot from jd, or None """
+    try:
+        _isot = jd_to_isot_array([float(jd)], precision)[0]
+    except (TypeError, ValueError):
+        return None
+    return None if _isot == 'NaT' else f'{_isot}'
+
+
+# +
+# function: isot_to_jd()
+# -
+def isot_to_jd(isot=''):
+    """ return jd from isot, or nan """
+    if not isinstance(isot, str) or isot.strip() == '':
+        return math.nan
+    return float(isot_to_jd_array([isot])[0])
+
+
+# +
+# function: jd_precision()
+# -
+def jd_precision(jd=None):
+    """ return the largest difference (in seconds) between jd_to_datetime64() and astropy for an array of jds """
+    _jd = np.atleast_1d(np.asarray(jd, dtype=float))
+    _jd = _jd[np.isfinite(_jd)]
+    if _jd.size == 0:
+        return 0.0
+    _ours = jd_to_datetime64(_jd)
+    _theirs = np.array(Time(_jd, format='jd', scale='utc').to_value('datetime64'), dtype='datetime64[ns]')
+    return float(np.max(np.abs((_ours.astype('datetime64[ns]') - _theirs).astype(np.int64))) / 1.0e9)
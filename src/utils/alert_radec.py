@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from src.app import app
+from src.models.ztf import db
+
+import argparse
+import sys
+import time
+
+
+# +
+# dunder string(s)
+# -
+__doc__ = """
+    Add, backfill and index the persisted ra and dec columns of the alert table.
+
+    ra (0..360) and dec are copied from location in batches of --batch-size ids (each batch is its own
+    transaction, so the table stays available and an interrupted run can simply be restarted), then
+    btree indexes on ra and dec and a q3c index on q3c_ang2ipix(ra, dec) are built CONCURRENTLY and
+    the table is analyzed. ztf_filters() (ra__*, dec__*, cone, astrocone, objectcone), sassy_bot and
+    sassy_cron read these columns, so run this once on an existing database before deploying.
+
+    % python3 -m src.utils.alert_radec --batch-size 50000
+"""
+
+
+# +
+# constant(s)
+# -
+RADEC_BATCH_SIZE = 50000
+
+RADEC_ADD = [
+    'ALTER TABLE alert ADD COLUMN IF NOT EXISTS ra double precision',
+    'ALTER TABLE alert ADD COLUMN IF NOT EXISTS dec double precision'
+]
+RADEC_BACKFILL = """
+    UPDATE alert SET
+        ra = (CASE WHEN ST_X(location::geometry) < 0.0 THEN ST_X(location::geometry) + 360.0
+              ELSE ST_X(location::geometry) END),
+        dec = ST_Y(location::geometry)
+    WHERE id BETWEEN :lo AND :hi AND (ra IS NULL OR dec IS NULL)
+"""
+RADEC_INDEXES = [
+    'CREATE EXTENSION IF NOT EXISTS q3c',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_alert_ra ON alert (ra)',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_alert_dec ON alert (dec)',
+    'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_alert_q3c_ang2ipix ON alert (q3c_ang2ipix(ra, dec))',
+    'ANALYZE alert'
+]
+
+
+# +
+# function: alert_radec()
+# -
+def alert_radec(batch_size=RADEC_BATCH_SIZE, backfill=True, index=True, verbose=False):
+    """ add, backfill and index alert.ra and alert.dec """
+
+    # check input(s)
+    batch_size = batch_size if (isinstance(batch_size, int) and batch_size > 0) else RADEC_BATCH_SIZE
+
+    with app.app_context():
+
+        # add column(s)
+        with db.engine.begin() as _conn:
+            for _sql in RADEC_ADD:
+                _conn.execute(db.text(_sql))
+
+        # backfill by id range
+        if backfill:
+            with db.engine.connect() as _conn:
+                _lo, _hi = _conn.execute(db.text('SELECT MIN(id), MAX(id) FROM alert')).fetchone()
+            _total, _start = 0, time.time()
+            for _id in range(int(_lo or 0), int(_hi or -1) + 1, batch_size):
+                with db.engine.begin() as _conn:
+                    _total += _conn.execute(db.text(RADEC_BACKFILL), lo=_id, hi=_id + batch_size - 1).rowcount
+                if verbose:
+                    print(f'backfilled ids {_id}..{_id + batch_size - 1}, {_total} rows in {time.time() - _start:.1f}s')
+
+        # indexes cannot be built concurrently inside a transaction
+        if index:
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as _conn:
+                for _sql in RADEC_INDEXES:
+                    if verbose:
+                        print(f'executing {_sql}')
+                    _conn.execute(db.text(_sql))
+
+
+# +
+# main()
+# -
+if __name__ == '__main__':
+
+    # get command line argument(s)
+    # noinspection PyTypeChecker
+    _parser = argparse.ArgumentParser(description='Add, backfill and index alert.ra and alert.dec',
+                                      formatter_class=argparse.RawTextHelpFormatter)
+    _parser.add_argument('--batch-size', default=RADEC_BATCH_SIZE, type=int,
+                         help="""alert ids per backfill transaction, defaults to %(default)s""")
+    _parser.add_argument('--no-backfill', default=False, action='store_true',
+                         help="""if present, do not backfill ra and dec""")
+    _parser.add_argument('--no-index', default=False, action='store_true',
+                         help="""if present, do not create the indexes""")
+    _parser.add_argument('--verbose', default=False, action='store_true',
+                         help="""if present, produce more verbose output""")
+    args = _parser.parse_args()
+
+    # execute
+    if args.batch_size > 0:
+        alert_radec(args.batch_size, not args.no_backfill, not args.no_index, bool(args.verbose))
+    else:
+        print(f'<<ERROR>> Insufficient command line arguments specified\nUse: python3 {sys.argv[0]} --help')
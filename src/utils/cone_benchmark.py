@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from src.app import app
+from src.models.ztf import ZTF_CONE_BACKENDS
+from src.models.ztf import ZtfAlert
+from src.models.ztf import db
+from src.models.ztf import ztf_cone
+from src.query_guard import explain_query
+from sqlalchemy import func
+
+import argparse
+import csv
+import json
+import random
+import sys
+import time
+
+
+# +
+# dunder string(s)
+# -
+__doc__ = """
+    Benchmark ZTF cone searches: q3c on alert.ra/dec against PostGIS ST_DWithin on alert.location.
+
+    Centers are drawn (with --seed) from existing alerts, so every radius is measured where there are
+    alerts. For each backend and radius, a COUNT(*) cone search is timed at every center (after one
+    untimed warm-up), the planner cost of the first is recorded, and the matched row counts are compared
+    between backends (PostGIS measures on the spheroid, q3c on the sphere, so a few edge alerts may differ
+    at large radii). The prv_candidate self-join (ZtfAlert.load_lightcurves) is timed per backend over
+    --lightcurves alerts. Results are written to <output>.json and <output>.csv. Requires the ra/dec
+    columns (see src/utils/alert_radec.py) and a database with alerts in it.
+
+    % python3 -m src.utils.cone_benchmark --radii 0.000416667,0.01,0.1,1.0,5.0 --centers 20
+"""
+
+
+# +
+# constant(s)
+# -
+BENCHMARK_CENTERS = 20
+BENCHMARK_LIGHTCURVES = 50
+BENCHMARK_OUTPUT = 'cone_benchmark'
+BENCHMARK_RADII = [0.000416667, 0.01, 0.1, 1.0, 5.0]
+BENCHMARK_SEED = 42
+
+
+# +
+# (hidden) function: _percentile()
+# -
+def _percentile(values=None, percent=50.0):
+    if not values:
+        return None
+    _values = sorted(values)
+    _index = min(len(_values) - 1, max(0, int(round(percent / 100.0 * (len(_values) - 1)))))
+    return _values[_index]
+
+
+# +
+# function: sample_alerts()
+# -
+def sample_alerts(number=BENCHMARK_CENTERS, seed=BENCHMARK_SEED):
+    """ return up to number [(id, ra, dec)] of randomly chosen alerts that have ra and dec """
+    _rng = random.Random(seed)
+    _lo, _hi = db.session.query(func.min(ZtfAlert.id), func.max(ZtfAlert.id)).one()
+    if _lo is None:
+        return []
+    _ids = [_rng.randint(_lo, _hi) for _ in range(number * 4)]
+    _rows = db.session.query(ZtfAlert.id, ZtfAlert.ra_deg, ZtfAlert.dec_deg).filter(
+        ZtfAlert.id.in_(_ids), ZtfAlert.ra_deg.isnot(None), ZtfAlert.dec_deg.isnot(None)).all()
+    _rng.shuffle(_rows)
+    return [(int(_i), float(_r), float(_d)) for _i, _r, _d in _rows[:number]]
+
+
+# +
+# function: run_cones()
+# -
+def run_cones(centers=None, radius=0.0, backend=''):
+    """ time a COUNT(*) cone search at each center, returns (latencies in seconds, counts, planner cost) """
+    _query = db.session.query(func.count(ZtfAlert.id))
+    _plan = explain_query(_query.filter(ztf_cone(centers[0][1], centers[0][2], radius, backend)))
+    _query.filter(ztf_cone(centers[0][1], centers[0][2], radius, backend)).scalar()
+    latencies, counts = [], []
+    for _id, _ra, _dec in centers:
+        _t = time.monotonic()
+        counts.append(int(_query.filter(ztf_cone(_ra, _dec, radius, backend)).scalar()))
+        latencies.append(time.monotonic() - _t)
+    return latencies, counts, None if _plan is None else _plan['cost']
+
+
+# +
+# function: run_lightcurves()
+# -
+def run_lightcurves(ids=None, backend=''):
+    """ time ZtfAlert.load_lightcurves() over freshly loaded alerts, returns (seconds, detections) """
+    db.session.expunge_all()
+    _alerts = db.session.query(ZtfAlert).filter(ZtfAlert.id.in_(ids)).all()
+    _t = time.monotonic()
+    _lightcurves = ZtfAlert.load_lightcurves(_alerts, db.session, backend=backend)
+    _elapsed = time.monotonic() - _t
+    return _elapsed, sum([len(_d) for _d, _n in _lightcurves.values()])
+
+
+# +
+# function: benchmark()
+# -
+def benchmark(radii=None, centers=BENCHMARK_CENTERS, lightcurves=BENCHMARK_LIGHTCURVES, backends=None,
+              seed=BENCHMARK_SEED, output=BENCHMARK_OUTPUT):
+    """ run every backend at every radius over the same centers and write <output>.json and <output>.csv """
+
+    # check input(s)
+    radii = radii if radii else BENCHMARK_RADII
+    backends = backends if backends else ZTF_CONE_BACKENDS
+    for _b in backends:
+        if _b not in ZTF_CONE_BACKENDS:
+            raise Exception(f'benchmark() entry: unknown backend {_b}, choose from {ZTF_CONE_BACKENDS}')
+
+    results = []
+    with app.app_context():
+        _centers = sample_alerts(max(centers, lightcurves), seed)
+        if not _centers:
+            raise Exception('benchmark() entry: no alerts with ra and dec, run src/utils/alert_radec.py first')
+        print(f'sampled {len(_centers)} alert(s) with seed {seed}')
+
+        # cone search(es)
+        for _radius in radii:
+            _counts = {}
+            for _backend in backends:
+                _latencies, _counts[_backend], _cost = run_cones(_centers[:centers], _radius, _backend)
+                _result = {
+                    'test': 'cone', 'backend': _backend, 'radius_deg': _radius, 'queries': len(_latencies),
+                    'mean_rows': round(sum(_counts[_backend]) / max(len(_counts[_backend]), 1), 3),
+                    'p50_ms': round(_percentile(_latencies, 50.0) * 1000.0, 3),
+                    'p99_ms': round(_percentile(_latencies, 99.0) * 1000.0, 3),
+                    'plan_cost': _cost, 'mismatches': None
+                }
+                _other = _counts[backends[0]]
+                if _backend != backends[0]:
+                    _result['mismatches'] = sum([1 for _a, _b in zip(_other, _counts[_backend]) if _a != _b])
+                results.append(_result)
+                print(f"cone {_backend:>8s} r={_radius:<12g}: p50={_result['p50_ms']} ms, "
+                      f"p99={_result['p99_ms']} ms, rows={_result['mean_rows']}, cost={_cost}, "
+                      f"mismatches={_result['mismatches']}")
+
+        # prv_candidate self-join
+        _ids = [_i for _i, _r, _d in _centers[:lightcurves]]
+        for _backend in backends:
+            run_lightcurves(_ids[:1], _backend)
+            _elapsed, _detections = run_lightcurves(_ids, _backend)
+            results.append({
+                'test': 'lightcurves', 'backend': _backend, 'radius_deg': None, 'queries': len(_ids),
+                'mean_rows': round(_detections / max(len(_ids), 1), 3),
+                'p50_ms': round(_elapsed * 1000.0, 3), 'p99_ms': None, 'plan_cost': None, 'mismatches': None
+            })
+            print(f"lightcurves {_backend:>8s}: {_elapsed * 1000.0:.3f} ms for {len(_ids)} alert(s), "
+                  f"{_detections} detection(s)")
+
+    # write result(s)
+    with open(f'{output}.json', 'w') as _f:
+        json.dump({'seed': seed, 'centers': centers, 'results': results}, _f, indent=2)
+    with open(f'{output}.csv', 'w', newline='') as _f:
+        _writer = csv.DictWriter(_f, fieldnames=list(results[0].keys()) if results else ['test'])
+        _writer.writeheader()
+        _writer.writerows(results)
+    print(f'wrote {output}.json and {output}.csv')
+    return results
+
+
+# +
+# main()
+# -
+if __name__ == '__main__':
+
+    # get command line argument(s)
+    # noinspection PyTypeChecker
+    _parser = argparse.ArgumentParser(description='Benchmark q3c against PostGIS cone searches on ZTF alerts',
+                                      formatter_class=argparse.RawTextHelpFormatter)
+    _parser.add_argument('--radii', default=','.join([f'{_r}' for _r in BENCHMARK_RADII]),
+                         help="""comma-separated radii in degrees, defaults to %(default)s""")
+    _parser.add_argument('--centers', default=BENCHMARK_CENTERS, type=int,
+                         help="""cone centers per radius, defaults to %(default)s""")
+    _parser.add_argument('--lightcurves', default=BENCHMARK_LIGHTCURVES, type=int,
+                         help="""alerts for the prv_candidate self-join, defaults to %(default)s""")
+    _parser.add_argument('--backends', default=','.join(ZTF_CONE_BACKENDS),
+                         help="""comma-separated backend(s), defaults to %(default)s""")
+    _parser.add_argument('--seed', default=BENCHMARK_SEED, type=int,
+                         help="""random seed, defaults to %(default)s""")
+    _parser.add_argument('--output', default=BENCHMARK_OUTPUT,
+                         help="""output file prefix (.json and .csv are appended), defaults to %(default)s""")
+    args = _parser.parse_args()
+
+    # execute
+    if args.centers > 0 and args.lightcurves > 0:
+        benchmark([float(_r) for _r in args.radii.split(',') if _r.strip()], args.centers, args.lightcurves,
+                  [_b.strip().lower() for _b in args.backends.split(',') if _b.strip()], args.seed, args.output)
+    else:
+        print(f'<<ERROR>> Insufficient command line arguments specified\nUse: python3 {sys.argv[0]} --help')
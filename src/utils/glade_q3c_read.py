@@ -5,6 +5,7 @@
 # import(s)
 # -
 from src.models.glade_q3c import GladeQ3cRecord
+from src.table_stats import notify_stats
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
@@ -152,6 +153,9 @@ def glade_q3c_read(_file=''):
         session.rollback()
         raise Exception(f"Failed to insert object {_glade_q3c} into database, error={e}")
 
+    # tell the web app (response cache, table statistics) that the table changed
+    notify_stats(session, GladeQ3cRecord.__tablename__, seconds=0)
+
 
 # +
 # main()
@@ -5,6 +5,7 @@
 # import(s)
 # -
 from src.models.glade import GladeRecord
+from src.table_stats import notify_stats
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
@@ -152,6 +153,9 @@ def glade_read(_file=''):
         session.rollback()
         raise Exception(f"Failed to insert object {_glade} into database, error={e}")
 
+    # tell the web app (response cache, table statistics) that the table changed
+    notify_stats(session, GladeRecord.__tablename__, seconds=0)
+
 
 # +
 # main()
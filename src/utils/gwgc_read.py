@@ -5,6 +5,7 @@
 # import(s)
 # -
 from src.models.gwgc import GwgcRecord
+from src.table_stats import notify_stats
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
@@ -132,6 +133,9 @@ def gwgc_read(_file=''):
         session.rollback()
         raise Exception(f"Failed to insert object {_record['Name']} database, error={e}")
 
+    # tell the web app (response cache, table statistics) that the table changed
+    notify_stats(session, GwgcRecord.__tablename__, seconds=0)
+
 
 # +
 # main()
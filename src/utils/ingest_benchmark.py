@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+
+
+# +
+# import(s)
+# -
+from src.app import app
+from src.ingest import WRITERS
+from src.ingest import do_ingest
+from src.ingest import ingest_bytes
+from src.ingest import packets_to_rows
+from src.ingest import write_batch
+from src.ingest_from_gzip import read_avro_file
+from src.ingest_from_gzip import read_avro_file_pipelined
+from src.models.ztf import ZtfAlert
+from src.models.ztf import db
+
+import argparse
+import base64
+import csv
+import fastavro
+import io
+import json
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import sys
+import tarfile
+import tempfile
+import time
+
+
+# +
+# dunder string(s)
+# -
+__doc__ = """
+    Benchmark alert ingest against a local PostgreSQL/PostGIS using synthetic ZTF AVRO packets.
+
+    Packets are generated from the ZtfAlert columns (plus ra, dec, prv_candidates and cutouts) and
+    driven through each selected ingest path. Each path runs in a fresh (spawned) process, so its peak
+    RSS is its own and does not depend on the paths run before it. Alerts/s, p50/p99 per-alert latency
+    and peak RSS are written to <output>.json and <output>.csv. Synthetic rows are deleted after each
+    path unless --keep is given.
+
+    % python3 -m src.utils.ingest_benchmark --alerts 2000 --modes do_ingest,batch-insert,batch-binary
+"""
+
+
+# +
+# constant(s)
+# -
+BENCHMARK_ALERTS = 1000
+BENCHMARK_BATCH_SIZE = 500
+BENCHMARK_CANDID_BASE = 9000000000000000000
+BENCHMARK_MODES = ['do_ingest', 'ingest_bytes'] + [f'batch-{_w}' for _w in WRITERS] + ['gzip', 'gzip-pipelined']
+BENCHMARK_OUTPUT = 'ingest_benchmark'
+BENCHMARK_PRV_MAX = 30
+BENCHMARK_SEED = 42
+BENCHMARK_WORKERS = 4
+
+CUTOUT_BYTES = (3000, 6000)
+DERIVED_COLUMNS = ['id', 'publisher', 'objectId', 'alert_candid', 'location', 'ra', 'dec', 'deltamaglatest',
+                   'deltamagref', 'gal_l', 'gal_b']
+
+
+# +
+# (hidden) function: _avro_type()
+# -
+def _avro_type(column=None):
+    _type = column.type
+    if isinstance(_type, db.BigInteger):
+        _avro = 'long'
+    elif isinstance(_type, (db.Integer, db.SmallInteger)):
+        _avro = 'int'
+    elif isinstance(_type, db.Float):
+        _avro = 'double'
+    else:
+        _avro = 'string'
+    return ['null', _avro] if column.nullable else _avro
+
+
+# +
+# function: alert_schema()
+# -
+def alert_schema():
+    """ return a parsed AVRO schema for ZTF alerts carrying every field ZtfAlert expects """
+    _candidate = [{'name': 'ra', 'type': 'double'}, {'name': 'dec', 'type': 'double'}]
+    _candidate += [{'name': _c.name, 'type': _avro_type(_c)} for _c in ZtfAlert.__table__.columns
+                   if _c.name not in DERIVED_COLUMNS]
+    _prv = [{'name': 'jd', 'type': 'double'}, {'name': 'fid', 'type': 'int'}, {'name': 'pid', 'type': 'long'},
+            {'name': 'diffmaglim', 'type': ['null', 'double']}, {'name': 'candid', 'type': ['null', 'long']},
+            {'name': 'ra', 'type': ['null', 'double']}, {'name': 'dec', 'type': ['null', 'double']},
+            {'name': 'magpsf', 'type': ['null', 'double']}, {'name': 'sigmapsf', 'type': ['null', 'double']},
+            {'name': 'isdiffpos', 'type': ['null', 'string']}]
+    _cutout = {'type': 'record', 'name': 'cutout',
+               'fields': [{'name': 'fileName', 'type': 'string'}, {'name': 'stampData', 'type': 'bytes'}]}
+    return fastavro.parse_schema({
+        'type': 'record', 'name': 'alert', 'namespace': 'ztf',
+        'fields': [
+            {'name': 'schemavsn', 'type': 'string'},
+            {'name': 'publisher', 'type': 'string'},
+            {'name': 'objectId', 'type': 'string'},
+            {'name': 'candid', 'type': 'long'},
+            {'name': 'candidate', 'type': {'type': 'record', 'name': 'candidate', 'fields': _candidate}},
+            {'name': 'prv_candidates', 'type': ['null', {'type': 'array', 'items': {
+                'type': 'record', 'name': 'prv_candidate', 'fields': _prv}}]},
+            {'name': 'cutoutScience', 'type': ['null', _cutout]},
+            {'name': 'cutoutTemplate', 'type': ['null', 'ztf.cutout']},
+            {'name': 'cutoutDifference', 'type': ['null', 'ztf.cutout']}
+        ]})
+
+
+# +
+# (hidden) function: _field_value()
+# -
+def _field_value(_rng=None, column=None):
+    _type = column.type
+    if column.nullable and _rng.random() < 0.05:
+        return None
+    elif isinstance(_type, db.BigInteger):
+        return _rng.randrange(1, 2 ** 40)
+    elif isinstance(_type, (db.Integer, db.SmallInteger)):
+        return _rng.randrange(0, 100)
+    elif isinstance(_type, db.Float):
+        return _rng.uniform(0.0, 1.0)
+    elif column.name == 'isdiffpos':
+        return _rng.choice(['t', 'f'])
+    return f'{column.name}_{_rng.randrange(1000)}'[:getattr(_type, 'length', None) or None]
+
+
+# +
+# function: synthetic_packet()
+# -
+def synthetic_packet(_rng=None, index=0, candid_base=BENCHMARK_CANDID_BASE):
+    """ return one synthetic alert packet (dict) """
+    _rng = _rng if _rng is not None else random.Random(BENCHMARK_SEED)
+    _candid = candid_base + index
+    _jd = 2459000.5 + _rng.uniform(0.0, 1000.0)
+    _ra, _dec = _rng.uniform(0.0, 360.0), _rng.uniform(-30.0, 90.0)
+
+    # candidate: generic values per column type, then realistic values for the fields ingest reads
+    candidate = {_c.name: _field_value(_rng, _c) for _c in ZtfAlert.__table__.columns
+                 if _c.name not in DERIVED_COLUMNS}
+    candidate.update({
+        'ra': _ra, 'dec': _dec, 'jd': _jd, 'fid': _rng.choice([1, 2]), 'candid': _candid,
+        'programid': 1, 'magpsf': _rng.uniform(15.0, 21.0), 'sigmapsf': _rng.uniform(0.01, 0.3),
+        'distnr': _rng.uniform(0.0, 5.0), 'magnr': _rng.uniform(14.0, 22.0), 'rb': _rng.uniform(0.0, 1.0),
+        'drb': _rng.uniform(0.0, 1.0), 'ranr': _ra + _rng.uniform(-0.001, 0.001),
+        'decnr': _dec + _rng.uniform(-0.001, 0.001), 'jdstarthist': _jd - _rng.uniform(0.0, 300.0),
+        'jdendhist': _jd, 'isdiffpos': _rng.choice(['t', 'f'])
+    })
+
+    # history: a mix of detections and upper limits (magpsf None) in both filters
+    prv_candidates = []
+    for _i in range(_rng.randrange(0, BENCHMARK_PRV_MAX + 1)):
+        _detected = _rng.random() < 0.6
+        prv_candidates.append({
+            'jd': _jd - _rng.uniform(0.5, 300.0), 'fid': _rng.choice([1, 2]), 'pid': _rng.randrange(1, 2 ** 40),
+            'diffmaglim': _rng.uniform(19.0, 21.0), 'candid': _rng.randrange(1, 2 ** 40) if _detected else None,
+            'ra': _ra if _detected else None, 'dec': _dec if _detected else None,
+            'magpsf': _rng.uniform(15.0, 21.0) if _detected else None,
+            'sigmapsf': _rng.uniform(0.01, 0.3) if _detected else None,
+            'isdiffpos': _rng.choice(['t', 'f']) if _detected else None
+        })
+
+    # cutouts: incompressible payloads of about the size of the real gzipped FITS stamps
+    _cutouts = {}
+    for _k in ['cutoutScience', 'cutoutTemplate', 'cutoutDifference']:
+        _size = _rng.randrange(*CUTOUT_BYTES)
+        _cutouts[_k] = {'fileName': f'candid{_candid}_{_k}.fits.gz',
+                        'stampData': _rng.getrandbits(8 * _size).to_bytes(_size, 'little')}
+
+    return dict({'schemavsn': '3.3', 'publisher': 'ztf-benchmark', 'objectId': f'ZTF99bench{index:07d}',
+                 'candid': _candid, 'candidate': candidate, 'prv_candidates': prv_candidates or None}, **_cutouts)
+
+
+# +
+# function: synthetic_avros()
+# -
+def synthetic_avros(count=BENCHMARK_ALERTS, seed=BENCHMARK_SEED, candid_base=BENCHMARK_CANDID_BASE):
+    """ return a list of (packet, avro bytes) tuples """
+    _rng, _schema, _avros = random.Random(seed), alert_schema(), []
+    for _i in range(count):
+        _packet = synthetic_packet(_rng, _i, candid_base)
+        _buffer = io.BytesIO()
+        fastavro.writer(_buffer, _schema, [_packet])
+        _avros.append((_packet, _buffer.getvalue()))
+    return _avros
+
+
+# +
+# function: write_tarball()
+# -
+def write_tarball(avros=None, path=''):
+    """ write avros to a ztf_public_*.tar.gz style archive """
+    with tarfile.open(path, 'w:gz') as _tar:
+        for _packet, _data in avros:
+            _info = tarfile.TarInfo(name=f"{_packet['candid']}.avro")
+            _info.size = len(_data)
+            _tar.addfile(_info, io.BytesIO(_data))
+    return path
+
+
+# +
+# (hidden) function: _peak_rss_mb()
+# -
+def _peak_rss_mb():
+    """ peak resident set size (self and children) in MB over the life of this process, ru_maxrss is in KB on linux """
+    _self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    _children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    _scale = 1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0
+    return _self / _scale, _children / _scale
+
+
+# +
+# (hidden) function: _percentile()
+# -
+def _percentile(values=None, percent=50.0):
+    if not values:
+        return None
+    _values = sorted(values)
+    _index = min(len(_values) - 1, max(0, int(round(percent / 100.0 * (len(_values) - 1)))))
+    return _values[_index]
+
+
+# +
+# (hidden) function: _cleanup()
+# -
+def _cleanup(candid_base=BENCHMARK_CANDID_BASE, count=0):
+    with app.app_context():
+        db.session.execute(ZtfAlert.__table__.delete().where(
+            ZtfAlert.alert_candid.between(candid_base, candid_base + count)))
+        db.session.commit()
+
+
+# +
+# (hidden) function: _count()
+# -
+def _count(candid_base=BENCHMARK_CANDID_BASE, count=0):
+    with app.app_context():
+        return db.session.query(ZtfAlert).filter(
+            ZtfAlert.alert_candid.between(candid_base, candid_base + count)).count()
+
+
+# +
+# function: run_mode()
+# -
+def run_mode(mode='', avros=None, batch_size=BENCHMARK_BATCH_SIZE, workers=BENCHMARK_WORKERS, tmpdir=''):
+    """ drive one ingest path, returns (elapsed seconds, per-alert latencies in seconds) """
+    latencies = []
+    _start = time.monotonic()
+
+    # one alert at a time
+    if mode in ['do_ingest', 'ingest_bytes']:
+        for _packet, _data in avros:
+            _t = time.monotonic()
+            if mode == 'do_ingest':
+                do_ingest(base64.b64encode(_data).decode('UTF-8'))
+            else:
+                ingest_bytes(_data)
+            latencies.append(time.monotonic() - _t)
+
+    # decode, transform and write in batches, every alert in a batch shares the batch latency
+    elif mode.startswith('batch-'):
+        with app.app_context():
+            for _i in range(0, len(avros), batch_size):
+                _chunk = avros[_i:_i + batch_size]
+                _t = time.monotonic()
+                _packets = [_p for _packet, _data in _chunk for _p in fastavro.reader(io.BytesIO(_data))]
+                write_batch(packets_to_rows(_packets), mode[len('batch-'):])
+                latencies.extend([time.monotonic() - _t] * len(_chunk))
+
+    # from a tarball, only the end-to-end time is measured
+    elif mode in ['gzip', 'gzip-pipelined']:
+        _tarball = write_tarball(avros, os.path.join(tmpdir, f'ztf_public_{mode}.tar.gz'))
+        _start = time.monotonic()
+        if mode == 'gzip':
+            read_avro_file(_tarball, batch_size)
+        else:
+            read_avro_file_pipelined(_tarball, workers, batch_size)
+
+    else:
+        raise Exception(f'run_mode() entry: unknown mode {mode}')
+
+    return time.monotonic() - _start, latencies
+
+
+# +
+# (hidden) function: _run_mode_process()
+# -
+# noinspection PyBroadException
+def _run_mode_process(results=None, mode='', avros=None, batch_size=BENCHMARK_BATCH_SIZE, workers=BENCHMARK_WORKERS,
+                      tmpdir=''):
+    """ runs in a spawned process: run_mode(), then report (elapsed, latencies, peak rss self and children) """
+    try:
+        _elapsed, _latencies = run_mode(mode, avros, batch_size, workers, tmpdir)
+        results.put((_elapsed, _latencies) + _peak_rss_mb())
+    except Exception as e:
+        results.put(f'{mode} failed, error={e!r}')
+
+
+# +
+# function: run_mode_isolated()
+# -
+def run_mode_isolated(mode='', avros=None, batch_size=BENCHMARK_BATCH_SIZE, workers=BENCHMARK_WORKERS, tmpdir=''):
+    """ run_mode() in a fresh process, returns (elapsed seconds, latencies, peak rss MB, peak rss children MB) """
+    _context = multiprocessing.get_context('spawn')
+    _results = _context.Queue()
+    _process = _context.Process(target=_run_mode_process, name=f'ingest-benchmark-{mode}',
+                                args=(_results, mode, avros, batch_size, workers, tmpdir))
+    _process.start()
+
+    # read before join() (a full pipe would block the child), but do not wait on a child that died
+    _result = None
+    while _result is None:
+        try:
+            _result = _results.get(timeout=1.0)
+        except queue.Empty:
+            if not _process.is_alive():
+                _result = f'{mode} exited with code {_process.exitcode}'
+    _process.join()
+    if isinstance(_result, str):
+        raise Exception(f'run_mode_isolated() {_result}')
+    return _result
+
+
+# +
+# function: benchmark()
+# -
+def benchmark(alerts=BENCHMARK_ALERTS, modes=None, batch_size=BENCHMARK_BATCH_SIZE, workers=BENCHMARK_WORKERS,
+              seed=BENCHMARK_SEED, output=BENCHMARK_OUTPUT, keep=False):
+    """ run each mode over the same synthetic alerts and write <output>.json and <output>.csv """
+
+    # check input(s)
+    modes = modes if modes else BENCHMARK_MODES
+    for _m in modes:
+        if _m not in BENCHMARK_MODES:
+            raise Exception(f'benchmark() entry: unknown mode {_m}, choose from {BENCHMARK_MODES}')
+
+    # generate once, outside the timed region(s)
+    with app.app_context():
+        db.create_all()
+    avros = synthetic_avros(alerts, seed)
+    _bytes = sum([len(_d) for _p, _d in avros])
+    print(f'generated {alerts} synthetic alert(s), {_bytes / 1024.0 / 1024.0:.1f} MB of AVRO')
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='ingest_benchmark_') as _tmpdir:
+        for _mode in modes:
+            _cleanup(BENCHMARK_CANDID_BASE, alerts)
+            _elapsed, _latencies, _rss_self, _rss_children = run_mode_isolated(_mode, avros, batch_size, workers,
+                                                                               _tmpdir)
+            _result = {
+                'mode': _mode, 'alerts': alerts, 'batch_size': batch_size, 'workers': workers,
+                'rows': _count(BENCHMARK_CANDID_BASE, alerts), 'elapsed_s': round(_elapsed, 6),
+                'alerts_per_s': round(alerts / max(_elapsed, 1.0e-9), 3),
+                'p50_ms': None if not _latencies else round(_percentile(_latencies, 50.0) * 1000.0, 3),
+                'p99_ms': None if not _latencies else round(_percentile(_latencies, 99.0) * 1000.0, 3),
+                'peak_rss_mb': round(_rss_self, 1), 'peak_rss_children_mb': round(_rss_children, 1)
+            }
+            results.append(_result)
+            print(f"{_mode:>16s}: {_result['alerts_per_s']:10.1f} alerts/s, p50={_result['p50_ms']} ms, "
+                  f"p99={_result['p99_ms']} ms, rows={_result['rows']}, peak_rss={_result['peak_rss_mb']} MB")
+        if not keep:
+            _cleanup(BENCHMARK_CANDID_BASE, alerts)
+
+    # write result(s)
+    with open(f'{output}.json', 'w') as _f:
+        json.dump({'seed': seed, 'avro_bytes': _bytes, 'results': results}, _f, indent=2)
+    with open(f'{output}.csv', 'w', newline='') as _f:
+        _writer = csv.DictWriter(_f, fieldnames=list(results[0].keys()) if results else ['mode'])
+        _writer.writeheader()
+        _writer.writerows(results)
+    print(f'wrote {output}.json and {output}.csv')
+    return results
+
+
+# +
+# main()
+# -
+if __name__ == '__main__':
+
+    # get command line argument(s)
+    # noinspection PyTypeChecker
+    _parser = argparse.ArgumentParser(description='Benchmark ZTF alert ingest with synthetic packets',
+                                      formatter_class=argparse.RawTextHelpFormatter)
+    _parser.add_argument('--alerts', default=BENCHMARK_ALERTS, type=int,
+                         help="""number of synthetic alerts, defaults to %(default)s""")
+    _parser.add_argument('--modes', default=','.join(BENCHMARK_MODES),
+                         help="""comma-separated ingest path(s), defaults to %(default)s""")
+    _parser.add_argument('--batch-size', default=BENCHMARK_BATCH_SIZE, type=int,
+                         help="""alerts per batch for batched path(s), defaults to %(default)s""")
+    _parser.add_argument('--workers', default=BENCHMARK_WORKERS, type=int,
+                         help="""parser processes for gzip-pipelined, defaults to %(default)s""")
+    _parser.add_argument('--seed', default=BENCHMARK_SEED, type=int,
+                         help="""random seed, defaults to %(default)s""")
+    _parser.add_argument('--output', default=BENCHMARK_OUTPUT,
+                         help="""output file prefix (.json and .csv are appended), defaults to %(default)s""")
+    _parser.add_argument('--keep', default=False, action='store_true',
+                         help="""if present, keep the synthetic rows after the last path""")
+    args = _parser.parse_args()
+
+    # execute
+    if args.alerts > 0:
+        benchmark(args.alerts, [_m.strip() for _m in args.modes.split(',') if _m.strip()], args.batch_size,
+                  args.workers, args.seed, args.output, args.keep)
+    else:
+        print(f'<<ERROR>> Insufficient command line arguments specified\nUse: python3 {sys.argv[0]} --help')
@@ -17,6 +17,7 @@ from bs4 import BeautifulSoup
 from bs4.dammit import EncodingDetector
 from datetime import datetime
 from src.models.ligo_q3c import LigoQ3cRecord
+from src.table_stats import notify_stats
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
@@ -785,6 +786,9 @@ def ligo_q3c_scrape(url=DEFAULT_BASE_URL, credentials=DEFAULT_CREDENTIALS,
                         if verbose:
                             _log.error(f"Failed to insert record for {_name} into database, error={e}")
 
+    # tell the web app (response cache, table statistics) that the table changed
+    notify_stats(session, LigoQ3cRecord.__tablename__, seconds=0)
+
     # close
     session.close()
     session.close_all()
@@ -4,7 +4,6 @@
 # +
 # import(s)
 # -
-from astropy.time import Time
 from datetime import datetime
 from datetime import timedelta
 
@@ -15,6 +14,8 @@ from src.common import *
 from src.utils.Alerce import *
 from src.utils.utils import *
 from src.utils.avro_plot import avro_plot
+from src.time_utils import isot_to_jd
+from src.time_utils import jd_to_isot
 
 import argparse
 import os
@@ -34,20 +35,12 @@ def get_iso(offset=0):
         return None
 
 
-# noinspection PyBroadException
 def iso_to_jd(_iso=''):
-    try:
-        return float(Time(_iso).mjd)+2400000.5
-    except Exception:
-        return float(math.nan)
+    return isot_to_jd(_iso)
 
 
-# noinspection PyBroadException
 def jd_to_iso(_jd=0.0):
-    try:
-        return Time(_jd, format='jd', precision=6).isot
-    except Exception:
-        return None
+    return jd_to_isot(_jd)
 
 
 # noinspection PyBroadException
@@ -140,9 +133,7 @@ def sassy_bot_read(_radius=RADIUS, _begin=BEGIN_ISO, _end=END_ISO, _rb_min=RB_MI
 
     # create new view
     _cmd_view = f'CREATE OR REPLACE VIEW sassy_bot ("objectId", jd, drb, rb, sid, candid, ssnamenr, ra, dec) ' \
-                f'AS WITH e AS (SELECT "objectId", jd, rb, drb, id, candid, ssnamenr, ' \
-                f'(CASE WHEN ST_X(ST_AsText(location)) < 0.0 THEN ST_X(ST_AsText(location))+360.0 ELSE ' \
-                f'ST_X(ST_AsText(location)) END), ST_Y(ST_AsText(location)) FROM alert WHERE ' \
+                f'AS WITH e AS (SELECT "objectId", jd, rb, drb, id, candid, ssnamenr, ra, dec FROM alert WHERE ' \
                 f'(("objectId" LIKE \'%ZTF2%\') AND (jd BETWEEN {_begin_jd} AND {_end_jd}) AND ' \
                 f'((rb BETWEEN {_rb_min} AND {_rb_max}) OR (drb BETWEEN {_rb_min} AND {_rb_max})))) SELECT * FROM e;'
     if _logger:
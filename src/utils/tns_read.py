@@ -8,6 +8,7 @@ from astropy.coordinates import Angle
 from astropy.coordinates import SkyCoord
 from datetime import datetime, timedelta
 from src.models.tns import TnsRecord
+from src.table_stats import notify_stats
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
@@ -221,6 +222,9 @@ def read_tns(_file=''):
                         session.rollback()
                         session.commit()
 
+    # tell the web app (response cache, table statistics) that the table changed
+    notify_stats(session, TnsRecord.__tablename__, seconds=0)
+
     # return
     session.close()
     session.close_all()
@@ -20,6 +20,7 @@ from bs4.dammit import EncodingDetector
 from datetime import datetime
 from datetime import timedelta
 from src.models.tns import TnsRecord
+from src.table_stats import notify_stats
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
@@ -840,6 +841,9 @@ def tns_scrape(login=DEFAULT_LOGIN_URL, credentials=DEFAULT_CREDENTIALS, number=
                 session.rollback()
                 session.commit()
 
+    # tell the web app (response cache, table statistics) that the table changed
+    notify_stats(session, TnsRecord.__tablename__, seconds=0)
+
     # close
     session.close()
     session.close_all()